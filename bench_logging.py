@@ -0,0 +1,107 @@
+"""Benchmark how long an error storm blocks the event loop, with direct and with queued logging.
+
+    python bench_logging.py [--errors 20000] [--channels 500] [--output /dev/null]
+
+"direct" formats and writes every record on the loop, as a plain StreamHandler would;
+"queued" is bot.py's setup: rate limited on the loop, formatted and written by a
+listener thread. A probe task sleeps PROBE_INTERVAL at a time and records how late it
+wakes up while the storm runs.
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the benchmark's events out of the real log
+
+import argparse
+import asyncio
+import atexit
+import logging
+import time
+
+import bot as nightlobby
+
+PROBE_INTERVAL = 0.005  # Seconds
+STORM_BATCH = 50  # Errors logged between yields to the loop
+
+
+class CountingStream:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count('\n')
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def direct_logging(stream):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(nightlobby.JsonFormatter())
+    logging.getLogger().handlers[:] = [handler]
+
+
+def queued_logging(stream):
+    return nightlobby.setup_logging(stream=stream)
+
+
+def stop_listener(listener):
+    listener.stop()  # Drains the queue, so the written count is complete
+    atexit.unregister(listener.stop)
+
+
+async def storm(errors, channels):
+    logger = logging.getLogger('bot')
+    try:
+        raise RuntimeError("503 Service Unavailable (error code: 0): upstream connect error")
+    except RuntimeError:
+        for i in range(errors):
+            logger.error("Error sending message to channel %s", i % channels, exc_info=True,
+                         extra={'lobby': i % channels, 'guild': 1})
+            if i % STORM_BATCH == 0:
+                await asyncio.sleep(0)
+
+
+async def probe(lags, done):
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(loop.time() - started - PROBE_INTERVAL)
+
+
+async def run(label, configure, args):
+    stream = CountingStream(args.output)
+    listener = configure(stream)
+    lags, done = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, done))
+    await asyncio.sleep(PROBE_INTERVAL * 2)
+    started = time.perf_counter()
+    await storm(args.errors, args.channels)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe_task
+    if listener is not None:
+        stop_listener(listener)
+    lags.sort()
+    print(f"{label:<8} {elapsed * 1000:>9.1f} {lags[len(lags) // 2] * 1000:>9.2f} "
+          f"{lags[int(len(lags) * 0.99)] * 1000:>9.2f} {lags[-1] * 1000:>9.2f} {stream.lines:>9}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--errors', type=int, default=20000)
+    parser.add_argument('--channels', type=int, default=500, help="Distinct channels the errors mention")
+    parser.add_argument('--output', default='/dev/null', help="Where the log lines are written")
+    args = parser.parse_args()
+
+    stop_listener(nightlobby.log_listener)
+    print(f"{args.errors} errors with tracebacks over {args.channels} channels")
+    print(f"{'mode':<8} {'storm ms':>9} {'p50 lag':>9} {'p99 lag':>9} {'max lag':>9} {'written':>9}")
+    await run("direct", direct_logging, args)
+    await run("queued", queued_logging, args)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
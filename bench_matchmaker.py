@@ -0,0 +1,82 @@
+"""Benchmark one matchmaker pass over a synthetic queue and set of open lobbies.
+
+    python bench_matchmaker.py [--players 5000] [--lobbies 1000] [--runs 5]
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the benchmark's events out of the real log
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import bot as nightlobby
+
+PLATFORMS = (None, 'pc', 'ps5', 'xbox')
+REGIONS = (None, 'eu', 'na', 'asia')
+
+
+def synthetic(players, lobbies, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    entries = [
+        {
+            'user_id': i,
+            'queued_at': now - timedelta(seconds=rng.uniform(0, nightlobby.MATCH_QUEUE_TIMEOUT)),
+            'prefs': {'platform': rng.choice(PLATFORMS), 'region': rng.choice(REGIONS)},
+        }
+        for i in range(players)
+    ]
+    open_lobbies = [
+        {
+            'channel': 10**6 + j,
+            'players': list(range(rng.randint(1, nightlobby.MAX_PLAYERS - 1))),
+            'created_at': now - timedelta(minutes=rng.uniform(0, 120)),
+            'platform': rng.choice(PLATFORMS),
+            'region': rng.choice(REGIONS),
+        }
+        for j in range(lobbies)
+    ]
+    return entries, open_lobbies, now
+
+
+def check(matches, entries, lobbies):
+    by_user = {e['user_id']: e for e in entries}
+    by_channel = {lobby['channel']: lobby for lobby in lobbies}
+    seats = {c: nightlobby.free_seats(lobby) for c, lobby in by_channel.items()}
+    assert len({user_id for user_id, _ in matches}) == len(matches), "player seated twice"
+    for user_id, channel_id in matches:
+        seats[channel_id] -= 1
+        assert seats[channel_id] >= 0, "lobby overfilled"
+        assert nightlobby.match_affinity(by_user[user_id]['prefs'], by_channel[channel_id]) is not None, "conflict"
+
+
+def bench(label, entries, lobbies, now, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        matches = nightlobby.solve_matches(entries, lobbies, now)
+        timings.append(time.perf_counter() - started)
+    check(matches, entries, lobbies)
+    print(f"{label:<12} {len(matches):>6} seated   best {min(timings) * 1000:8.1f} ms   "
+          f"mean {sum(timings) / len(timings) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--lobbies', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    entries, lobbies, now = synthetic(args.players, args.lobbies, args.seed)
+    free = sum(nightlobby.free_seats(lobby) for lobby in lobbies)
+    print(f"{args.players} queued players, {args.lobbies} open lobbies, {free} free seats")
+
+    bench("greedy", entries, lobbies, now, args.runs)
+
+
+if __name__ == '__main__':
+    main()
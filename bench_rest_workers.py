@@ -0,0 +1,151 @@
+"""Benchmark command latency while a background REST spike runs, inline and with REST workers.
+
+    python bench_rest_workers.py [--channels 2000] [--workers 2] [--commands 100] [--rest-latency 0.02] [--job-cpu 2]
+
+Runs create_game and leave_lobby against replay.py's in-memory Discord while a restart-style
+broadcast and an activity lookup fan out over --channels channels through run_rest_jobs.
+Background jobs are simulated: each waits --rest-latency and then spends --job-cpu ms decoding
+JSON, which stands in for the response handling and model building discord.py does per request.
+"inline" runs those jobs on the bot's loop, "workers" hands them to --workers processes over
+the same queues start_rest_workers uses. "idle" is the baseline without a spike.
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the benchmark's events out of the real log
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import threading
+import time
+
+import bot as nightlobby
+import replay
+from replay import FakeContext, FakeREST, FakeWorld, default_flags
+
+GUILD = 1
+PAYLOAD = json.dumps([{'id': str(i), 'content': 'x' * 200, 'author': {'id': str(i), 'bot': False},
+                       'embeds': [], 'attachments': []} for i in range(50)])
+
+
+async def simulated_job(client, kind, **args):
+    """Stand-in for perform_rest_job: REST latency, then the CPU cost of handling the response"""
+    await asyncio.sleep(args['latency'])
+    deadline = time.perf_counter() + args['cpu']
+    while time.perf_counter() < deadline:
+        json.loads(PAYLOAD)
+    return None
+
+
+async def run_simulated_worker(jobs, results):
+    loop = asyncio.get_running_loop()
+
+    async def consume():
+        while True:
+            job = await loop.run_in_executor(None, jobs.get)
+            if job is None:
+                return
+            await simulated_job(None, job['kind'], **job['args'])
+            results.put((job['id'], True, None))
+
+    await asyncio.gather(*(consume() for _ in range(nightlobby.REST_WORKER_TASKS)))
+
+
+def simulated_worker_main(jobs, results):
+    asyncio.run(run_simulated_worker(jobs, results))
+
+
+def start_simulated_workers(count):
+    """start_rest_workers, with workers that run simulated_job instead of logging in"""
+    context = multiprocessing.get_context('spawn')
+    nightlobby.rest_jobs = context.Queue()
+    nightlobby.rest_results = context.Queue()
+    for i in range(count):
+        worker = context.Process(target=simulated_worker_main, args=(nightlobby.rest_jobs, nightlobby.rest_results),
+                                 name=f'rest-worker-{i}', daemon=True)
+        worker.start()
+        nightlobby.rest_workers.append(worker)
+    drain = threading.Thread(target=nightlobby.drain_rest_results,
+                             args=(asyncio.get_running_loop(), nightlobby.rest_results), daemon=True)
+    drain.start()
+    return drain
+
+
+async def warm_up_workers():
+    # Spawned workers take a while to import bot.py; wait until every one answers
+    await nightlobby.run_rest_jobs('send', [{'channel_id': 0, 'latency': 0.2, 'cpu': 0}] * len(nightlobby.rest_workers) * 4)
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.world = FakeWorld(FakeREST(args.rest_latency))
+        self.world.install()
+        nightlobby.bot.process_commands = replay._noop
+        category = nightlobby.guild_config(GUILD)['lobby_category']
+        self.world.load_ready({'guilds': [{'id': GUILD, 'categories': [category], 'channels': [
+            {'id': replay.next_id(), 'name': 'general', 'cat': None, 'guild': GUILD}]}]})
+        self.guild = self.world.guild(GUILD)
+        self.general = self.guild.text_channels[0]
+        self.members = [self.world.member(self.guild, {'id': 10_000 + i}) for i in range(args.commands)]
+
+    async def run_command(self, command, member, channel, **kwargs):
+        started = time.perf_counter()
+        await command.callback(FakeContext(self.world, command, member, channel), **kwargs)
+        return time.perf_counter() - started
+
+    async def commands(self):
+        """Create and leave a lobby per member, one after another; latencies of every command"""
+        latencies = []
+        for member in self.members:
+            latencies.append(await self.run_command(nightlobby.create_game, member, self.general,
+                                                    details=default_flags(nightlobby.CreateFlags)))
+            channel = self.world.get_channel(nightlobby.user_sessions.get(member.id))
+            if channel is not None:
+                latencies.append(await self.run_command(nightlobby.leave_lobby, member, channel))
+        return latencies
+
+    async def spike(self):
+        jobs = [{'channel_id': i, 'latency': self.args.rest_latency, 'cpu': self.args.job_cpu / 1000}
+                for i in range(self.args.channels)]
+        await asyncio.gather(nightlobby.run_rest_jobs('send', jobs), nightlobby.run_rest_jobs('last_activity', jobs))
+
+    async def run(self, label, with_spike):
+        spike = asyncio.create_task(self.spike()) if with_spike else None
+        started = time.perf_counter()
+        latencies = sorted(await self.commands())
+        elapsed = time.perf_counter() - started
+        if spike is not None:
+            await spike
+        print(f"{label:<8} {latencies[len(latencies) // 2] * 1000:>9.1f} {latencies[int(len(latencies) * 0.99)] * 1000:>9.1f} "
+              f"{latencies[-1] * 1000:>9.1f} {elapsed:>9.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=2000, help="Channels the background spike fans out over")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--commands', type=int, default=100, help="Lobbies created and left per run")
+    parser.add_argument('--rest-latency', type=float, default=0.02, help="Seconds per simulated REST call")
+    parser.add_argument('--job-cpu', type=float, default=2.0, help="Milliseconds of CPU per background job")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    nightlobby.perform_rest_job = simulated_job
+    bench = Bench(args)
+    print(f"{args.commands} create + leave pairs; spike of 2 x {args.channels} jobs at {args.job_cpu:g}ms CPU each, "
+          f"{nightlobby.REST_JOB_CONCURRENCY} in flight per batch")
+    print(f"{'mode':<8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'total s':>9}")
+    await bench.run("idle", False)
+    await bench.run("inline", True)
+    drain = start_simulated_workers(args.workers)
+    await warm_up_workers()
+    await bench.run("workers", True)
+    nightlobby.stop_rest_workers()
+    drain.join(timeout=5)  # Reads the stop marker before the queues are torn down at exit
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
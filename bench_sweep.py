@@ -0,0 +1,73 @@
+"""Benchmark the inactive-lobby sweep per shard as the number of guilds grows.
+
+    python bench_sweep.py [--guilds 10 100 1000] [--shards 16] [--lobbies 5] [--channels 20]
+
+Runs against replay.py's in-memory Discord with no REST latency, so the numbers are the
+bot's own CPU cost per sweep.
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the benchmark's events out of the real log
+
+import argparse
+import asyncio
+import time
+
+import bot as nightlobby
+from replay import FakeREST, FakeWorld, next_id
+
+
+def build_world(guilds, shards, lobbies, channels):
+    nightlobby.clear_lobbies()
+    nightlobby.user_sessions.clear()
+    world = FakeWorld(FakeREST())
+    world.install()
+    for gid in range(1, guilds + 1):
+        guild = world.guild(gid)
+        guild.shard_id = gid % shards
+        category = nightlobby.guild_config(gid)['lobby_category']
+        for i in range(channels):
+            world.channel({'id': next_id(), 'name': f"chat-{i}", 'cat': None, 'guild': gid})
+        for i in range(lobbies):
+            channel = world.channel({'id': next_id(), 'name': f"lobby-{gid}-{i}", 'cat': category, 'guild': gid})
+            owner = world.member(guild, {'id': next_id()})
+            nightlobby.register_lobby({
+                'owner': owner.id, 'players': [owner.id], 'channel': channel.id, 'guild': gid,
+                'created_at': nightlobby.datetime.utcnow(), 'hash': str(channel.id), 'hash_message_id': None,
+            })
+    started = time.perf_counter()
+    nightlobby.build_lobby_channel_index()
+    return time.perf_counter() - started
+
+
+async def timed(coro, runs):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        await coro()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--lobbies', type=int, default=5, help="Lobbies per guild")
+    parser.add_argument('--channels', type=int, default=20, help="Other text channels per guild")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'guilds':>7} {'lobbies':>8} {'index ms':>9} {'shard 0 lobbies':>16} {'shard 0 sweep ms':>17} {'all shards ms':>14}")
+    for guilds in args.guilds:
+        index_time = build_world(guilds, args.shards, args.lobbies, args.channels)
+        shard_lobbies = len(nightlobby.iter_lobby_channels(0))
+        shard_time = await timed(lambda: nightlobby.sweep_shard(0), args.runs)
+        all_time = await timed(nightlobby.cleanup_inactive_lobbies.coro, args.runs)
+        print(f"{guilds:>7} {len(nightlobby.active_lobbies):>8} {index_time * 1000:>9.1f} {shard_lobbies:>16} "
+              f"{shard_time * 1000:>17.2f} {all_time * 1000:>14.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
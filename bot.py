@@ -1,29 +1,256 @@
+import time
+
+# Cold-start timing starts before the heavy imports
+PROCESS_STARTED = time.perf_counter()
+
 import discord
 from discord.ext import commands, tasks
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
+import logging.handlers
 import os
 from dotenv import load_dotenv
 import re
 import json
 import uuid
+import queue
+import random
+import atexit
+import threading
+import multiprocessing
+import itertools
+import heapq
+import sys
+import traceback
+import weakref
+import copy
+import functools
+import contextvars
+import hashlib
+import gzip
+import shutil
+import tracemalloc
+from collections import OrderedDict, Counter, deque
+from bisect import bisect_right
+from typing import Optional
+from lobby_events import LobbyStats, rebuild_lobby_stats, format_duration, format_rate
+from aiohttp import web
+
+try:
+    import fcntl
+except ImportError:  # Standby failover needs flock; other platforms run without it
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Logging: warnings and errors are rate limited, every record is queued on the event
+# loop, then formatted as JSON and written by a listener thread so I/O never blocks the loop
+LOG_RATE_LIMIT = 5  # Warnings/errors allowed per sample key per window
+LOG_RATE_WINDOW = 60  # Seconds
+LOG_FIELDS = ('lobby', 'guild', 'command', 'user')
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Let through LOG_RATE_LIMIT warnings/errors per key per window and count the rest.
+
+    The key is the record's `sample_key` extra if given, otherwise the unformatted
+    message template, so a storm of per-channel errors collapses into one key. Records
+    below WARNING always pass. flush() reports what was suppressed in finished windows.
+    """
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.buckets = {}  # key -> [window_start, emitted, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or getattr(record, 'suppressed', 0):
+            return True
+        key = getattr(record, 'sample_key', None) or (record.name, record.levelno, record.msg)
+        now = record.created
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                record.suppressed = bucket[2] if bucket else 0
+                self.buckets[key] = [now, 1, 0]
+                return True
+            if bucket[1] < self.limit:
+                bucket[1] += 1
+                return True
+            bucket[2] += 1
+            return False
+
+    def flush(self, now=None):
+        """Log a summary for every finished window that suppressed records, and forget it"""
+        now = time.time() if now is None else now
+        with self.lock:
+            finished = [(key, bucket[2]) for key, bucket in self.buckets.items() if now - bucket[0] >= self.window]
+            for key, _ in finished:
+                del self.buckets[key]
+        for key, suppressed in finished:
+            if suppressed:
+                name, level, template = key if isinstance(key, tuple) else ('bot', logging.WARNING, key)
+                logging.getLogger(name).log(level, "%d more like this were suppressed: %s", suppressed, template,
+                                            extra={'suppressed': suppressed})
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() formats the record on the logging thread and folds the traceback
+    into msg; here only the message is resolved, and exc_info travels with the record,
+    which the in-process queue passes without pickling.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def flush_suppressed(rate_filter, stop):
+    while not stop.wait(rate_filter.window):
+        rate_filter.flush()
+
+def setup_logging(level=logging.INFO, stream=None):
+    """Route all logging through a QueueHandler drained by a background QueueListener"""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(JsonFormatter())
+    queue_handler = LoopQueueHandler(log_queue)
+    rate_filter = RateLimitFilter()
+    queue_handler.addFilter(rate_filter)
+    # Without this, the suppressed count of a storm that stopped would never be reported
+    stop_flushing = threading.Event()
+    threading.Thread(target=flush_suppressed, args=(rate_filter, stop_flushing), daemon=True,
+                     name='log-rate-flush').start()
+    atexit.register(stop_flushing.set)
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
+# Event recorder (opt-in): set RECORD_EVENTS to a file path to append the gateway
+# events and commands we handle as compact JSON lines, replayable with replay.py
+RECORD_EVENTS = os.getenv('RECORD_EVENTS')
+RECORD_MAX_BYTES = int(os.getenv('RECORD_MAX_BYTES', 50 * 1024 * 1024))
+RECORD_BACKUPS = int(os.getenv('RECORD_BACKUPS', 5))
+recorder = logging.getLogger('nightlobby.recorder')
+recorder.propagate = False
+record_started = time.monotonic()
+
+def setup_recorder(path):
+    """Write recorded events to a rotating file from a listener thread"""
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=RECORD_MAX_BYTES, backupCount=RECORD_BACKUPS, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    record_queue = queue.SimpleQueue()
+    recorder.addHandler(LoopQueueHandler(record_queue))
+    recorder.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(record_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+if RECORD_EVENTS:
+    setup_recorder(RECORD_EVENTS)
+
+# Lobby event log: append-only JSON lines of lobby lifecycle and matchmaking events,
+# rotated and gzipped locally. Set LOBBY_EVENT_LOG to an empty string to disable it
+LOBBY_EVENT_LOG = os.getenv('LOBBY_EVENT_LOG', 'lobby_events.log')
+LOBBY_EVENT_LOG_MAX_BYTES = int(os.getenv('LOBBY_EVENT_LOG_MAX_BYTES', 20 * 1024 * 1024))
+LOBBY_EVENT_LOG_BACKUPS = int(os.getenv('LOBBY_EVENT_LOG_BACKUPS', 30))
+event_log = logging.getLogger('nightlobby.events')
+event_log.propagate = False
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def setup_event_log(path):
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOBBY_EVENT_LOG_MAX_BYTES, backupCount=LOBBY_EVENT_LOG_BACKUPS, encoding='utf-8'
+    )
+    file_handler.namer = lambda name: name + '.gz'
+    file_handler.rotator = gzip_rotator
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    event_queue = queue.SimpleQueue()
+    event_log.addHandler(LoopQueueHandler(event_queue))
+    event_log.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(event_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+if LOBBY_EVENT_LOG:
+    setup_event_log(LOBBY_EVENT_LOG)
+
+def record_event(kind, **fields):
+    if not RECORD_EVENTS:
+        return
+    entry = {'t': round(time.monotonic() - record_started, 3), 'e': kind}
+    entry.update(fields)
+    recorder.info(json.dumps(entry, separators=(',', ':'), ensure_ascii=False, default=str))
+
+def rec_user(user):
+    if user is None:
+        return None
+    return {'id': user.id, 'name': user.display_name, 'bot': user.bot}
+
+def rec_channel(channel):
+    if channel is None or getattr(channel, 'guild', None) is None:
+        return None
+    return {'id': channel.id, 'name': getattr(channel, 'name', None),
+            'cat': getattr(channel, 'category_id', None), 'guild': channel.guild.id}
+
+def rec_value(value):
+    """Serialize a converted command argument so the replayer can rebuild it"""
+    if isinstance(value, (discord.Member, discord.User)):
+        return {'member': rec_user(value)}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [rec_value(v) for v in value]
+    if isinstance(value, commands.FlagConverter):
+        return {'flags': {name: rec_value(v) for name, v in value}}
+    return str(value)
+
 # Bot configuration
+AUTO_SHARD = os.getenv('AUTO_SHARD', '').lower() in ('1', 'true', 'yes')  # One gateway connection per shard
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
-bot = commands.Bot(command_prefix='/', intents=intents, help_command=None)
+intents.members = True  # Privileged: member join/update/remove events keep welcomes and cached names current
+# Members are cached as they show up rather than chunked up front, so startup doesn't wait on large guilds
+bot = (commands.AutoShardedBot if AUTO_SHARD else commands.Bot)(command_prefix='/', intents=intents, help_command=None,
+                                                               chunk_guilds_at_startup=False)
 
 # In-memory storage for active lobbies
 active_lobbies = {}
@@ -32,9 +259,1553 @@ empty_lobby_timers = {}  # Track empty lobby timers
 pending_requests = {}  # Store pending match requests
 request_timeouts = {}  # Store request timeout tasks
 
+# Display name cache: (guild_id, user_id) -> name, least recently used first
+NAME_CACHE_SIZE = 5000
+display_names = OrderedDict()
+name_fill_queue = {}  # guild_id -> set of user ids waiting for a fetch_member fill
+name_fill_tasks = {}  # guild_id -> running fill task
+NAME_FILL_BATCH = 10  # Max concurrent fetch_member calls per fill batch
+
+# Lobby concurrency: seats are claimed and released synchronously (no await between
+# the check and the change) and every change bumps the lobby's version. REST side
+# effects for one lobby are serialized on a striped lock, so different lobbies
+# never wait on each other
+MAX_PLAYERS = 3  # Seats in a lobby created without max_players
+MAX_PLAYERS_LIMIT = 8  # Largest max_players /create_game accepts
+PARTY_MAX_COMPANIONS = 2  # Friends that can join together with /join_party
+LOCK_STRIPES = 64
+lobby_lock_stripes = [asyncio.Lock() for _ in range(LOCK_STRIPES)]
+
+# Lobby search: inverted indexes over optional lobby attributes, the set of lobbies
+# with free seats (also bucketed per guild by how many are free), and every lobby's
+# channel id in creation (snowflake) order
+LOBBY_ATTRIBUTES = ('platform', 'region', 'style', 'start')
+lobby_attr_index = {attr: {} for attr in LOBBY_ATTRIBUTES}  # attr -> value -> set of channel ids
+open_lobbies = set()
+seat_buckets = {}  # (guild_id, free seats) -> set of open lobby channel ids
+lobby_seat_bucket = {}  # channel_id -> its key in seat_buckets
+lobby_order = []
+
+# Startup: per-phase cold-start timings, checked against a budget, and the
+# fingerprint of the last app-command tree we synced to Discord
+STARTUP_BUDGET = float(os.getenv('STARTUP_BUDGET', 30))  # Seconds from process start to tasks running
+COMMAND_TREE_HASH_FILE = os.getenv('COMMAND_TREE_HASH_FILE', '.command_tree.sha256')
+STARTUP_PHASES = ('import', 'login', 'ready', 'restore', 'tasks', 'sync')  # Reported once all have finished
+startup_timings = {}  # phase -> seconds spent in that phase; 'sync' runs alongside the others
+startup_last_mark = PROCESS_STARTED
+startup_reported = False
+command_sync_task = None
+
+# Guild settings: GUILD_CONFIG_FILE maps guild ids to settings and is read once at
+# startup; guilds without an entry use the defaults
+GUILD_CONFIG_FILE = os.getenv('GUILD_CONFIG_FILE', 'guild_config.json')
+DEFAULT_GUILD_CONFIG = {
+    'lobby_category': 1379101422318125159,
+    'lobby_role': 1242067709433217088,  # May end any lobby
+    'announcement_channel': 1242067710385590293,
+}
+guild_configs = {}  # guild_id -> settings merged over the defaults
+
+# Lobby channels: indexed by shard, guild and channel id, built once on ready and then
+# kept current from channel create/delete/update events. Lobby records are also
+# grouped by guild, so per-guild and per-shard work never scans other guilds
+lobby_channel_index = {}  # shard_id -> guild_id -> {channel_id: channel}
+guild_lobbies = {}  # guild_id -> set of lobby channel ids
+
+# Join messages: edits after seat changes are coalesced per lobby over this delay
+JOIN_REFRESH_DELAY = 1.0
+join_refresh_tasks = {}  # channel_id -> pending refresh task
+
+# REST workers: with REST_WORKERS > 0, background REST jobs (broadcasts, teardown,
+# restore and cleanup lookups) run in login-only worker processes fed over a
+# multiprocessing queue, and their results are applied back on this loop
+REST_WORKERS = int(os.getenv('REST_WORKERS', 0))
+REST_WORKER_TASKS = 4  # Jobs each worker process runs concurrently
+REST_JOB_TIMEOUT = float(os.getenv('REST_JOB_TIMEOUT', 60))  # Seconds before a worker job is given up on
+REST_JOB_CONCURRENCY = int(os.getenv('REST_JOB_CONCURRENCY', 8))  # Jobs of one batch in flight at once
+# Workers have their own discord.py clients, so this process's rate limiter never sees their
+# requests. The pool paces itself to REST_WORKER_RATE requests per second between all workers,
+# leaving the rest of Discord's global 50/s to this process
+REST_WORKER_RATE = float(os.getenv('REST_WORKER_RATE', 25))
+rest_worker_slot = None  # Shared multiprocessing.Value: monotonic time the pool's next request may start
+rest_workers = []
+rest_jobs = None
+rest_results = None
+rest_pending = {}  # job id -> future waiting for the result
+rest_job_ids = itertools.count(1)
+
+# REST health: one circuit breaker per route class. While a breaker is open, background
+# work on those routes (sweeps, announcements, fan-outs, welcome DMs) is paused or cut
+# down; commands keep going and serve as probes. Times are in seconds
+HEALTH_WINDOW = 60  # Outcomes older than this are forgotten
+HEALTH_MIN_CALLS = 10  # Calls in the window before a breaker can open
+HEALTH_ERROR_RATE = 0.25  # 429s, 5xx and transport errors
+HEALTH_SLOW = 2.0  # Median latency, including discord.py's own retries
+HEALTH_COOLDOWN = 30  # First pause; doubles each time a breaker reopens
+HEALTH_MAX_COOLDOWN = 300
+HEALTH_PROBES = 5  # Healthy calls in a row that close a half-open breaker
+DEGRADED_FANOUT = 3  # /find_match requests sent while messages are degraded
+JOB_ROUTE_CLASSES = {'send': 'messages', 'delete_channel': 'channels', 'last_activity': 'messages', 'find_hash': 'messages'}
+rest_health = {}  # route class -> breaker state, recent outcomes and cooldown
+degraded_skips = Counter()  # background work name -> runs skipped or cut down while degraded
+
+# Loop lag: a heartbeat samples scheduling lag and a side thread captures the loop
+# thread's stack while it is blocked. Thresholds are in seconds
+LAG_SAMPLE_INTERVAL = 0.5
+LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.25))
+LAG_REPORT_EVERY = 120  # Heartbeats between lag percentile log lines
+STALL_STACK_DEPTH = 8
+loop_lag = deque(maxlen=1200)  # Recent lag samples
+loop_stalls = deque(maxlen=50)  # Recent stalls over the threshold
+loop_heartbeat = None
+pending_stall = None  # Stall captured by the watchdog, waiting for the loop to resume
+task_labels = weakref.WeakKeyDictionary()  # task -> command or task loop it is running
+lag_watchdog_task = None
+
+# Profiler: off unless a moderator asks for a command or task; samples are taken by a
+# side thread and written as collapsed stacks that flamegraph tools read directly
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+profile_requests = {}  # label -> aggregated samples and timings for that label
+profile_sessions = weakref.WeakKeyDictionary()  # task -> the invocation it is profiling
+profile_context = contextvars.ContextVar('profile_session', default=None)  # REST calls find their invocation here
+profile_lock = threading.Lock()  # Guards sample counters shared with the sampler thread
+
+# Matchmaker: `/find_match auto: yes` queues a player, and every tick the queue is
+# matched against open lobbies in one batch per guild
+MATCH_TICK = 10  # Seconds between matchmaker passes
+MATCH_QUEUE_TIMEOUT = 15 * 60  # Seconds a player stays queued
+MATCH_AFFINITY = ('platform', 'region')
+MATCH_SEAT_WEIGHT = 1.0  # Cost per free seat, so nearly full lobbies fill first
+MATCH_AGE_WEIGHT = 0.1  # Credit per minute of lobby age, so older lobbies fill first
+MATCH_AFFINITY_WEIGHT = 2.0  # Cost when only one side names a platform/region
+match_queue = OrderedDict()  # user_id -> queue entry, oldest first
+
+# Waitlists: players who hit a full lobby queue for its next free seat, one lobby at a time
+WAITLIST_SIZE = 5  # Players waiting per lobby
+lobby_waitlists = {}  # channel_id -> OrderedDict of user_id -> channel id to notify on promotion
+user_waitlist = {}  # user_id -> channel_id of the lobby they are waiting for
+waitlist_promoters = {}  # channel_id -> the one promote_waitlist task seating that lobby's waitlist
+
+# Permission reconciler: seat changes made while an overwrite edit is queued share the next one
+pending_overwrites = {}  # channel_id -> future resolved when the queued channel.edit(overwrites=...) lands
+overwrite_edits = Counter()  # 'applied' | 'unchanged' | 'coalesced' -> reconciles
+
+# Duplicate commands: the same command with the same arguments from the same user in the
+# same channel is coalesced while it runs and answered without rerunning for a short window
+# after it finishes. Commands whose target is implicit (e.g. /allow takes the newest request
+# in the channel) are not coalesced, since a repeat may mean a different target
+IDEMPOTENCY_WINDOW = 5  # Seconds
+inflight_ops = {}  # (user_id, channel_id, command, arguments) -> future done when the command finishes
+recent_ops = OrderedDict()  # (user_id, channel_id, command, arguments) -> monotonic finish time, oldest first
+command_calls = Counter()  # command -> invocations seen by coalesce_per_user
+absorbed_duplicates = Counter()  # (command, 'in flight' | 'just finished') -> duplicates dropped
+
+# Memory: entries pointing at a lobby or channel that is gone are evicted once they have
+# been orphaned for ORPHAN_TTL, and resident memory is checked against an optional budget
+ORPHAN_TTL = 600  # Seconds; covers a channel briefly missing from the cache
+MATCH_REQUEST_TTL = 300  # Seconds a /find_match request stays answerable
+MEMORY_BUDGET_MB = float(os.getenv('MEMORY_BUDGET_MB', 0))  # 0 disables the budget warning
+MEMORY_TRACKED = (
+    'active_lobbies', 'user_sessions', 'pending_requests', 'request_timeouts', 'display_names', 'name_fill_queue',
+    'lobby_attr_index', 'open_lobbies', 'lobby_order', 'guild_lobbies', 'lobby_channel_index', 'guild_configs',
+    'join_refresh_tasks', 'match_queue', 'lobby_waitlists', 'user_waitlist', 'waitlist_promoters', 'pending_overwrites',
+    'inflight_ops', 'recent_ops', 'rest_pending', 'rest_health', 'orphaned_since',
+)
+orphaned_since = {}  # (structure, key) -> monotonic time the entry was first seen orphaned
+evicted_entries = Counter()  # structure -> entries evicted
+memory_over_budget = False
+
+# Bulk moderator operations
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', 16))  # Lobbies worked on at once
+BULK_PROGRESS_INTERVAL = 2  # Seconds between progress message edits
+BULK_END_GRACE = 10  # Seconds between the end notice and deleting the channels
+BULK_PREVIEW = 15  # Lobbies listed in a dry run
+
+# Auditor: lobbies are re-checked against Discord round-robin, a few per tick, spending at
+# most AUDIT_REST_BUDGET REST calls a minute; a repair that overruns a tick is paid back
+# from the next one, and unused calls don't carry over
+AUDIT_TICK = 10  # Seconds
+AUDIT_REST_BUDGET = int(os.getenv('AUDIT_REST_BUDGET', 30))  # REST calls per minute; 0 disables the auditor
+AUDIT_SLICE = int(os.getenv('AUDIT_SLICE', 5))  # Most lobbies checked per tick
+AUDIT_CHECKS = ('channel', 'overwrites', 'hash_message', 'join_message')
+audit_cursor = 0  # Channel id of the last lobby audited; the next tick starts after it
+audit_tokens = 0.0  # REST calls left this tick
+audit_checked = Counter()  # check -> lobbies checked
+audit_drift = Counter()  # check -> drift found and repaired
+audit_rest_calls = Counter()  # 'read' | 'repair' -> REST calls made by the auditor
+audit_pass = {'started': None, 'lobbies': 0, 'drift': 0}  # The round-robin pass in progress
+last_audit_pass = None  # (lobbies, seconds, drift) of the last finished pass
+lobbies_setting_up = set()  # channel_ids create_game has registered but not yet sent the hash message to
+
+# Snapshot API: with SNAPSHOT_API_PORT set, GET /lobbies serves every lobby's seats and the
+# queue sizes per guild as JSON. The body is rebuilt only after state_version changes (at
+# most every SNAPSHOT_MIN_INTERVAL) and carries an ETag, so an unchanged poll gets a bare 304
+SNAPSHOT_API_HOST = os.getenv('SNAPSHOT_API_HOST', '127.0.0.1')
+SNAPSHOT_API_PORT = int(os.getenv('SNAPSHOT_API_PORT', 0))  # 0 disables the API
+SNAPSHOT_MIN_INTERVAL = 1.0  # Seconds between rebuilds while the state keeps changing
+state_version = 0  # Bumped on every lobby, seat, waitlist and match queue change
+snapshot_boot = uuid.uuid4().hex[:12]  # Part of every ETag, so tags from a previous run never match
+snapshot_cache = None  # (state_version, etag, body, gzipped body)
+snapshot_built_at = 0.0  # Monotonic time of the last rebuild
+snapshot_lock = asyncio.Lock()
+snapshot_runner = None
+
+# Standby: with STATE_DIR set, lobby changes are journaled next to a periodic snapshot.
+# Every instance loads that state and follows the journal until it can take the
+# primary lock, then connects with the state it already has
+STATE_DIR = os.getenv('STATE_DIR', '')
+STATE_SNAPSHOT_EVERY = 1000  # Journal entries between snapshots
+STANDBY_POLL = 0.2  # Seconds between journal reads and lock attempts while standing by
+LOBBY_TIME_FIELDS = ('created_at', 'last_activity')
+journal_queue = None  # Lines and snapshots for the journal writer thread while this instance is primary
+journal_thread = None
+state_seq = 0
+state_snapshot_seq = 0
+standby_loaded = False  # Lobby state came from a snapshot; on_ready keeps it
+takeover_started = None
+
 # Steam friend code pattern (9-10 digits, can be within text)
 STEAM_CODE_PATTERN = r'(?:^|\s|:)(\d{9,10})(?:\s|$|\.|,|!|\?)'
 
+def remember_name(guild_id, user, name=None):
+    """Store a user's display name for a guild, evicting the least recently used entry"""
+    key = (guild_id, user.id)
+    display_names[key] = name or user.display_name
+    display_names.move_to_end(key)
+    while len(display_names) > NAME_CACHE_SIZE:
+        display_names.popitem(last=False)
+
+def forget_name(guild_id, user_id):
+    display_names.pop((guild_id, user_id), None)
+
+def display_name(guild, user_id):
+    """Resolve a player's name from caches only; misses are filled in the background"""
+    guild_id = guild.id if guild else None
+    key = (guild_id, user_id)
+    name = display_names.get(key)
+    if name is not None:
+        display_names.move_to_end(key)
+        return name
+    member = guild.get_member(user_id) if guild else None
+    if member is not None:
+        remember_name(guild_id, member)
+        return member.display_name
+    user = bot.get_user(user_id)
+    if guild is None and user is not None:
+        remember_name(guild_id, user)
+        return user.display_name
+    if guild is not None:
+        queue_name_fill(guild, user_id)
+    return user.display_name if user else "Unknown"
+
+def player_names(guild, user_ids):
+    return [display_name(guild, pid) for pid in user_ids]
+
+def queue_name_fill(guild, user_id):
+    """Queue a guild member for a batched fetch_member fill"""
+    name_fill_queue.setdefault(guild.id, set()).add(user_id)
+    task = name_fill_tasks.get(guild.id)
+    if task is None or task.done():
+        try:
+            name_fill_tasks[guild.id] = asyncio.get_running_loop().create_task(fill_names(guild))
+        except RuntimeError:
+            pass  # No running loop (e.g. at import time); the next render will retry
+
+async def fill_names(guild):
+    """Fetch queued members in small concurrent batches and cache their names"""
+    while name_fill_queue.get(guild.id):
+        pending = name_fill_queue.pop(guild.id)
+        batch = [pending.pop() for _ in range(min(NAME_FILL_BATCH, len(pending)))]
+        if pending:
+            name_fill_queue.setdefault(guild.id, set()).update(pending)
+        results = await asyncio.gather(*(guild.fetch_member(uid) for uid in batch), return_exceptions=True)
+        for uid, member in zip(batch, results):
+            if not isinstance(member, BaseException):
+                remember_name(guild.id, member)
+            elif isinstance(member, discord.NotFound):
+                # Not a member anymore; cache the global name so we don't refetch on every render
+                user = bot.get_user(uid)
+                remember_name(guild.id, user or discord.Object(id=uid), user.display_name if user else "Unknown")
+            # Any other failure (5xx, timeouts) leaves the name unfilled, so the next render queues it again
+    name_fill_tasks.pop(guild.id, None)
+
+class SeatUnavailable(Exception):
+    """A seat could not be claimed; the message is safe to show to users"""
+
+class LobbyFull(SeatUnavailable):
+    pass
+
+def lobby_lock(channel_id):
+    return lobby_lock_stripes[channel_id % LOCK_STRIPES]
+
+def touch_state():
+    global state_version
+    state_version += 1
+
+def bump_version(lobby):
+    lobby['version'] = lobby.get('version', 0) + 1
+    touch_state()
+    update_open_index(lobby)
+    journal_lobby(lobby)
+    return lobby['version']
+
+def lobby_capacity(lobby):
+    return lobby.get('max_players') or MAX_PLAYERS
+
+def free_seats(lobby):
+    return max(0, lobby_capacity(lobby) - len(lobby['players']))
+
+def claim_seats(lobby, user_ids):
+    """Reserve a seat for every user in user_ids, or for none of them.
+
+    Synchronous, so check and claim can't interleave with another join on the loop.
+    """
+    if any(user_id in lobby['players'] for user_id in user_ids):
+        raise SeatUnavailable("❌ You are already in this lobby." if len(user_ids) == 1
+                              else "❌ Someone in your party is already in this lobby.")
+    if free_seats(lobby) < len(user_ids):
+        if len(user_ids) == 1:
+            raise LobbyFull(f"❌ This lobby is full! ({len(lobby['players'])}/{lobby_capacity(lobby)} players)")
+        raise LobbyFull(f"❌ This lobby only has {free_seats(lobby)} free seat(s) for your party of {len(user_ids)}.")
+    lobby['players'].extend(user_ids)
+    return bump_version(lobby)
+
+def release_seat(lobby, user_id):
+    if user_id in lobby['players']:
+        lobby['players'].remove(user_id)
+        bump_version(lobby)
+
+async def grant_seat(lobby, channel, member, reason='joined'):
+    """Claim a seat and give the member access to the lobby channel.
+
+    Raises SeatUnavailable before any REST call if the seat can't be claimed, and
+    releases the seat again if the permission update fails.
+    """
+    return await grant_seats(lobby, channel, [member], reason)
+
+async def grant_seats(lobby, channel, members, reason='joined'):
+    """Claim seats for all members at once and let them in with one permission update"""
+    claim_seats(lobby, [member.id for member in members])
+    for member in members:
+        user_sessions[member.id] = channel.id
+        remember_name(channel.guild.id, member)
+    try:
+        await reconcile_overwrites(lobby, channel)
+    except Exception:
+        for member in members:
+            release_seat(lobby, member.id)
+            if user_sessions.get(member.id) == channel.id:
+                del user_sessions[member.id]
+        raise
+    for member in members:
+        leave_waitlist(member.id)
+        log_lobby_event('joined', channel.id, channel.guild.id, member.id, via=reason,
+                        players=len(lobby['players']), max_players=lobby_capacity(lobby))
+    schedule_join_refresh(lobby)
+    return len(lobby['players'])
+
+async def revoke_seat(lobby, channel, member, reason='left'):
+    """Release a member's seat and remove their access to the lobby channel"""
+    if lobby:
+        release_seat(lobby, member.id)
+    if user_sessions.get(member.id) == channel.id:
+        del user_sessions[member.id]
+    if lobby:
+        await reconcile_overwrites(lobby, channel)
+    else:
+        async with lobby_lock(channel.id):
+            await channel.set_permissions(member, overwrite=None)
+    log_lobby_event(reason, channel.id, channel.guild.id, member.id,
+                    players=len(lobby['players']) if lobby else None)
+    if lobby:
+        schedule_join_refresh(lobby)
+        schedule_promotion(lobby)
+
+def overwrite_member_id(target):
+    """The user id an overwrite target stands for, or None for roles"""
+    if isinstance(target, discord.Role) or getattr(target, 'type', None) is discord.Role:
+        return None
+    if target.id == getattr(getattr(target, 'guild', None), 'id', None) or target.id == bot.user.id:
+        return None
+    return None if getattr(target, 'bot', False) else target.id
+
+def desired_overwrites(lobby, channel):
+    """The channel's overwrites with exactly the lobby's players seated.
+
+    Roles, denies and member overwrites the bot did not grant (anything other than the plain
+    seat, e.g. a moderator's) are kept; a seat left behind by someone who is no longer a
+    player is removed.
+    """
+    players = set(lobby['players'])
+    seated = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+    overwrites = {}
+    for target, overwrite in channel.overwrites.items():
+        user_id = overwrite_member_id(target)
+        if user_id in players:
+            players.discard(user_id)
+            overwrites[target] = seated
+        elif user_id is None or overwrite != seated:
+            overwrites[target] = overwrite
+    for user_id in players:
+        overwrites[channel.guild.get_member(user_id) or discord.Object(user_id)] = seated
+    return overwrites
+
+async def reconcile_overwrites(lobby, channel):
+    """Apply the lobby's player list to the channel's overwrites in one batched edit"""
+    future = pending_overwrites.get(channel.id)
+    if future is None:
+        future = pending_overwrites[channel.id] = asyncio.get_running_loop().create_future()
+        asyncio.create_task(apply_overwrites(lobby, channel, future))
+    else:
+        overwrite_edits['coalesced'] += 1
+    await asyncio.shield(future)
+
+async def apply_overwrites(lobby, channel, future):
+    # Waiting on the lock lets changes made during the previous edit join this one
+    async with lobby_lock(channel.id):
+        if pending_overwrites.get(channel.id) is future:
+            del pending_overwrites[channel.id]
+        try:
+            overwrites = desired_overwrites(lobby, channel)
+            if overwrites == channel.overwrites:
+                overwrite_edits['unchanged'] += 1
+            else:
+                await channel.edit(overwrites=overwrites)
+                overwrite_edits['applied'] += 1
+        except Exception as e:
+            future.set_exception(e)
+            # Every waiter re-raises it; mark it retrieved in case they were all cancelled
+            future.exception()
+        else:
+            future.set_result(None)
+
+def join_waitlist(lobby, user_id, notify_channel_id):
+    """Queue user_id for the lobby's next free seat; returns their position, or None if the waitlist is full"""
+    channel_id = lobby['channel']
+    waitlist = lobby_waitlists.get(channel_id)
+    if waitlist is None or user_id not in waitlist:
+        if waitlist is not None and len(waitlist) >= WAITLIST_SIZE:
+            return None
+        leave_waitlist(user_id)
+        waitlist = lobby_waitlists.setdefault(channel_id, OrderedDict())
+        waitlist[user_id] = notify_channel_id
+        user_waitlist[user_id] = channel_id
+        touch_state()
+    return list(waitlist).index(user_id) + 1
+
+def leave_waitlist(user_id):
+    """Take user_id off whichever waitlist they are on; returns that lobby's channel id"""
+    channel_id = user_waitlist.pop(user_id, None)
+    waitlist = lobby_waitlists.get(channel_id)
+    if waitlist is not None:
+        waitlist.pop(user_id, None)
+        if not waitlist:
+            del lobby_waitlists[channel_id]
+        touch_state()
+    return channel_id
+
+def drop_waitlist(channel_id):
+    """Forget a lobby's waitlist and tell everyone on it that the lobby is gone"""
+    waitlist = lobby_waitlists.pop(channel_id, None)
+    if not waitlist:
+        return
+    for user_id in waitlist:
+        user_waitlist.pop(user_id, None)
+    asyncio.create_task(notify_dropped_waiters(waitlist))
+
+async def notify_dropped_waiters(waitlist):
+    by_channel = {}
+    for user_id, notify_channel_id in waitlist.items():
+        by_channel.setdefault(notify_channel_id, []).append(user_id)
+    for notify_channel_id, user_ids in by_channel.items():
+        notify_channel = bot.get_channel(notify_channel_id)
+        if notify_channel is None:
+            continue
+        mentions = " ".join(f"<@{user_id}>" for user_id in user_ids)
+        try:
+            await notify_channel.send(f"⌛ {mentions} the lobby you were waiting for has ended. "
+                                      f"Use `/find_match` to find another one.")
+        except discord.HTTPException as e:
+            logger.warning("Could not tell waitlisted players their lobby ended: %s", e,
+                           extra={'guild': notify_channel.guild.id})
+
+def full_lobby_message(error, guild, lobby, position):
+    names = player_names(guild, lobby['players'])
+    message = f"{error}\nPlayers in lobby: {', '.join(names)}"
+    if position is None:
+        return message + "\nThe waitlist is full too. Try `/find_match` for another lobby."
+    return message + f"\n⏳ You're #{position} on the waitlist and will be added automatically when a seat opens."
+
+def schedule_promotion(lobby):
+    # A running promoter keeps seating until the lobby is full, so it picks up this seat too
+    channel_id = lobby['channel']
+    if channel_id in lobby_waitlists and free_seats(lobby) and channel_id not in waitlist_promoters:
+        waitlist_promoters[channel_id] = asyncio.create_task(promote_waitlist(channel_id))
+
+async def promote_waitlist(channel_id):
+    """Seat waiting players while the lobby has free seats, notifying each one once"""
+    try:
+        channel = bot.get_channel(channel_id)
+        while channel is not None and channel_id in lobby_waitlists:
+            lobby = active_lobbies.get(channel_id)
+            if lobby is None:
+                drop_waitlist(channel_id)
+                return
+            user_id, notify_channel_id = next(iter(lobby_waitlists[channel_id].items()))
+            if user_id in user_sessions:
+                leave_waitlist(user_id)
+                continue
+            try:
+                member = channel.guild.get_member(user_id) or await channel.guild.fetch_member(user_id)
+                player_count = await grant_seat(lobby, channel, member, reason='waitlist')
+            except LobbyFull:
+                return
+            except (SeatUnavailable, discord.HTTPException) as e:
+                leave_waitlist(user_id)
+                logger.warning("Could not promote %s from the waitlist: %s", user_id, e,
+                               extra={'lobby': channel_id, 'guild': channel.guild.id, 'user': user_id})
+                continue
+            # The seat is theirs either way; a failed announcement must not stop the next promotion
+            try:
+                await channel.send(f"🎉 **{member.display_name}** joined from the waitlist! ({player_count}/{lobby_capacity(lobby)} players)")
+                notify_channel = bot.get_channel(notify_channel_id)
+                if notify_channel is not None and notify_channel.id != channel_id:
+                    await notify_channel.send(f"🎮 {member.mention} a seat opened up, you've been added to {channel.mention}!")
+            except discord.HTTPException as e:
+                logger.warning("Could not announce %s's promotion from the waitlist: %s", user_id, e,
+                               extra={'lobby': channel_id, 'guild': channel.guild.id, 'user': user_id})
+    finally:
+        waitlist_promoters.pop(channel_id, None)
+
+def normalize_attr(attr, value):
+    """Normalize a lobby attribute for indexing; start times are bucketed by hour"""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if attr == 'start':
+        match = re.match(r'^(\d{1,2})(?::\d{2})?$', value)
+        if match and int(match.group(1)) < 24:
+            return f"{int(match.group(1)):02d}:00"
+    return value or None
+
+def register_lobby(lobby):
+    """Add a lobby to active_lobbies and every search index"""
+    channel_id = lobby['channel']
+    active_lobbies[channel_id] = lobby
+    lobby.setdefault('version', 0)
+    # Lobbies rebuilt from a channel carry Discord's aware created_at; every other time is naive UTC
+    for field in LOBBY_TIME_FIELDS:
+        if lobby.get(field) is not None and lobby[field].tzinfo is not None:
+            lobby[field] = lobby[field].replace(tzinfo=None)
+    if lobby.get('guild') is None:
+        channel = bot.get_channel(channel_id)
+        lobby['guild'] = channel.guild.id if channel else None
+    guild_lobbies.setdefault(lobby['guild'], set()).add(channel_id)
+    for attr in LOBBY_ATTRIBUTES:
+        value = normalize_attr(attr, lobby.get(attr))
+        if value is not None:
+            lobby_attr_index[attr].setdefault(value, set()).add(channel_id)
+    index = bisect_right(lobby_order, channel_id)
+    if not index or lobby_order[index - 1] != channel_id:
+        lobby_order.insert(index, channel_id)
+    update_open_index(lobby)
+    touch_state()
+    journal_lobby(lobby)
+
+def unregister_lobby(channel_id):
+    """Remove a lobby from active_lobbies and every search index"""
+    lobby = active_lobbies.pop(channel_id, None)
+    if lobby is None:
+        return None
+    lobbies = guild_lobbies.get(lobby.get('guild'))
+    if lobbies is not None:
+        lobbies.discard(channel_id)
+        if not lobbies:
+            del guild_lobbies[lobby.get('guild')]
+    for attr in LOBBY_ATTRIBUTES:
+        value = normalize_attr(attr, lobby.get(attr))
+        bucket = lobby_attr_index[attr].get(value)
+        if bucket is not None:
+            bucket.discard(channel_id)
+            if not bucket:
+                del lobby_attr_index[attr][value]
+    index = bisect_right(lobby_order, channel_id)
+    if index and lobby_order[index - 1] == channel_id:
+        del lobby_order[index - 1]
+    open_lobbies.discard(channel_id)
+    unbucket_lobby(channel_id)
+    drop_waitlist(channel_id)
+    touch_state()
+    journal_removal(channel_id)
+    return lobby
+
+def clear_lobbies():
+    active_lobbies.clear()
+    guild_lobbies.clear()
+    for values in lobby_attr_index.values():
+        values.clear()
+    open_lobbies.clear()
+    seat_buckets.clear()
+    lobby_seat_bucket.clear()
+    lobby_order.clear()
+    lobby_waitlists.clear()
+    user_waitlist.clear()
+    touch_state()
+    if journal_queue is not None:
+        write_journal({'op': 'clear'})
+
+def update_open_index(lobby):
+    channel_id = lobby['channel']
+    unbucket_lobby(channel_id)
+    free = free_seats(lobby)
+    if channel_id in active_lobbies and free:
+        open_lobbies.add(channel_id)
+        key = (lobby.get('guild'), free)
+        seat_buckets.setdefault(key, set()).add(channel_id)
+        lobby_seat_bucket[channel_id] = key
+    else:
+        open_lobbies.discard(channel_id)
+
+def unbucket_lobby(channel_id):
+    key = lobby_seat_bucket.pop(channel_id, None)
+    bucket = seat_buckets.get(key)
+    if bucket is not None:
+        bucket.discard(channel_id)
+        if not bucket:
+            del seat_buckets[key]
+
+def find_lobby_with_seats(guild_id, seats):
+    """An open lobby in the guild with at least `seats` free, preferring the fullest that fits"""
+    for free in range(seats, MAX_PLAYERS_LIMIT + 1):
+        for channel_id in seat_buckets.get((guild_id, free), ()):
+            return channel_id
+    return None
+
+def find_lobbies(guild_id=None, **filters):
+    """Return the ids of open lobbies (in guild_id, if given) matching every given attribute filter"""
+    sets = [open_lobbies]
+    if guild_id is not None:
+        sets.append(guild_lobbies.get(guild_id, set()))
+    for attr, value in filters.items():
+        value = normalize_attr(attr, value)
+        if value is not None:
+            sets.append(lobby_attr_index[attr].get(value, set()))
+    sets.sort(key=len)
+    return sets[0].intersection(*sets[1:])
+
+def describe_lobby(lobby):
+    """Short text listing a lobby's optional attributes"""
+    parts = []
+    for attr, emoji in (('platform', '🖥️'), ('region', '🌍'), ('style', '🎯'), ('start', '⏰')):
+        if lobby.get(attr):
+            parts.append(f"{emoji} {lobby[attr]}")
+    return " · ".join(parts)
+
+class LobbyFlags(commands.FlagConverter):
+    platform: Optional[str] = None
+    region: Optional[str] = None
+    style: Optional[str] = None
+    start: Optional[str] = commands.flag(default=None, aliases=['start_time'])
+
+    def as_filters(self):
+        return {attr: getattr(self, attr) for attr in LOBBY_ATTRIBUTES if getattr(self, attr)}
+
+class MatchFlags(LobbyFlags):
+    auto: bool = False
+
+class CreateFlags(LobbyFlags):
+    max_players: Optional[int] = None
+
+def match_affinity(prefs, lobby):
+    """Penalty for seating a player with prefs in lobby; None if their preferences conflict"""
+    penalty = 0.0
+    for attr in MATCH_AFFINITY:
+        wanted = prefs.get(attr)
+        offered = normalize_attr(attr, lobby.get(attr))
+        if wanted and offered and wanted != offered:
+            return None
+        if bool(wanted) != bool(offered):
+            penalty += MATCH_AFFINITY_WEIGHT
+    return penalty
+
+def solve_matches(entries, lobbies, now):
+    """Assign queued players to free seats in one greedy pass.
+
+    Each lobby's cost prefers lobbies that are nearly full and have waited longest, plus an
+    affinity penalty per player. Players are seated longest-waiting first, each taking the
+    cheapest lobby that still has a seat. The penalty only depends on a lobby's platform and
+    region, so lobbies are grouped by those and each player only compares the cheapest open
+    lobby of every group. Returns (user_id, channel_id) pairs.
+    """
+    if not entries or not lobbies:
+        return []
+    seats = [free_seats(lobby) for lobby in lobbies]
+    groups = {}  # (platform, region) -> heap of (cost, index) of lobbies with free seats
+    for j, (free, lobby) in enumerate(zip(seats, lobbies)):
+        if free > 0:
+            cost = MATCH_SEAT_WEIGHT * free - MATCH_AGE_WEIGHT * (now - lobby['created_at']).total_seconds() / 60
+            key = tuple(normalize_attr(attr, lobby.get(attr)) for attr in MATCH_AFFINITY)
+            groups.setdefault(key, []).append((cost, j))
+    for heap in groups.values():
+        heapq.heapify(heap)
+    offered = {key: dict(zip(MATCH_AFFINITY, key)) for key in groups}
+    matches = []
+    for entry in sorted(entries, key=lambda e: e['queued_at']):
+        best = None
+        for key, heap in groups.items():
+            if not heap:
+                continue
+            penalty = match_affinity(entry['prefs'], offered[key])
+            if penalty is not None:
+                cost, j = heap[0]
+                if best is None or (cost + penalty, j) < best[:2]:
+                    best = (cost + penalty, j, heap)
+        if best is None:
+            continue
+        _, j, heap = best
+        seats[j] -= 1
+        if not seats[j]:
+            heapq.heappop(heap)
+        matches.append((entry['user_id'], lobbies[j]['channel']))
+    return matches
+
+def mark_startup(phase):
+    """Record the time spent since the previous startup phase ended"""
+    global startup_last_mark
+    now = time.perf_counter()
+    if phase not in startup_timings:
+        startup_timings[phase] = round(now - startup_last_mark, 3)
+    startup_last_mark = now
+
+def report_startup():
+    """Log the phase timings once the last of them, usually the background sync, has finished"""
+    global startup_reported
+    if startup_reported or not all(phase in startup_timings for phase in STARTUP_PHASES):
+        return
+    startup_reported = True
+    total = round(time.perf_counter() - PROCESS_STARTED, 3)
+    running = sum(seconds for phase, seconds in startup_timings.items() if phase != 'sync')
+    logger.info("Startup finished in %.2fs, tasks running after %.2fs: %s", total, running,
+                ", ".join(f"{phase} {startup_timings[phase]:.2f}s" for phase in STARTUP_PHASES))
+    if running > STARTUP_BUDGET:
+        logger.warning("Startup took %.2fs to get tasks running, over the %.0fs budget", running, STARTUP_BUDGET)
+
+def command_tree_fingerprint():
+    """Stable hash of the registered app-command tree, independent of registration order"""
+    payload = sorted((cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()), key=lambda c: c['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_command_tree():
+    """Sync app commands only when the tree changed since the last successful sync"""
+    started = time.perf_counter()
+    fingerprint = command_tree_fingerprint()
+    try:
+        with open(COMMAND_TREE_HASH_FILE) as f:
+            synced_fingerprint = f.read().strip()
+    except OSError:
+        synced_fingerprint = None
+    if fingerprint == synced_fingerprint:
+        logger.info("Command tree unchanged (%s), skipping sync", fingerprint[:12])
+    else:
+        try:
+            synced = await bot.tree.sync()
+            logger.info("Synced %d command(s)", len(synced))
+            with open(COMMAND_TREE_HASH_FILE, 'w') as f:
+                f.write(fingerprint)
+        except Exception as e:
+            logger.error("Failed to sync commands: %s", e)
+    startup_timings.setdefault('sync', round(time.perf_counter() - started, 3))
+    report_startup()
+
+def load_guild_config(path=None):
+    """Read per-guild settings; a missing file leaves every guild on the defaults"""
+    guild_configs.clear()
+    try:
+        with open(path or GUILD_CONFIG_FILE) as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return
+    for guild_id, settings in raw.items():
+        guild_configs[int(guild_id)] = {
+            **DEFAULT_GUILD_CONFIG,
+            **{key: int(value) if value is not None else None for key, value in settings.items()},
+        }
+    logger.info("Loaded settings for %d guilds from %s", len(guild_configs), path or GUILD_CONFIG_FILE)
+
+def guild_config(guild_id):
+    return guild_configs.get(guild_id, DEFAULT_GUILD_CONFIG)
+
+def is_lobby_channel(channel):
+    """Lobby channels are the bot's 'lobby-' channels inside the guild's lobby category"""
+    guild = getattr(channel, 'guild', None)
+    return (guild is not None
+            and getattr(channel, 'category_id', None) == guild_config(guild.id)['lobby_category']
+            and getattr(channel, 'name', '').startswith('lobby-'))
+
+def index_lobby_channel(channel):
+    guild = channel.guild
+    lobby_channel_index.setdefault(guild.shard_id, {}).setdefault(guild.id, {})[channel.id] = channel
+
+def unindex_lobby_channel(channel_id, guild=None):
+    shards = [lobby_channel_index.get(guild.shard_id, {})] if guild is not None else lobby_channel_index.values()
+    for guilds in shards:
+        for guild_id, channels in guilds.items():
+            if (guild is None or guild_id == guild.id) and channels.pop(channel_id, None) is not None:
+                return
+
+def unindex_guild(guild):
+    lobby_channel_index.get(guild.shard_id, {}).pop(guild.id, None)
+
+def build_lobby_channel_index():
+    lobby_channel_index.clear()
+    for guild in bot.guilds:
+        for channel in guild.text_channels:
+            if is_lobby_channel(channel):
+                index_lobby_channel(channel)
+
+def iter_lobby_channels(shard_id=None, guild_id=None):
+    """Snapshot of the indexed lobby channels, optionally of one shard or guild, safe to iterate across awaits"""
+    if guild_id is not None:
+        # A guild's channels live under its own shard, so only that entry is read
+        guild = bot.get_guild(guild_id)
+        if guild is None or (shard_id is not None and guild.shard_id != shard_id):
+            return []
+        return list(lobby_channel_index.get(guild.shard_id, {}).get(guild_id, {}).values())
+    shards = [lobby_channel_index.get(shard_id, {})] if shard_id is not None else lobby_channel_index.values()
+    return [
+        channel
+        for guilds in shards
+        for channels in guilds.values()
+        for channel in channels.values()
+    ]
+
+def shard_connected(shard_id):
+    """False while a shard is reconnecting, when its cached channels may be stale"""
+    if not isinstance(bot, discord.AutoShardedClient):
+        return True
+    shard = bot.get_shard(shard_id)
+    return shard is not None and not shard.is_closed()
+
+lobby_stats = LobbyStats()
+stats_seed_events = None  # Events logged while lobby_stats is rebuilt from the log, applied after
+stats_seed_task = None
+
+async def seed_lobby_stats():
+    """Rebuild the live rollups from the event log on a thread, so /stats survives restarts"""
+    global lobby_stats, stats_seed_events
+    started = time.time()
+    stats_seed_events = []
+    try:
+        seeded = await asyncio.to_thread(rebuild_lobby_stats, LOBBY_EVENT_LOG, started)
+    except Exception:
+        logger.exception("Could not seed lobby stats from %s", LOBBY_EVENT_LOG)
+        stats_seed_events = None
+        return
+    # Events from before the rebuild started come from the log, later ones from the live record
+    for entry in stats_seed_events:
+        seeded.record(entry)
+    stats_seed_events = None
+    lobby_stats = seeded
+    logger.info("Seeded lobby stats from %s in %.1fs", LOBBY_EVENT_LOG, time.time() - started)
+
+def log_lobby_event(kind, lobby=None, guild=None, user=None, **fields):
+    """Append a lobby event to the event log and fold it into the live stats"""
+    entry = {'ts': round(time.time(), 3), 'e': kind}
+    if lobby is not None:
+        entry['lobby'] = lobby
+    if guild is not None:
+        entry['guild'] = guild
+    if user is not None:
+        entry['user'] = user
+    entry.update(fields)
+    lobby_stats.record(entry)
+    if stats_seed_events is not None:
+        stats_seed_events.append(entry)
+    if LOBBY_EVENT_LOG:
+        event_log.info(json.dumps(entry, separators=(',', ':')))
+
+def serialize_lobby(lobby):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in lobby.items()}
+
+def deserialize_lobby(data):
+    lobby = dict(data)
+    for key in LOBBY_TIME_FIELDS:
+        if lobby.get(key):
+            lobby[key] = datetime.fromisoformat(lobby[key])
+    return lobby
+
+def write_journal(entry):
+    global state_seq
+    state_seq += 1
+    entry['seq'] = state_seq
+    journal_queue.put(json.dumps(entry, separators=(',', ':')) + '\n')
+    if state_seq - state_snapshot_seq >= STATE_SNAPSHOT_EVERY:
+        write_state_snapshot()
+
+def journal_lobby(lobby):
+    if journal_queue is not None and active_lobbies.get(lobby['channel']) is lobby:
+        write_journal({'op': 'put', 'lobby': serialize_lobby(lobby)})
+
+def journal_removal(channel_id):
+    if journal_queue is not None:
+        write_journal({'op': 'del', 'channel': channel_id})
+
+def write_state_snapshot():
+    """Queue every lobby for the snapshot; the writer starts an empty journal after it"""
+    global journal_queue, journal_thread, state_snapshot_seq
+    if journal_queue is None:
+        journal_queue = queue.SimpleQueue()
+        journal_thread = threading.Thread(target=journal_writer, args=(journal_queue,), name='state-journal', daemon=True)
+        journal_thread.start()
+        atexit.register(stop_journal_writer)
+    # Lobbies are copied here so the snapshot matches state_seq; encoding and I/O happen on the writer
+    journal_queue.put((state_seq, [serialize_lobby(lobby) for lobby in active_lobbies.values()]))
+    state_snapshot_seq = state_seq
+
+def save_state_snapshot(seq, lobbies, journal):
+    """Replace the snapshot and return a new, empty journal, closing the old one"""
+    snapshot = os.path.join(STATE_DIR, 'lobbies.snapshot')
+    with open(snapshot + '.tmp', 'w') as f:
+        json.dump({'seq': seq, 'lobbies': lobbies}, f)
+    os.replace(snapshot + '.tmp', snapshot)
+    # A new file (new inode) tells followers the old journal is finished
+    path = os.path.join(STATE_DIR, 'lobbies.journal')
+    new_journal = open(path + '.tmp', 'w')
+    os.replace(path + '.tmp', path)
+    if journal is not None:
+        journal.close()
+    return new_journal
+
+def journal_writer(entries):
+    # Runs on a thread: writes whatever has queued up since the last pass, then flushes once
+    journal = None
+    while True:
+        batch = [entries.get()]
+        while True:
+            try:
+                batch.append(entries.get_nowait())
+            except queue.Empty:
+                break
+        for item in batch:
+            if item is None:
+                if journal is not None:
+                    journal.close()
+                return
+            try:
+                if isinstance(item, str):
+                    journal.write(item)
+                else:
+                    journal = save_state_snapshot(*item, journal)
+            except Exception:
+                logger.exception("Could not write lobby state to %s", STATE_DIR)
+        if journal is not None:
+            journal.flush()
+
+def stop_journal_writer():
+    """Write out everything still queued for the journal"""
+    if journal_thread is not None and journal_thread.is_alive():
+        journal_queue.put(None)
+        journal_thread.join(timeout=5)
+
+class StateFollower:
+    """Applies the primary's lobby snapshot and journal to this process's lobby state"""
+
+    def __init__(self, directory):
+        self.snapshot_path = os.path.join(directory, 'lobbies.snapshot')
+        self.journal_path = os.path.join(directory, 'lobbies.journal')
+        self.journal = None
+        self.inode = None
+        self.buffer = ''
+        self.seq = 0
+
+    def load(self):
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        clear_lobbies()
+        for data in snapshot['lobbies']:
+            register_lobby(deserialize_lobby(data))
+        self.seq = snapshot['seq']
+
+    def poll(self):
+        """Apply journal entries written since the last poll, following journal rotations"""
+        while True:
+            if self.journal is None:
+                try:
+                    self.journal = open(self.journal_path)
+                except FileNotFoundError:
+                    return
+                self.inode = os.fstat(self.journal.fileno()).st_ino
+                self.buffer = ''
+            self.read()
+            try:
+                if os.stat(self.journal_path).st_ino == self.inode:
+                    return
+            except FileNotFoundError:
+                return
+            self.read()
+            self.close()
+
+    def read(self):
+        self.buffer += self.journal.read()
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            if line:
+                self.apply(json.loads(line))
+
+    def apply(self, entry):
+        if entry['seq'] <= self.seq:
+            return
+        self.seq = entry['seq']
+        if entry['op'] == 'put':
+            lobby = deserialize_lobby(entry['lobby'])
+            unregister_lobby(lobby['channel'])
+            register_lobby(lobby)
+        elif entry['op'] == 'del':
+            unregister_lobby(entry['channel'])
+        elif entry['op'] == 'clear':
+            clear_lobbies()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+async def run_with_standby(token):
+    """Follow saved lobby state until no other instance holds the primary lock, then connect"""
+    global standby_loaded, takeover_started, state_seq
+    if fcntl is None:
+        raise RuntimeError("STATE_DIR needs fcntl file locks, which this platform doesn't have")
+    os.makedirs(STATE_DIR, exist_ok=True)
+    lock = open(os.path.join(STATE_DIR, 'primary.lock'), 'a+')
+    follower = StateFollower(STATE_DIR)
+    follower.load()
+    standing_by = False
+    while True:
+        follower.poll()
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            if not standing_by:
+                logger.info("Another instance is primary; standing by with %d lobbies loaded", len(active_lobbies))
+                standing_by = True
+            await asyncio.sleep(STANDBY_POLL)
+    takeover_started = time.perf_counter()
+    follower.poll()
+    follower.close()
+    lock.seek(0)
+    lock.truncate()
+    lock.write(f"{os.getpid()}\n")
+    lock.flush()
+
+    user_sessions.clear()
+    for lobby in active_lobbies.values():
+        for pid in lobby['players']:
+            user_sessions[pid] = lobby['channel']
+    standby_loaded = bool(active_lobbies)
+    state_seq = follower.seq
+    write_state_snapshot()
+    logger.info("Holding the primary lock with %d lobbies from saved state", len(active_lobbies))
+    async with bot:
+        await bot.start(token)
+
+def label_task(label):
+    """Name the running task for stall reports (e.g. 'command:create_game')"""
+    task = asyncio.current_task()
+    if task is not None:
+        task_labels[task] = label
+    if profile_requests:
+        begin_profile(label)
+
+def lag_percentiles():
+    samples = sorted(loop_lag)
+    if not samples:
+        return {}
+    pick = lambda pct: samples[min(len(samples) - 1, int(len(samples) * pct))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': samples[-1]}
+
+async def watch_loop_lag():
+    """Heartbeat: measures how late each sleep wakes up, and closes out stalls the watchdog caught"""
+    global loop_heartbeat, pending_stall
+    beats = 0
+    while True:
+        loop_heartbeat = time.perf_counter()
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        lag = time.perf_counter() - loop_heartbeat - LAG_SAMPLE_INTERVAL
+        loop_lag.append(lag)
+        stall, pending_stall = pending_stall, None
+        if lag >= LAG_THRESHOLD:
+            if stall is None or stall['beat'] != loop_heartbeat:
+                stall = {'activity': None, 'stack': []}
+            stall.pop('beat', None)
+            stall.update(lag=lag, at=datetime.utcnow())
+            loop_stalls.append(stall)
+            logger.warning("Event loop blocked for %.0f ms in %s", lag * 1000, stall['activity'] or "unknown",
+                           extra={'command': stall['activity']})
+        beats += 1
+        if beats % LAG_REPORT_EVERY == 0:
+            pct = lag_percentiles()
+            logger.info("Loop lag p50=%.1fms p95=%.1fms p99=%.1fms max=%.1fms",
+                        pct['p50'] * 1000, pct['p95'] * 1000, pct['p99'] * 1000, pct['max'] * 1000)
+
+def lag_watchdog(loop, thread_id):
+    # Side thread: if the heartbeat is overdue the loop is stuck, so grab its stack now
+    global pending_stall
+    captured = None
+    while not loop.is_closed():
+        time.sleep(LAG_THRESHOLD / 2)
+        beat = loop_heartbeat
+        if beat is None or beat == captured:
+            continue
+        if time.perf_counter() - beat - LAG_SAMPLE_INTERVAL < LAG_THRESHOLD:
+            continue
+        captured = beat
+        frame = sys._current_frames().get(thread_id)
+        task = asyncio.current_task(loop)
+        pending_stall = {
+            'beat': beat,
+            'activity': task_labels.get(task) or task.get_name() if task else "callback",
+            'stack': traceback.format_list(traceback.extract_stack(frame)[-STALL_STACK_DEPTH:]) if frame else [],
+        }
+
+def start_lag_watchdog():
+    global lag_watchdog_task
+    if lag_watchdog_task is not None:
+        return
+    lag_watchdog_task = asyncio.create_task(watch_loop_lag())
+    threading.Thread(target=lag_watchdog, args=(asyncio.get_running_loop(), threading.get_ident()),
+                     name='lag-watchdog', daemon=True).start()
+
+def labelled(label):
+    """Label each run of a task loop or callback, so stalls and profiles can name it"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            label_task(label)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                finish_profile()
+        return wrapper
+    return decorator
+
+def coalesce_per_user(func):
+    """Run one copy of a command per (user, channel, arguments) at a time.
+
+    Duplicates that arrive while it runs wait for it to finish, and duplicates within
+    IDEMPOTENCY_WINDOW afterwards are answered as already handled; neither repeats the
+    command's REST calls.
+    """
+    @functools.wraps(func)
+    async def wrapper(ctx, *args, **kwargs):
+        name = func.__name__
+        arguments = json.dumps([rec_value(a) for a in args] + [{k: rec_value(v) for k, v in kwargs.items()}],
+                               sort_keys=True, default=str)
+        key = (ctx.author.id, ctx.channel.id, name, arguments)
+        command_calls[name] += 1
+        pending = inflight_ops.get(key)
+        if pending is not None:
+            absorbed_duplicates[name, 'in flight'] += 1
+            await asyncio.shield(pending)
+            await ctx.send("ℹ️ That was already handled; see the reply to your first request.", ephemeral=True)
+            return
+        now = time.monotonic()
+        while recent_ops and next(iter(recent_ops.values())) < now - IDEMPOTENCY_WINDOW:
+            recent_ops.popitem(last=False)
+        if key in recent_ops:
+            absorbed_duplicates[name, 'just finished'] += 1
+            await ctx.send("ℹ️ That was already handled a moment ago; see the reply to your first request.", ephemeral=True)
+            return
+        inflight_ops[key] = done = asyncio.get_running_loop().create_future()
+        try:
+            return await func(ctx, *args, **kwargs)
+        finally:
+            del inflight_ops[key]
+            done.set_result(None)
+            recent_ops[key] = time.monotonic()
+            recent_ops.move_to_end(key)
+    return wrapper
+
+def begin_profile(label):
+    request = profile_requests.get(label)
+    task = asyncio.current_task()
+    if request is None or task is None:
+        return
+    session = {'request': request, 'started': time.perf_counter(), 'rest': 0.0}
+    profile_sessions[task] = session
+    profile_context.set(session)
+
+def finish_profile():
+    task = asyncio.current_task()
+    session = profile_sessions.pop(task, None) if task else None
+    if session is None:
+        return
+    profile_context.set(None)
+    request = session['request']
+    request['wall'] += time.perf_counter() - session['started']
+    request['rest'] += session['rest']
+    request['invocations'] += 1
+    if request['remaining'] is not None:
+        request['remaining'] -= 1
+        if request['remaining'] <= 0:
+            finish_profile_request(request['label'])
+
+def frame_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def profile_sampler(loop, thread_id):
+    # Side thread, alive only while a profile is requested; samples what the loop is running
+    while profile_requests and not loop.is_closed():
+        time.sleep(PROFILE_INTERVAL)
+        task = asyncio.current_task(loop)
+        session = profile_sessions.get(task) if task else None
+        frame = sys._current_frames().get(thread_id) if session else None
+        if frame is not None:
+            request = session['request']
+            stack = f"{request['label']};{frame_stack(frame)}"
+            with profile_lock:
+                request['samples'][stack] += 1
+                request['cpu'] += PROFILE_INTERVAL
+
+async def profiled_request(route, **kwargs):
+    # Installed over bot.http.request only while profiling
+    session = profile_context.get()
+    if session is None:
+        return await monitored_request(route, **kwargs)
+    profile_sessions.setdefault(asyncio.current_task(), session)
+    started = time.perf_counter()
+    try:
+        return await monitored_request(route, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        session['rest'] += elapsed
+        request = session['request']
+        with profile_lock:
+            request['samples'][f"{request['label']};[discord REST] {route.method} {route.path}"] += max(1, round(elapsed / PROFILE_INTERVAL))
+
+def start_profile_request(label, invocations=None, seconds=None):
+    first = not profile_requests
+    profile_requests[label] = {
+        'label': label, 'remaining': invocations, 'samples': Counter(),
+        'wall': 0.0, 'rest': 0.0, 'cpu': 0.0, 'invocations': 0,
+    }
+    if first:
+        bot.http.request = profiled_request
+        threading.Thread(target=profile_sampler, args=(asyncio.get_running_loop(), threading.get_ident()),
+                         name='profiler', daemon=True).start()
+    if seconds:
+        asyncio.get_running_loop().call_later(seconds, finish_profile_request, label)
+
+def finish_profile_request(label):
+    """Stop profiling label and write its collapsed stacks (one 'frame;frame count' line each)"""
+    request = profile_requests.pop(label, None)
+    if request is None:
+        return None
+    if not profile_requests:
+        bot.http.request = monitored_request
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{label.replace(':', '-')}-{datetime.utcnow():%Y%m%d-%H%M%S}.folded")
+    with profile_lock:
+        samples = request['samples'].most_common()
+    with open(path, 'w') as f:
+        for stack, count in samples:
+            f.write(f"{stack} {count}\n")
+    logger.info("Profile of %s: %d runs, wall %.0fms, cpu %.0fms, REST wait %.0fms, other %.0fms -> %s",
+                label, request['invocations'], request['wall'] * 1000, request['cpu'] * 1000, request['rest'] * 1000,
+                max(0.0, request['wall'] - request['cpu'] - request['rest']) * 1000, path)
+    return path
+
+def hash_message_text(lobby):
+    # A non-default size is kept in the hash message so a restart can restore it
+    seats = lobby_capacity(lobby)
+    seats_line = f"\nSeats: {seats}" if seats != MAX_PLAYERS else ""
+    return f"Lobby Hash: `{lobby['hash']}`\nQuick Join: `/join_lobby {lobby['hash']}`{seats_line}"
+
+def hash_message_seats(content):
+    """max_players recorded on a lobby's hash message, or None for the default"""
+    match = re.search(r'^Seats: (\d+)$', content, re.M)
+    return int(match.group(1)) if match else None
+
+class RestJobError(Exception):
+    """A REST job failed in a worker process; the message names the original error"""
+
+async def perform_rest_job(client, kind, **args):
+    """Run one REST job with client, which is the bot itself or a worker's login-only client"""
+    channel_id = args['channel_id']
+    channel = client.get_channel(channel_id) or client.get_partial_messageable(channel_id)
+    if kind == 'send':
+        embed = discord.Embed.from_dict(args['embed']) if args.get('embed') else None
+        message = await channel.send(args.get('content'), embed=embed)
+        return message.id
+    if kind == 'delete_channel':
+        if isinstance(channel, discord.PartialMessageable):
+            await client.http.delete_channel(channel_id, reason=args.get('reason'))
+        else:
+            await channel.delete(reason=args.get('reason'))
+        return None
+    if kind == 'last_activity':
+        # Timestamp of the newest non-bot message, if any
+        async for message in channel.history(limit=args.get('limit', 50)):
+            if not message.author.bot:
+                return message.created_at.timestamp()
+        return None
+    if kind == 'find_hash':
+        async for message in channel.history(limit=args.get('limit', 20)):
+            if message.author.id == client.user.id and message.content and message.content.startswith('Lobby Hash:'):
+                return message.content.split('`')[1], message.id, hash_message_seats(message.content)
+        return None
+    raise ValueError(f"Unknown REST job {kind!r}")
+
+def pace_requests(client, slot, rate):
+    """Space client's REST requests through slot so every worker sharing it stays under rate per second"""
+    request = client.http.request
+
+    async def paced(route, **kwargs):
+        with slot.get_lock():
+            now = time.monotonic()
+            start = max(now, slot.value)
+            slot.value = start + 1 / rate
+        if start > now:
+            await asyncio.sleep(start - now)
+        return await request(route, **kwargs)
+
+    client.http.request = paced
+
+async def run_rest_worker(token, jobs, results, slot):
+    client = discord.Client(intents=discord.Intents.none())
+    await client.login(token)
+    pace_requests(client, slot, REST_WORKER_RATE)
+    loop = asyncio.get_running_loop()
+
+    async def consume():
+        while True:
+            job = await loop.run_in_executor(None, jobs.get)
+            if job is None:
+                return
+            try:
+                value = await perform_rest_job(client, job['kind'], **job['args'])
+                results.put((job['id'], True, value))
+            except Exception as e:
+                results.put((job['id'], False, f"{type(e).__name__}: {e}"))
+
+    try:
+        await asyncio.gather(*(consume() for _ in range(REST_WORKER_TASKS)))
+    finally:
+        await client.close()
+
+def rest_worker_main(token, jobs, results, slot):
+    """Entry point of a REST worker process"""
+    asyncio.run(run_rest_worker(token, jobs, results, slot))
+
+def resolve_rest_job(job_id, ok, value):
+    future = rest_pending.pop(job_id, None)
+    if future is None or future.done():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(RestJobError(value))
+
+def drain_rest_results(loop, results):
+    # Runs on a thread so waiting for worker results never blocks the event loop
+    while True:
+        try:
+            item = results.get()
+        except (EOFError, OSError):
+            return
+        if item is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(resolve_rest_job, *item)
+
+def start_rest_workers(token):
+    global rest_jobs, rest_results, rest_worker_slot
+    if REST_WORKERS <= 0 or rest_workers:
+        return
+    context = multiprocessing.get_context('spawn')
+    rest_jobs = context.Queue()
+    rest_results = context.Queue()
+    rest_worker_slot = context.Value('d', 0.0)
+    for i in range(REST_WORKERS):
+        worker = context.Process(target=rest_worker_main, args=(token, rest_jobs, rest_results, rest_worker_slot),
+                                 name=f'rest-worker-{i}', daemon=True)
+        worker.start()
+        rest_workers.append(worker)
+    threading.Thread(target=drain_rest_results, args=(asyncio.get_running_loop(), rest_results),
+                     name='rest-results', daemon=True).start()
+    atexit.register(stop_rest_workers)
+    logger.info("Started %d REST worker processes", REST_WORKERS)
+
+def stop_rest_workers():
+    if not rest_workers:
+        return
+    for _ in range(len(rest_workers) * REST_WORKER_TASKS):
+        rest_jobs.put(None)
+    for worker in rest_workers:
+        worker.join(timeout=5)
+        if worker.is_alive():
+            worker.terminate()
+    rest_workers.clear()
+    rest_results.put(None)
+
+async def submit_rest_job(kind, **args):
+    """Run a REST job on the worker pool, or inline on this loop when no workers are running"""
+    if not rest_workers:
+        return await perform_rest_job(bot, kind, **args)
+    job_id = next(rest_job_ids)
+    future = asyncio.get_running_loop().create_future()
+    rest_pending[job_id] = future
+    rest_jobs.put({'id': job_id, 'kind': kind, 'args': args})
+    started = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(future, REST_JOB_TIMEOUT)
+    except asyncio.TimeoutError:
+        rest_pending.pop(job_id, None)
+        record_rest_outcome(JOB_ROUTE_CLASSES[kind], time.perf_counter() - started, False)
+        raise RestJobError(f"{kind} job timed out after {REST_JOB_TIMEOUT:.0f}s")
+    except RestJobError as e:
+        # Missing channels and permissions are answers, not an unhealthy API
+        healthy = str(e).startswith(('NotFound', 'Forbidden'))
+        record_rest_outcome(JOB_ROUTE_CLASSES[kind], time.perf_counter() - started, healthy)
+        raise
+    record_rest_outcome(JOB_ROUTE_CLASSES[kind], time.perf_counter() - started, True)
+    return value
+
+async def run_rest_jobs(kind, jobs):
+    """Run a batch of jobs of one kind, at most REST_JOB_CONCURRENCY at a time; results come back in order, errors as exceptions"""
+    semaphore = asyncio.Semaphore(REST_JOB_CONCURRENCY)
+
+    async def run(args):
+        async with semaphore:
+            return await submit_rest_job(kind, **args)
+
+    return await asyncio.gather(*(run(args) for args in jobs), return_exceptions=True)
+
+def log_batch_failures(action, channels, results, **extra):
+    """Log a batch's failed jobs: each one when there are few, otherwise a single summary line"""
+    failures = [(channel, result) for channel, result in zip(channels, results) if isinstance(result, Exception)]
+    if len(failures) > 3:
+        logger.error("Error %s %d of %d lobbies, e.g. %s: %s", action, len(failures), len(results),
+                     failures[0][0].name, failures[0][1], extra=extra)
+        return len(failures)
+    for channel, error in failures:
+        logger.error("Error %s %s: %s", action, channel.name, error,
+                     extra={'lobby': channel.id, 'guild': channel.guild.id, **extra})
+    return len(failures)
+
+def route_class(path):
+    """Group a REST path, either a route template or a URL, into the class its breaker tracks"""
+    if '/interactions/' in path or '/webhooks/' in path:
+        return 'interactions'
+    if '/messages' in path or '/pins' in path or '/reactions' in path:
+        return 'messages'
+    if path.startswith('/users/@me/channels'):
+        return 'dm'
+    if '/members' in path:
+        return 'members'
+    if '/channels' in path or '/permissions/' in path:
+        return 'channels'
+    return 'other'
+
+def median_latency(outcomes):
+    """Median of the outcomes that carry a latency sample, or None if none do"""
+    latencies = sorted(latency for _, latency, _ in outcomes if latency is not None)
+    return latencies[len(latencies) // 2] if latencies else None
+
+def record_rest_outcome(route, latency, ok):
+    """Feed one REST call's latency and success into its route class's breaker.
+
+    latency is None for outcomes with nothing to time, such as a 429 discord.py retries itself.
+    """
+    health = rest_health.setdefault(route, {
+        'state': 'closed', 'outcomes': deque(), 'cooldown': HEALTH_COOLDOWN, 'reopen_at': None, 'probes': 0,
+    })
+    now = time.monotonic()
+    outcomes = health['outcomes']
+    outcomes.append((now, latency, ok))
+    while outcomes[0][0] < now - HEALTH_WINDOW:
+        outcomes.popleft()
+    degraded(route)  # Lets an expired cooldown move to half-open first
+    if health['state'] == 'half-open':
+        if ok and latency is not None and latency < HEALTH_SLOW:
+            health['probes'] += 1
+            if health['probes'] >= HEALTH_PROBES:
+                health['state'] = 'closed'
+                health['cooldown'] = HEALTH_COOLDOWN
+                outcomes.clear()  # Judge the recovered route on fresh calls only
+                logger.info("REST %s recovered; resuming background work (%s skipped while degraded)", route,
+                            ", ".join(f"{name} {count}" for name, count in degraded_skips.items()) or "nothing")
+                degraded_skips.clear()
+        else:
+            open_breaker(route, health, "probe failed")
+    elif health['state'] == 'closed' and len(outcomes) >= HEALTH_MIN_CALLS:
+        errors = sum(1 for _, _, good in outcomes if not good) / len(outcomes)
+        median = median_latency(outcomes)
+        if errors >= HEALTH_ERROR_RATE or (median is not None and median >= HEALTH_SLOW):
+            timing = f", median {median:.2f}s" if median is not None else ""
+            open_breaker(route, health, f"{errors:.0%} errors{timing} over {len(outcomes)} calls")
+
+def open_breaker(route, health, reason):
+    if health['state'] == 'half-open':
+        health['cooldown'] = min(health['cooldown'] * 2, HEALTH_MAX_COOLDOWN)
+    health['state'] = 'open'
+    health['probes'] = 0
+    # Jitter keeps every paused loop from resuming against Discord at the same moment
+    pause = health['cooldown'] * random.uniform(1, 1.5)
+    health['reopen_at'] = time.monotonic() + pause
+    logger.warning("REST %s degraded (%s); pausing background work for %.0fs", route, reason, pause)
+
+def degraded(*routes):
+    """True while the breaker of any of the given route classes is open"""
+    now = time.monotonic()
+    for route in routes:
+        health = rest_health.get(route)
+        if health is None or health['state'] != 'open':
+            continue
+        if now < health['reopen_at']:
+            return True
+        health['state'] = 'half-open'
+        health['probes'] = 0
+    return False
+
+def skip_if_degraded(work, *routes):
+    if degraded(*routes):
+        degraded_skips[work] += 1
+        return True
+    return False
+
+async def monitored_request(route, **kwargs):
+    # Installed over bot.http.request in setup_hook so every REST call feeds the breakers
+    started = time.perf_counter()
+    try:
+        result = await type(bot.http).request(bot.http, route, **kwargs)
+    except discord.HTTPException as e:
+        record_rest_outcome(route_class(route.path), time.perf_counter() - started, e.status != 429 and e.status < 500)
+        raise
+    except (OSError, asyncio.TimeoutError):
+        record_rest_outcome(route_class(route.path), time.perf_counter() - started, False)
+        raise
+    record_rest_outcome(route_class(route.path), time.perf_counter() - started, True)
+    return result
+
+class RateLimitMonitor(logging.Filter):
+    """Counts the 429s discord.py retries internally, which never reach monitored_request"""
+
+    def filter(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith('We are being rate limited.') and len(record.args) >= 2:
+            path = str(record.args[1]).removeprefix(discord.http.Route.BASE)
+            # The last argument is retry_after, not how long the call took, so no latency is recorded
+            record_rest_outcome(route_class(path), None, False)
+        return True
+
 class CopyButton(discord.ui.Button):
     def __init__(self, label: str, command: str):
         super().__init__(
@@ -50,136 +1821,153 @@ class CopyButton(discord.ui.Button):
             ephemeral=True
         )
 
-class LobbyView(discord.ui.View):
-    def __init__(self, owner_id, lobby_channel, lobby_hash):
-        super().__init__(timeout=None)  # Persistent view
-        self.owner_id = owner_id
-        self.lobby_channel = lobby_channel
-        self.lobby_hash = lobby_hash
-        self.max_players = 3
-        
-    @discord.ui.button(label='Join Game', style=discord.ButtonStyle.green, emoji='🎮', custom_id='join_game_button')
-    async def join_game(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # Check if lobby is full
-        if len(active_lobbies[self.lobby_channel.id]['players']) >= self.max_players:
-            await interaction.response.send_message(
-                f"❌ This lobby is full! ({len(active_lobbies[self.lobby_channel.id]['players'])}/3 players)\nPlayers in lobby: {', '.join([bot.get_user(pid).display_name for pid in active_lobbies[self.lobby_channel.id]['players']])}",
-                ephemeral=True
-            )
-            return
-            
-        await interaction.response.send_message(
-            "❌ This command is not available in this view.",
-            ephemeral=True
-        )
+def build_join_message(lobby):
+    """Render the join embed and button for a lobby from its in-memory record"""
+    channel = bot.get_channel(lobby['channel'])
+    players = lobby['players']
+    full = not free_seats(lobby)
+    embed = discord.Embed(
+        title="🕹️ NightReign Lobby",
+        color=0xff0000 if full else 0x00ff00,
+        timestamp=datetime.now()
+    )
+    player_list = []
+    for i, player_id in enumerate(players):
+        crown = "👑" if i == 0 else "🎮"
+        player_list.append(f"{crown} {display_name(channel.guild, player_id) if channel else 'Unknown'}")
+    embed.add_field(
+        name=f"Players ({len(players)}/{lobby_capacity(lobby)})",
+        value="\n".join(player_list) if player_list else "None",
+        inline=False
+    )
+    embed.add_field(
+        name="Lobby Channel",
+        value=channel.mention if channel else "Unknown",
+        inline=True
+    )
+    embed.add_field(
+        name="Status",
+        value="🔴 **LOBBY FULL** - Ready to play!" if full
+        else f"🟢 **OPEN** - Need {free_seats(lobby)} more player(s)",
+        inline=True
+    )
+    if describe_lobby(lobby):
+        embed.add_field(name="Details", value=describe_lobby(lobby), inline=False)
+    embed.add_field(
+        name="How to Join",
+        value=f"**Click Join Game, or copy and paste the command below:**\n```/join_lobby {lobby['hash']}```",
+        inline=False
+    )
+    embed.set_footer(text="Use the Quick Join command below to join this lobby!")
+    view = discord.ui.View(timeout=None)
+    view.add_item(LobbyJoinButton(lobby['channel'], full=full))
+    return embed, view
 
-    async def _update_lobby_message(self, interaction):
-        embed = discord.Embed(
-            title="🕹️ NightReign Lobby",
-            color=0x00ff00 if len(active_lobbies[self.lobby_channel.id]['players']) < self.max_players else 0xff0000,
-            timestamp=datetime.now()
-        )
-        player_list = []
-        for i, player_id in enumerate(active_lobbies[self.lobby_channel.id]['players']):
-            user = bot.get_user(player_id)
-            if user:
-                crown = "👑" if i == 0 else "🎮"
-                player_list.append(f"{crown} {user.display_name}")
-        embed.add_field(
-            name=f"Players ({len(active_lobbies[self.lobby_channel.id]['players'])}/{self.max_players})",
-            value="\n".join(player_list) if player_list else "None",
-            inline=False
-        )
-        embed.add_field(
-            name="Lobby Channel",
-            value=f"#{self.lobby_channel.name}",
-            inline=True
-        )
-        if len(active_lobbies[self.lobby_channel.id]['players']) >= self.max_players:
-            self.join_game.disabled = True
-            self.join_game.style = discord.ButtonStyle.red
-            self.join_game.label = "Lobby Full"
-            embed.add_field(
-                name="Status",
-                value="🔴 **LOBBY FULL** - Ready to play!",
-                inline=True
-            )
-        else:
-            self.join_game.disabled = False
-            self.join_game.style = discord.ButtonStyle.green
-            self.join_game.label = "Join Game"
-            embed.add_field(
-                name="Status",
-                value=f"🟢 **OPEN** - Need {self.max_players - len(active_lobbies[self.lobby_channel.id]['players'])} more player(s)",
-                inline=True
-            )
-        # Edit the original Join Game message in the command channel
-        lobby_data = active_lobbies[self.lobby_channel.id]
-        join_msg_id = lobby_data.get('join_message_id')
-        if join_msg_id:
-            for guild in bot.guilds:
-                for channel in guild.text_channels:
-                    try:
-                        msg = await channel.fetch_message(join_msg_id)
-                        await msg.edit(embed=embed, view=self)
-                        return
-                    except Exception:
-                        continue
-        # Fallback: edit the interaction message if original not found
-        await interaction.response.edit_message(embed=embed, view=self)
-
-class LobbyChannelView(discord.ui.View):
-    def __init__(self, lobby_data):
-        super().__init__(timeout=None)
-        self.lobby_data = lobby_data
-        
-    def get_live_players(self, channel_id):
-        # Always get the latest player list from active_lobbies
-        lobby = active_lobbies.get(channel_id)
-        if lobby:
-            return lobby['players']
-        return []
-        
-    @discord.ui.button(label='Leave Lobby', style=discord.ButtonStyle.red, emoji='🚪')
-    async def leave_lobby(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_message(
-            "❌ This command is not available in this view.",
-            ephemeral=True
-        )
+async def refresh_join_message(lobby):
+    """Edit the lobby's join message so the player list and button match the record"""
+    await asyncio.sleep(JOIN_REFRESH_DELAY)
+    join_refresh_tasks.pop(lobby['channel'], None)
+    if active_lobbies.get(lobby['channel']) is not lobby:
+        return
+    join_channel = bot.get_channel(lobby.get('join_channel_id'))
+    if not join_channel or not lobby.get('join_message_id'):
+        return
+    embed, view = build_join_message(lobby)
+    try:
+        await join_channel.get_partial_message(lobby['join_message_id']).edit(embed=embed, view=view)
+    except discord.HTTPException as e:
+        logger.warning("Could not update join message: %s", e,
+                       extra={'lobby': lobby['channel'], 'guild': join_channel.guild.id})
 
-    @discord.ui.button(label='Invite Player', style=discord.ButtonStyle.primary, emoji='📨')
-    async def invite_player(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_message(
-            "❌ This command is not available in this view.",
-            ephemeral=True
-        )
+def schedule_join_refresh(lobby):
+    # Bursts of joins/leaves collapse into one edit of the join message
+    if lobby.get('join_message_id') and lobby['channel'] not in join_refresh_tasks:
+        join_refresh_tasks[lobby['channel']] = asyncio.create_task(refresh_join_message(lobby))
 
-    @discord.ui.button(label='End Session', style=discord.ButtonStyle.gray, emoji='🏁')
-    async def end_session(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_message(
-            "❌ This command is not available in this view.",
-            ephemeral=True
-        )
+@labelled('button:join')
+async def join_from_button(interaction, channel_id):
+    lobby = active_lobbies.get(channel_id)
+    channel = bot.get_channel(channel_id)
+    if not lobby or not channel:
+        await interaction.response.send_message("❌ This lobby no longer exists.", ephemeral=True)
+        return
 
-class LobbyListButton(discord.ui.View):
-    def __init__(self, lobby_channel):
-        super().__init__(timeout=None)
-        self.lobby_channel = lobby_channel
-        
-    @discord.ui.button(label='Join Lobby', style=discord.ButtonStyle.green, emoji='🎮')
-    async def join_lobby(self, interaction: discord.Interaction, button: discord.ui.Button):
+    existing_channel = bot.get_channel(user_sessions.get(interaction.user.id))
+    if existing_channel:
         await interaction.response.send_message(
-            "❌ This command is not available in this view.",
+            f"❌ You're already in an active lobby! Leave your current session first: {existing_channel.mention}",
             ephemeral=True
         )
+        return
+    user_sessions.pop(interaction.user.id, None)
+
+    try:
+        player_count = await grant_seat(lobby, channel, interaction.user, reason='button')
+    except LobbyFull as e:
+        position = join_waitlist(lobby, interaction.user.id, interaction.channel_id)
+        await interaction.response.send_message(full_lobby_message(e, channel.guild, lobby, position), ephemeral=True)
+        return
+    except SeatUnavailable as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    except discord.Forbidden:
+        await interaction.response.send_message("❌ I don't have permission to add you to this channel.", ephemeral=True)
+        return
+
+    await interaction.response.send_message(
+        f"🎮 You've joined the lobby! Click here to go to the channel: {channel.mention}", ephemeral=True
+    )
+    await channel.send(f"🎉 **{interaction.user.display_name}** joined the lobby! ({player_count}/{lobby_capacity(lobby)} players)")
+
+class LobbyJoinButton(discord.ui.DynamicItem[discord.ui.Button], template=r'lobby:join:(?P<channel_id>[0-9]+)'):
+    """Join button whose custom_id carries the lobby channel id; registered once, routed by pattern"""
+
+    def __init__(self, channel_id, full=False):
+        super().__init__(discord.ui.Button(
+            label='Lobby Full' if full else 'Join Game',
+            style=discord.ButtonStyle.red if full else discord.ButtonStyle.green,
+            emoji='🎮',
+            disabled=full,
+            custom_id=f'lobby:join:{channel_id}'
+        ))
+        self.channel_id = channel_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(int(match['channel_id']))
+
+    async def callback(self, interaction):
+        await join_from_button(interaction, self.channel_id)
+
+class LegacyJoinButton(discord.ui.DynamicItem[discord.ui.Button], template=r'join_(?P<channel_id>[0-9]+)'):
+    """Routes buttons posted with the old join_<channel id> custom_id"""
+
+    def __init__(self, channel_id):
+        super().__init__(discord.ui.Button(label='Join Game', custom_id=f'join_{channel_id}'))
+        self.channel_id = channel_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(int(match['channel_id']))
+
+    async def callback(self, interaction):
+        await join_from_button(interaction, self.channel_id)
+
+JOIN_BUTTONS = (LobbyJoinButton, LegacyJoinButton)
 
 class LobbyPaginator(discord.ui.View):
-    def __init__(self, lobbies_data, timeout=180):
+    """Pages through a set of lobby ids lazily, walking them in creation order from a cursor"""
+    def __init__(self, lobby_ids, filters=None, timeout=180):
         super().__init__(timeout=timeout)
-        self.lobbies_data = lobbies_data
+        self.lobby_ids = sorted(lobby_ids)  # Snowflakes, so this is creation order
+        self.filters = filters or {}
         self.current_page = 0
         self.lobbies_per_page = 5
-        self.total_pages = (len(lobbies_data) + self.lobbies_per_page - 1) // self.lobbies_per_page
+        self.total_pages = max(1, (len(lobby_ids) + self.lobbies_per_page - 1) // self.lobbies_per_page)
+        self.page_cursors = [0]  # Channel id each visited page starts after
+        self.available_spots = sum(
+            free_seats(active_lobbies[cid]) for cid in lobby_ids if cid in active_lobbies
+        )
         
         # Update button states
         self.update_buttons()
@@ -188,11 +1976,24 @@ class LobbyPaginator(discord.ui.View):
         self.previous_page.disabled = self.current_page == 0
         self.next_page.disabled = self.current_page >= self.total_pages - 1
     
+    def page_lobbies(self):
+        """Collect the current page's lobbies and remember where the next page starts"""
+        cursor = self.page_cursors[self.current_page]
+        page = []
+        for index in range(bisect_right(self.lobby_ids, cursor), len(self.lobby_ids)):
+            channel_id = self.lobby_ids[index]
+            lobby = active_lobbies.get(channel_id)
+            channel = bot.get_channel(channel_id)
+            if lobby is None or channel is None:
+                continue
+            page.append((lobby, channel))
+            if len(page) == self.lobbies_per_page:
+                break
+        if page and len(self.page_cursors) == self.current_page + 1:
+            self.page_cursors.append(page[-1][1].id)
+        return page
+    
     def get_page_embed(self):
-        start_idx = self.current_page * self.lobbies_per_page
-        end_idx = min(start_idx + self.lobbies_per_page, len(self.lobbies_data))
-        current_lobbies = self.lobbies_data[start_idx:end_idx]
-        
         embed = discord.Embed(
             title="🕹️ Active NightReign Lobbies",
             description="Use the commands below to join a lobby",
@@ -201,32 +2002,32 @@ class LobbyPaginator(discord.ui.View):
         )
         
         # Add lobbies for current page
-        for lobby_data in current_lobbies:
-            channel = bot.get_channel(lobby_data['channel_id'])
-            if not channel:
-                continue
-                
-            owner = bot.get_user(lobby_data['owner'])
-            owner_name = owner.display_name if owner else "Unknown"
+        for lobby, channel in self.page_lobbies():
+            owner_name = display_name(channel.guild, lobby['owner'])
+            names = player_names(channel.guild, lobby['players'])
+            details = describe_lobby(lobby)
             
             embed.add_field(
                 name=f"#{channel.name}",
                 value=(
                     f"👑 Owner: {owner_name}\n"
-                    f"👥 Players: {lobby_data['member_count']}/3\n"
-                    f"🎮 Players: {', '.join(lobby_data['player_list']) if lobby_data['player_list'] else 'None'}\n"
-                    f"🔑 Join Command: `/join_lobby {lobby_data['hash']}`"
+                    f"👥 Players: {len(lobby['players'])}/{lobby_capacity(lobby)}\n"
+                    f"🎮 Players: {', '.join(names) if names else 'None'}\n"
+                    + (f"{details}\n" if details else "")
+                    + f"🔑 Join Command: `/join_lobby {lobby['hash']}`"
                 ),
                 inline=True
             )
         
         # Add summary field
+        filter_text = ", ".join(f"{attr}: {value}" for attr, value in self.filters.items())
         embed.add_field(
             name="📊 Summary",
             value=(
-                f"Total Lobbies: {len(self.lobbies_data)}\n"
-                f"Available Spots: {sum(3 - data['member_count'] for data in self.lobbies_data)}\n"
-                f"Page {self.current_page + 1}/{self.total_pages}"
+                f"Total Lobbies: {len(self.lobby_ids)}\n"
+                f"Available Spots: {self.available_spots}\n"
+                + (f"Filters: {filter_text}\n" if filter_text else "")
+                + f"Page {self.current_page + 1}/{self.total_pages}"
             ),
             inline=False
         )
@@ -248,103 +2049,171 @@ class LobbyPaginator(discord.ui.View):
             self.update_buttons()
             await interaction.response.edit_message(embed=self.get_page_embed(), view=self)
 
-@bot.event
-async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
-    
-    # Register slash commands
-    try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
-    
-    # Store existing lobby channels before clearing
-    existing_lobbies = []
-    for guild in bot.guilds:
-        for channel in guild.text_channels:
-            if channel.name.startswith('lobby-'):
-                existing_lobbies.append(channel)
-    
+def adopt_saved_lobbies():
+    """Keep the lobby state loaded from the standby snapshot, dropping lobbies whose channel is gone"""
+    global standby_loaded
+    standby_loaded = False
+    for channel_id in [c for c in active_lobbies if bot.get_channel(c) is None]:
+        forget_lobby(discord.Object(id=channel_id))
+    logger.info("Took over %d lobbies %.2fs after the primary lock was released",
+                len(active_lobbies), time.perf_counter() - takeover_started)
+
+async def rebuild_lobbies(existing_lobbies):
+    """Rebuild lobby state from the lobby channels themselves"""
     # Clear active lobbies and sessions
-    active_lobbies.clear()
+    clear_lobbies()
     user_sessions.clear()
     
     # Send restart notification to existing lobbies
-    for channel in existing_lobbies:
-        try:
-            embed = discord.Embed(
-                title="🔄 Bot Restarted",
-                description=(
-                    "The bot was restarted for maintenance or updates.\n"
-                    "Most features should work as normal, but some features may temporarily behave differently.\n"
-                    "If you notice any issues, please ping @po1sontre.\n\n"
-                ),
-                color=0x00ff00
-            )
-            embed.set_footer(text="Thank you for your patience!")
-            await channel.send(embed=embed)
-        except Exception as e:
-            logger.error(f"Error sending restart message to {channel.name}: {e}")
+    embed = discord.Embed(
+        title="🔄 Bot Restarted",
+        description=(
+            "The bot was restarted for maintenance or updates.\n"
+            "Most features should work as normal, but some features may temporarily behave differently.\n"
+            "If you notice any issues, please ping @po1sontre.\n\n"
+        ),
+        color=0x00ff00
+    )
+    embed.set_footer(text="Thank you for your patience!")
+    if not skip_if_degraded('restart notices', 'messages'):
+        results = await run_rest_jobs('send', [{'channel_id': c.id, 'embed': embed.to_dict()} for c in existing_lobbies])
+        log_batch_failures("sending restart message to", existing_lobbies, results)
     
     # Continue with normal lobby restoration
-    for guild in bot.guilds:
-        for channel in guild.text_channels:
-            if channel.name.startswith('lobby-'):
-                players = []
-                owner_id = None
-                hash_message_id = None
-                lobby_hash = None
-                async for message in channel.history(limit=20):
-                    if message.author == bot.user and message.content and message.content.startswith('Lobby Hash:'):
-                        lobby_hash = message.content.split('`')[1]
-                        hash_message_id = message.id
-                        break
-                for member in channel.members:
-                    perms = channel.permissions_for(member)
-                    if perms.read_messages and perms.send_messages and not member.bot:
-                        players.append(member.id)
-                        if owner_id is None:
-                            owner_id = member.id
-                if owner_id is None and players:
-                    owner_id = players[0]
-                if owner_id and lobby_hash and hash_message_id:
-                    lobby_data = {
-                        'owner': owner_id,
-                        'players': players,
-                        'channel': channel.id,
-                        'created_at': datetime.utcnow(),
-                        'hash': lobby_hash,
-                        'hash_message_id': hash_message_id
-                    }
-                    active_lobbies[channel.id] = lobby_data
-                    for pid in players:
-                        user_sessions[pid] = channel.id
+    found_hashes = await run_rest_jobs('find_hash', [{'channel_id': c.id} for c in existing_lobbies])
+    log_batch_failures("restoring", existing_lobbies, found_hashes)
+    for channel, found in zip(existing_lobbies, found_hashes):
+        if isinstance(found, Exception):
+            continue
+        players = []
+        owner_id = None
+        lobby_hash, hash_message_id, max_players = found or (None, None, None)
+        for member in channel.members:
+            perms = channel.permissions_for(member)
+            if perms.read_messages and perms.send_messages and not member.bot:
+                players.append(member.id)
+                if owner_id is None:
+                    owner_id = member.id
+        if owner_id is None and players:
+            owner_id = players[0]
+        if owner_id and lobby_hash and hash_message_id:
+            lobby_data = {
+                'owner': owner_id,
+                'players': players,
+                'channel': channel.id,
+                'guild': channel.guild.id,
+                'created_at': datetime.utcnow(),
+                'hash': lobby_hash,
+                'hash_message_id': hash_message_id,
+                'version': 0
+            }
+            if max_players:
+                lobby_data['max_players'] = max_players
+            register_lobby(lobby_data)
+            for pid in players:
+                user_sessions[pid] = channel.id
+
+@bot.event
+async def on_ready():
+    global command_sync_task
+    mark_startup('ready')
+    logger.info("%s has connected to Discord!", bot.user)
+    
+    # Register slash commands in the background; it's rate limited and rarely needed
+    if command_sync_task is None:
+        command_sync_task = asyncio.create_task(sync_command_tree())
+    
+    # Index existing lobby channels before clearing
+    build_lobby_channel_index()
+    existing_lobbies = iter_lobby_channels()
+    
+    if standby_loaded:
+        adopt_saved_lobbies()
+    else:
+        await rebuild_lobbies(existing_lobbies)
+
+    mark_startup('restore')
+    record_event('ready', guilds=[
+        {'id': guild.id, 'name': guild.name, 'categories': [c.id for c in guild.categories],
+         'channels': [rec_channel(c) for c in guild.text_channels]}
+        for guild in bot.guilds
+    ], lobbies=[
+        {'channel': lobby['channel'], 'owner': lobby['owner'], 'players': lobby['players'],
+         'hash': lobby['hash'], 'hash_message_id': lobby['hash_message_id']}
+        for lobby in active_lobbies.values()
+    ])
     
     # Start the cleanup task
     if not cleanup_inactive_lobbies.is_running():
         cleanup_inactive_lobbies.start()
-        print("Started lobby cleanup task - running every 1 minute")
+        logger.info("Started lobby cleanup task - running every 1 minute")
     
     # Start the periodic announcement task
     if not periodic_announcement.is_running():
         periodic_announcement.start()
-        print("Started periodic announcement task - running every 4 hours")
+        logger.info("Started periodic announcement task - running every 4 hours")
+
+    if not run_matchmaker.is_running():
+        run_matchmaker.start()
+    if not evict_orphaned_state.is_running():
+        evict_orphaned_state.start()
+    if AUDIT_REST_BUDGET and not audit_lobbies.is_running():
+        audit_lobbies.start()
+    if SNAPSHOT_API_PORT and snapshot_runner is None:
+        await start_snapshot_api()
+    mark_startup('tasks')
+    report_startup()
+
+async def setup_hook():
+    # Called once login has completed, before the gateway connects
+    global stats_seed_task
+    mark_startup('login')
+    if LOBBY_EVENT_LOG and stats_seed_task is None:
+        stats_seed_task = asyncio.create_task(seed_lobby_stats())
+    load_guild_config()
+    bot.add_dynamic_items(*JOIN_BUTTONS)
+    start_rest_workers(os.getenv('DISCORD_TOKEN'))
+    start_lag_watchdog()
+    bot.http.request = monitored_request
+    logging.getLogger('discord.http').addFilter(RateLimitMonitor())
+
+bot.setup_hook = setup_hook
 
 @bot.event
 async def on_message(message):
     # Don't respond to our own messages
     if message.author == bot.user:
         return
+    record_event('message', id=message.id, channel=rec_channel(message.channel),
+                 author=rec_user(message.author), content=message.content)
+    lobby = active_lobbies.get(message.channel.id)
+    if lobby and not message.author.bot:
+        lobby['last_activity'] = datetime.utcnow()
 
     # Process commands
     await bot.process_commands(message)
 
+@bot.before_invoke
+async def before_command(ctx):
+    label_task(f"command:{ctx.command.qualified_name}")
+    record_event('command', name=ctx.command.qualified_name, author=rec_user(ctx.author),
+                 channel=rec_channel(ctx.channel), args=[rec_value(a) for a in ctx.args[1:]],
+                 kwargs={k: rec_value(v) for k, v in ctx.kwargs.items()})
+
+@bot.after_invoke
+async def after_command(ctx):
+    finish_profile()
+
 @bot.command(name='create_game', description='Create a new NightReign lobby')
-async def create_game(ctx):
-    """Create a new NightReign lobby"""
+@coalesce_per_user
+async def create_game(ctx, *, details: CreateFlags):
+    """Create a new NightReign lobby, optionally tagged with platform, region, style, start time and seat count"""
     try:
         user_id = ctx.author.id
+        max_players = details.max_players or MAX_PLAYERS
+        if not 2 <= max_players <= MAX_PLAYERS_LIMIT:
+            await ctx.send(f"❌ `max_players` must be between 2 and {MAX_PLAYERS_LIMIT}.", ephemeral=True)
+            return
         
         # Check if user already has an active session
         if user_id in user_sessions:
@@ -361,7 +2230,7 @@ async def create_game(ctx):
                 del user_sessions[user_id]
 
         # Get the category channel
-        category = ctx.guild.get_channel(1379101422318125159)
+        category = ctx.guild.get_channel(guild_config(ctx.guild.id)['lobby_category'])
         if not category:
             await ctx.send("❌ Could not find the lobby category channel.", ephemeral=True)
             return
@@ -388,7 +2257,8 @@ async def create_game(ctx):
             await ctx.send("❌ I don't have permission to create channels!", ephemeral=True)
             return
         except Exception as e:
-            logger.error(f"Error creating channel: {e}")
+            logger.error("Error creating channel: %s", e,
+                         extra={'guild': ctx.guild.id, 'command': 'create_game', 'user': user_id})
             await ctx.send("❌ An error occurred while creating the lobby channel.", ephemeral=True)
             return
 
@@ -398,19 +2268,28 @@ async def create_game(ctx):
             'owner': user_id,
             'players': [user_id],
             'channel': lobby_channel.id,
-            'created_at': datetime.now(),
+            'guild': ctx.guild.id,
+            'created_at': datetime.utcnow(),
             'hash': lobby_hash,
-            'hash_message_id': None
+            'hash_message_id': None,
+            'max_players': max_players,
+            'version': 0
         }
+        lobby_data.update(details.as_filters())
         
         try:
             # Store lobby data
-            active_lobbies[lobby_channel.id] = lobby_data
+            index_lobby_channel(lobby_channel)
+            lobbies_setting_up.add(lobby_channel.id)  # The auditor leaves it alone until the hash message exists
+            register_lobby(lobby_data)
             user_sessions[user_id] = lobby_channel.id
+            log_lobby_event('created', lobby_channel.id, ctx.guild.id, user_id, max_players=max_players,
+                            **details.as_filters())
             
             # Send the hash message in the lobby channel
-            hash_msg = await lobby_channel.send(f"Lobby Hash: `{lobby_hash}`\nQuick Join: `/join_lobby {lobby_hash}`")
+            hash_msg = await lobby_channel.send(hash_message_text(lobby_data))
             lobby_data['hash_message_id'] = hash_msg.id
+            lobbies_setting_up.discard(lobby_channel.id)
             
             # Send welcome message in lobby channel
             welcome_embed = discord.Embed(
@@ -436,34 +2315,12 @@ async def create_game(ctx):
             await lobby_channel.send(embed=welcome_embed)
             
             # Send join embed in the original channel
-            join_embed = discord.Embed(
-                title="🕹️ NightReign Lobby",
-                color=0x00ff00,
-                timestamp=datetime.now()
-            )
-            join_embed.add_field(
-                name="Players (1/3)",
-                value=f"👑 {ctx.author.display_name}",
-                inline=False
-            )
-            join_embed.add_field(
-                name="Lobby Channel",
-                value=f"{lobby_channel.mention}",
-                inline=True
-            )
-            join_embed.add_field(
-                name="Status",
-                value="🟢 **OPEN** - Need 2 more players",
-                inline=True
-            )
-            join_embed.add_field(
-                name="How to Join",
-                value=f"**To join this lobby, copy and paste the command below:**\n```/join_lobby {lobby_hash}```",
-                inline=False
-            )
-            join_embed.set_footer(text="Use the Quick Join command below to join this lobby!")
-            msg = await ctx.send(embed=join_embed)
+            remember_name(ctx.guild.id, ctx.author)
+            join_embed, join_view = build_join_message(lobby_data)
+            msg = await ctx.send(embed=join_embed, view=join_view)
             lobby_data['join_message_id'] = msg.id
+            lobby_data['join_channel_id'] = ctx.channel.id
+            journal_lobby(lobby_data)
             
             # Notify the user
             await ctx.send(
@@ -473,20 +2330,21 @@ async def create_game(ctx):
             )
             
         except Exception as e:
-            logger.error(f"Error setting up lobby: {e}")
+            logger.error("Error setting up lobby: %s", e,
+                         extra={'lobby': lobby_channel.id, 'guild': ctx.guild.id, 'command': 'create_game'})
             # Clean up if something goes wrong
             try:
                 await lobby_channel.delete(reason="Error during lobby setup")
             except:
                 pass
-            if lobby_channel.id in active_lobbies:
-                del active_lobbies[lobby_channel.id]
+            unregister_lobby(lobby_channel.id)
+            lobbies_setting_up.discard(lobby_channel.id)
             if user_id in user_sessions:
                 del user_sessions[user_id]
             await ctx.send("❌ An error occurred while setting up the lobby. Please try again.", ephemeral=True)
             
     except Exception as e:
-        logger.error(f"Unexpected error in create_game: {e}")
+        logger.exception("Unexpected error in create_game: %s", e, extra={'command': 'create_game'})
         await ctx.send("❌ An unexpected error occurred. Please try again.", ephemeral=True)
 
 @bot.command(name='my_lobby', description='Check your current lobby status')
@@ -523,144 +2381,422 @@ async def my_lobby(ctx):
         await ctx.send(f"🎮 Your active lobby: {lobby_channel.mention}")
 
 @bot.command(name='lobbies', description='List all active lobbies')
-async def list_lobbies(ctx):
-    """List all active lobbies with accurate player stats and join commands"""
+async def list_lobbies(ctx, *, filters: LobbyFlags):
+    """List open lobbies, optionally filtered by platform, region, style or start time"""
     if not active_lobbies:
         await ctx.send("🔍 No active lobbies found.")
         return
-    
-    # Collect all available lobby data
-    available_lobbies = []
-    for channel_id, lobby_data in active_lobbies.items():
-        channel = bot.get_channel(channel_id)
-        if not channel:
-            continue
-            
-        # Get member count by checking for the specific role
-        member_count = 0
-        player_list = []
-        for member in channel.members:
-            if any(role.id == 1242067709433217088 for role in member.roles):
-                member_count += 1
-                player_list.append(member.display_name)
-        
-        # Skip full lobbies
-        if member_count >= 3:
-            continue
-            
-        # Get the lobby hash
-        lobby_hash = lobby_data.get('hash', '')
-        if not lobby_hash:
-            continue
-            
-        available_lobbies.append({
-            'channel_id': channel_id,
-            'owner': lobby_data['owner'],
-            'member_count': member_count,
-            'player_list': player_list,
-            'hash': lobby_hash
+    
+    lobby_ids = find_lobbies(ctx.guild.id, **filters.as_filters())
+    if not lobby_ids:
+        await ctx.send("🔍 No available lobbies found.")
+        return
+    
+    # Create and send the paginated view
+    view = LobbyPaginator(lobby_ids, filters.as_filters())
+    await ctx.send(embed=view.get_page_embed(), view=view)
+
+# Add button callback for join buttons
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    if not interaction.data or 'custom_id' not in interaction.data:
+        return
+    # Buttons are routed by custom_id through the dynamic items added in setup_hook
+    record_event('interaction', custom_id=interaction.data['custom_id'],
+                 user=rec_user(interaction.user), channel=rec_channel(interaction.channel))
+
+@tasks.loop(minutes=1)
+@labelled('task:cleanup_inactive_lobbies')
+async def cleanup_inactive_lobbies():
+    """Clean up inactive lobbies that haven't had messages in 2 hours, or 10 minutes if newly created"""
+    record_event('task', name='cleanup_inactive_lobbies')
+    if skip_if_degraded('lobby sweeps', 'messages', 'channels'):
+        return
+    await asyncio.gather(*(sweep_shard(shard_id) for shard_id in list(lobby_channel_index) if shard_connected(shard_id)))
+
+async def sweep_shard(shard_id):
+    """Expire the inactive lobbies of one shard's guilds"""
+    now = datetime.utcnow()
+    to_delete = []
+    
+    # Check every indexed lobby channel's last non-bot message
+    channels = [channel for channel in iter_lobby_channels(shard_id) if channel.id in active_lobbies]
+    last_activity = await run_rest_jobs('last_activity', [{'channel_id': c.id} for c in channels])
+    log_batch_failures("checking", channels, last_activity, shard=shard_id)
+    for channel, last_active in zip(channels, last_activity):
+        try:
+            if isinstance(last_active, Exception):
+                continue
+
+            # If no user messages in 2 hours, mark for deletion
+            if last_active is not None:
+                message_age = now - datetime.utcfromtimestamp(last_active)
+                if message_age > timedelta(hours=2):
+                    to_delete.append(channel.id)
+                    logger.info("Marking channel %s for deletion - no activity for %.1f hours",
+                                channel.name, message_age.total_seconds() / 3600,
+                                extra={'lobby': channel.id, 'guild': channel.guild.id})
+            else:
+                # If no messages at all, check channel age
+                channel_age = now - channel.created_at.replace(tzinfo=None)
+                if channel_age > timedelta(hours=2):
+                    to_delete.append(channel.id)
+                    logger.info("Marking channel %s for deletion - no messages and %.1f hours old",
+                                channel.name, channel_age.total_seconds() / 3600,
+                                extra={'lobby': channel.id, 'guild': channel.guild.id})
+
+        except Exception as e:
+            logger.error("Error checking channel %s: %s", channel.name, e,
+                         extra={'lobby': channel.id, 'guild': channel.guild.id})
+            continue
+
+    # Delete marked channels
+    deleted = []
+    for channel_id in to_delete:
+        channel = bot.get_channel(channel_id)
+        if channel:
+            # Clean up data structures
+            if channel_id in active_lobbies:
+                lobby = active_lobbies[channel_id]
+                for pid in lobby['players']:
+                    if pid in user_sessions:
+                        del user_sessions[pid]
+                unregister_lobby(channel_id)
+                log_lobby_event('expired', channel_id, channel.guild.id, players=len(lobby['players']))
+            deleted.append(channel)
+
+    results = await run_rest_jobs('delete_channel', [
+        {'channel_id': c.id, 'reason': "Inactive lobby cleanup"} for c in deleted
+    ])
+    log_batch_failures("deleting", deleted, results, shard=shard_id)
+    for channel, result in zip(deleted, results):
+        if not isinstance(result, Exception):
+            logger.info("Deleted inactive channel %s", channel.name,
+                        extra={'lobby': channel.id, 'guild': channel.guild.id})
+
+@tasks.loop(minutes=1)
+@labelled('task:evict_orphaned_state')
+async def evict_orphaned_state():
+    """Evict orphaned and expired entries, then check resident memory against the budget"""
+    evict_orphans()
+    check_memory_budget()
+
+def evict_orphans():
+    """Drop entries that have pointed at a missing lobby or channel for longer than ORPHAN_TTL"""
+    global orphaned_since
+    cutoff = datetime.now() - timedelta(seconds=MATCH_REQUEST_TTL)
+    for user_id in [uid for uid, request in pending_requests.items() if request['timestamp'] < cutoff]:
+        timeout = request_timeouts.pop(pending_requests.pop(user_id)['request_id'], None)
+        if timeout is not None:
+            timeout.cancel()
+        evicted_entries['pending_requests'] += 1
+
+    if not all(shard_connected(shard_id) for shard_id in lobby_channel_index):
+        return  # A reconnecting shard's channel cache can't tell us what is gone
+    now = time.monotonic()
+    candidates = [('active_lobbies', cid) for cid in active_lobbies if bot.get_channel(cid) is None]
+    candidates += [
+        ('user_sessions', uid) for uid, cid in user_sessions.items()
+        if cid not in active_lobbies and bot.get_channel(cid) is None
+    ]
+    candidates += [('lobby_channel_index', c.id) for c in iter_lobby_channels() if bot.get_channel(c.id) is None]
+    still_orphaned = {}
+    for key in candidates:
+        since = orphaned_since.get(key, now)
+        if now - since < ORPHAN_TTL:
+            still_orphaned[key] = since
+            continue
+        structure, entry = key
+        if structure == 'active_lobbies':
+            lobby = forget_lobby(discord.Object(id=entry))
+            if lobby:
+                log_lobby_event('ended', entry, lobby.get('guild'), reason='orphaned', players=len(lobby['players']))
+        elif structure == 'user_sessions':
+            user_sessions.pop(entry, None)
+        else:
+            unindex_lobby_channel(entry)
+        evicted_entries[structure] += 1
+    orphaned_since = still_orphaned
+
+def deep_size(obj, seen=None):
+    """Approximate bytes held by plain containers and their contents, counting shared objects once"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+def memory_report():
+    """(structure, entries, approximate bytes) for each tracked structure, largest first"""
+    rows = [(name, len(globals()[name]), deep_size(globals()[name])) for name in MEMORY_TRACKED]
+    rows.append(('lobby_stats', len(lobby_stats.hourly) + len(lobby_stats.daily) + len(lobby_stats.lobby_created),
+                 deep_size(vars(lobby_stats))))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+def process_rss():
+    """Resident memory in bytes, or None where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def check_memory_budget():
+    global memory_over_budget
+    rss = process_rss()
+    if not MEMORY_BUDGET_MB or rss is None:
+        return
+    over = rss > MEMORY_BUDGET_MB * 2**20
+    if over and not memory_over_budget:
+        largest = ", ".join(f"{name} {entries} entries ~{size / 1024:.0f}KB" for name, entries, size in memory_report()[:5])
+        logger.warning("Resident memory %.0fMB is over the %.0fMB budget; largest structures: %s",
+                       rss / 2**20, MEMORY_BUDGET_MB, largest)
+    elif memory_over_budget and not over:
+        logger.info("Resident memory back under budget at %.0fMB", rss / 2**20)
+    memory_over_budget = over
+
+@tasks.loop(seconds=AUDIT_TICK)
+@labelled('task:audit_lobbies')
+async def audit_lobbies():
+    """Check the next few lobbies against Discord and repair drift, within the REST budget"""
+    global audit_tokens, audit_cursor
+    per_tick = AUDIT_REST_BUDGET * AUDIT_TICK / 60
+    audit_tokens = min(per_tick, audit_tokens + per_tick)
+    if skip_if_degraded('audit', 'channels', 'messages'):
+        return
+    for _ in range(min(AUDIT_SLICE, len(lobby_order))):
+        if not lobby_order:
+            break  # The previous audit ended the last lobby
+        index = bisect_right(lobby_order, audit_cursor)
+        if index == len(lobby_order):
+            finish_audit_pass()
+            index = 0
+        lobby = active_lobbies[lobby_order[index]]
+        if lobby['channel'] in lobbies_setting_up:
+            audit_cursor = lobby['channel']  # create_game is still posting its messages; audit it next pass
+            continue
+        # Reads are paid up front; a repair may overrun into the next tick
+        if audit_tokens < 1 + bool(lobby.get('hash_message_id')) + bool(lobby.get('join_message_id')):
+            break
+        audit_cursor = lobby['channel']
+        if audit_pass['started'] is None:
+            audit_pass['started'] = time.monotonic()
+        audit_pass['lobbies'] += 1
+        try:
+            await audit_lobby(lobby)
+        except discord.HTTPException as e:
+            logger.warning("Could not audit lobby: %s", e, extra={'lobby': lobby['channel'], 'guild': lobby.get('guild')})
+        except Exception:
+            # One broken lobby must not stop the task, or every later lobby goes unaudited
+            logger.exception("Error auditing lobby", extra={'lobby': lobby['channel'], 'guild': lobby.get('guild')})
+
+def finish_audit_pass():
+    global last_audit_pass
+    if audit_pass['started'] is None:
+        return
+    last_audit_pass = (audit_pass['lobbies'], time.monotonic() - audit_pass['started'], audit_pass['drift'])
+    logger.info("Audit pass checked %d lobbies in %.0fs and repaired %d drifted",
+                last_audit_pass[0], last_audit_pass[1], last_audit_pass[2])
+    audit_pass.update(started=None, lobbies=0, drift=0)
+
+def audit_call(kind='read'):
+    global audit_tokens
+    audit_tokens -= 1
+    audit_rest_calls[kind] += 1
+
+def record_drift(check, lobby, detail):
+    audit_drift[check] += 1
+    audit_pass['drift'] += 1
+    logger.info("Audit found %s drift: %s", check, detail, extra={'lobby': lobby['channel'], 'guild': lobby.get('guild')})
+
+async def audit_lobby(lobby):
+    """Compare one lobby's channel, overwrites, hash message and join message with Discord"""
+    channel_id = lobby['channel']
+    guild = bot.get_guild(lobby.get('guild'))
+    if guild is None:
+        return  # Orphan eviction handles lobbies of guilds the bot left
+    version = lobby['version']
+    audit_call()
+    audit_checked['channel'] += 1
+    try:
+        channel = await guild.fetch_channel(channel_id)
+    except discord.NotFound:
+        record_drift('channel', lobby, "the channel was deleted")
+        if forget_lobby(discord.Object(id=channel_id)):
+            log_lobby_event('ended', channel_id, guild.id, reason='audit', players=len(lobby['players']))
+        return
+
+    audit_checked['overwrites'] += 1
+    async with lobby_lock(channel_id):
+        # A seat change since the fetch means the fetched overwrites are already stale
+        if active_lobbies.get(channel_id) is lobby and lobby['version'] == version and channel_id not in pending_overwrites:
+            overwrites = desired_overwrites(lobby, channel)
+            if overwrites != channel.overwrites:
+                record_drift('overwrites', lobby, "overwrites don't match the players")
+                audit_call('repair')
+                await channel.edit(overwrites=overwrites)
+
+    # Only a known hash message that Discord no longer has is drift; without an id there is nothing to compare
+    if lobby.get('hash_message_id') and channel_id not in lobbies_setting_up:
+        audit_checked['hash_message'] += 1
+        audit_call()
+        try:
+            await channel.fetch_message(lobby['hash_message_id'])
+        except discord.NotFound:
+            if active_lobbies.get(channel_id) is lobby:
+                record_drift('hash_message', lobby, "the hash message is missing")
+                audit_call('repair')
+                lobby['hash_message_id'] = (await channel.send(hash_message_text(lobby))).id
+                journal_lobby(lobby)
+
+    join_channel = bot.get_channel(lobby.get('join_channel_id'))
+    if not lobby.get('join_message_id') or not join_channel or channel_id in join_refresh_tasks:
+        return
+    audit_checked['join_message'] += 1
+    audit_call()
+    try:
+        join_message = await join_channel.fetch_message(lobby['join_message_id'])
+    except discord.NotFound:
+        record_drift('join_message', lobby, "the join message was deleted")
+        lobby.pop('join_message_id', None)
+        journal_lobby(lobby)
+        return
+    embed, view = build_join_message(lobby)
+    shown = [(field.name, field.value) for field in join_message.embeds[0].fields] if join_message.embeds else None
+    if shown != [(field.name, field.value) for field in embed.fields] and active_lobbies.get(channel_id) is lobby:
+        record_drift('join_message', lobby, "the join message is out of date")
+        audit_call('repair')
+        await join_message.edit(embed=embed, view=view)
+
+def lobby_snapshot():
+    """Plain data for the snapshot API; ids are strings since snowflakes overflow JavaScript numbers"""
+    guilds = {}
+    def guild_entry(guild_id):
+        return guilds.setdefault(str(guild_id), {'lobbies': [], 'open_lobbies': 0, 'players': 0,
+                                                 'match_queue': 0, 'waitlisted': 0})
+    for channel_id in lobby_order:
+        lobby = active_lobbies[channel_id]
+        entry = guild_entry(lobby.get('guild'))
+        waitlisted = len(lobby_waitlists.get(channel_id, ()))
+        entry['lobbies'].append({
+            'channel': str(channel_id),
+            'owner': str(lobby['owner']),
+            'players': len(lobby['players']),
+            'max_players': lobby_capacity(lobby),
+            'open': channel_id in open_lobbies,
+            'waitlisted': waitlisted,
+            'created_at': lobby['created_at'].replace(tzinfo=None).isoformat() + 'Z' if lobby.get('created_at') else None,
+            **{attr: lobby[attr] for attr in LOBBY_ATTRIBUTES if lobby.get(attr) is not None},
         })
-    
-    if not available_lobbies:
-        await ctx.send("🔍 No available lobbies found.")
+        entry['open_lobbies'] += channel_id in open_lobbies
+        entry['players'] += len(lobby['players'])
+        entry['waitlisted'] += waitlisted
+    for queued in match_queue.values():
+        guild_entry(queued['guild'])['match_queue'] += 1
+    return {'version': state_version, 'generated_at': datetime.utcnow().isoformat() + 'Z', 'guilds': guilds}
+
+def encode_snapshot(data):
+    body = json.dumps(data, separators=(',', ':')).encode()
+    return body, gzip.compress(body, compresslevel=6)
+
+async def current_snapshot():
+    """The cached snapshot, rebuilt first if the state changed since it was built"""
+    global snapshot_cache, snapshot_built_at
+    async with snapshot_lock:
+        if snapshot_cache is not None and (snapshot_cache[0] == state_version
+                                           or time.monotonic() - snapshot_built_at < SNAPSHOT_MIN_INTERVAL):
+            return snapshot_cache
+        data = lobby_snapshot()
+        # Only the copied data leaves the loop; serializing it doesn't hold up the gateway
+        body, gzipped = await asyncio.get_running_loop().run_in_executor(None, encode_snapshot, data)
+        snapshot_cache = (data['version'], f'"{snapshot_boot}-{data["version"]}"', body, gzipped)
+        snapshot_built_at = time.monotonic()
+        return snapshot_cache
+
+def etag_matches(header, etag):
+    return any(tag.strip().removeprefix('W/') in (etag, '*') for tag in header.split(','))
+
+async def serve_lobbies(request):
+    _, etag, body, gzipped = await current_snapshot()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return web.Response(status=304, headers=headers)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        body = gzipped
+    return web.Response(body=body, content_type='application/json', headers=headers)
+
+async def start_snapshot_api():
+    """Serve the snapshot API from the bot's own loop; requests never reach Discord"""
+    global snapshot_runner
+    app = web.Application()
+    app.router.add_get('/lobbies', serve_lobbies)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, SNAPSHOT_API_HOST, SNAPSHOT_API_PORT).start()
+    except OSError as e:
+        logger.error("Snapshot API could not listen on %s:%d: %s", SNAPSHOT_API_HOST, SNAPSHOT_API_PORT, e)
+        await runner.cleanup()
         return
-    
-    # Create and send the paginated view
-    view = LobbyPaginator(available_lobbies)
-    await ctx.send(embed=view.get_page_embed(), view=view)
+    snapshot_runner = runner
+    logger.info("Snapshot API listening on http://%s:%d/lobbies", SNAPSHOT_API_HOST, SNAPSHOT_API_PORT)
 
-# Add button callback for join buttons
 @bot.event
-async def on_interaction(interaction: discord.Interaction):
-    if not interaction.data or 'custom_id' not in interaction.data:
-        return
-        
-    if interaction.data['custom_id'].startswith('join_'):
-        channel_id = int(interaction.data['custom_id'].split('_')[1])
-        channel = bot.get_channel(channel_id)
-        
-        if not channel:
-            await interaction.response.send_message("❌ This lobby no longer exists.", ephemeral=True)
-            return
-            
-        # Get the lobby hash
-        lobby_hash = None
-        async for message in channel.history(limit=20):
-            if message.author == bot.user and message.content and message.content.startswith('Lobby Hash:'):
-                lobby_hash = message.content.split('`')[1]
-                break
-        
-        if not lobby_hash:
-            await interaction.response.send_message("❌ Could not find lobby information.", ephemeral=True)
-            return
-            
-        # Create a temporary view to handle the join
-        view = LobbyView(active_lobbies[channel_id]['owner'], channel, lobby_hash)
-        await view.join_game(interaction, None)
+async def on_guild_channel_create(channel):
+    if is_lobby_channel(channel):
+        index_lobby_channel(channel)
 
-@tasks.loop(minutes=1)
-async def cleanup_inactive_lobbies():
-    """Clean up inactive lobbies that haven't had messages in 2 hours, or 10 minutes if newly created"""
-    now = datetime.utcnow()
-    to_delete = []
-    
-    # First check all channels that start with 'lobby-'
-    for guild in bot.guilds:
-        for channel in guild.text_channels:
-            if not channel.name.startswith('lobby-'):
-                continue
-                
-            try:
-                # Get the lobby data
-                lobby = active_lobbies.get(channel.id)
-                if not lobby:
-                    continue
-
-                # Check last non-bot message
-                last_user_message = None
-                async for msg in channel.history(limit=50):
-                    if not msg.author.bot:  # Only count non-bot messages
-                        last_user_message = msg
-                        break
+@bot.event
+async def on_guild_channel_delete(channel):
+    unindex_lobby_channel(channel.id, channel.guild)
+    lobby = unregister_lobby(channel.id)
+    if lobby:
+        log_lobby_event('ended', channel.id, channel.guild.id, reason='deleted', players=len(lobby['players']))
+        for pid in lobby['players']:
+            if user_sessions.get(pid) == channel.id:
+                del user_sessions[pid]
 
-                # If no user messages in 2 hours, mark for deletion
-                if last_user_message:
-                    message_age = now - last_user_message.created_at.replace(tzinfo=None)
-                    if message_age > timedelta(hours=2):
-                        to_delete.append(channel.id)
-                        logger.info(f"Marking channel {channel.name} for deletion - no activity for {message_age.total_seconds()/3600:.1f} hours")
-                else:
-                    # If no messages at all, check channel age
-                    channel_age = now - channel.created_at.replace(tzinfo=None)
-                    if channel_age > timedelta(hours=2):
-                        to_delete.append(channel.id)
-                        logger.info(f"Marking channel {channel.name} for deletion - no messages and {channel_age.total_seconds()/3600:.1f} hours old")
+@bot.event
+async def on_guild_channel_update(before, after):
+    if getattr(before, 'category_id', None) != getattr(after, 'category_id', None) or before.name != after.name:
+        unindex_lobby_channel(before.id, before.guild)
+        if is_lobby_channel(after):
+            index_lobby_channel(after)
 
-            except Exception as e:
-                logger.error(f"Error checking channel {channel.name}: {e}")
-                continue
+@bot.event
+async def on_guild_remove(guild):
+    unindex_guild(guild)
+    for channel_id in list(guild_lobbies.get(guild.id, ())):
+        forget_lobby(discord.Object(id=channel_id))
 
-    # Delete marked channels
-    for channel_id in to_delete:
-        try:
-            channel = bot.get_channel(channel_id)
-            if channel:
-                # Clean up data structures
-                if channel_id in active_lobbies:
-                    lobby = active_lobbies[channel_id]
-                    for pid in lobby['players']:
-                        if pid in user_sessions:
-                            del user_sessions[pid]
-                    del active_lobbies[channel_id]
-                
-                await channel.delete(reason="Inactive lobby cleanup")
-                logger.info(f"Deleted inactive channel {channel.name}")
-        except Exception as e:
-            logger.error(f"Error deleting channel {channel_id}: {e}")
+@bot.event
+async def on_member_update(before, after):
+    if before.display_name != after.display_name:
+        remember_name(after.guild.id, after)
+
+@bot.event
+async def on_user_update(before, after):
+    if before.display_name != after.display_name:
+        # Global name changes show through in every guild without a nickname
+        for guild in bot.guilds:
+            forget_name(guild.id, after.id)
+
+@bot.event
+async def on_member_remove(member):
+    forget_name(member.guild.id, member.id)
 
 @bot.event
 async def on_member_join(member):
     """Send welcome message to new members"""
+    record_event('member_join', member=rec_user(member), guild=member.guild.id)
+    if skip_if_degraded('welcome messages', 'dm', 'messages'):
+        return
     # Wait a bit to ensure the member is fully joined
     await asyncio.sleep(1)
     
@@ -691,15 +2827,23 @@ async def on_member_join(member):
                     await channel.send(f"{member.mention}", embed=embed)
                     break
     except Exception as e:
-        logger.error(f"Error sending welcome message to {member}: {e}")
+        logger.error("Error sending welcome message to %s: %s", member, e,
+                     extra={'guild': member.guild.id, 'user': member.id})
 
 @tasks.loop(hours=4)
+@labelled('task:periodic_announcement')
 async def periodic_announcement():
     """Send periodic quick start reminders about the bot's features"""
+    record_event('task', name='periodic_announcement')
+    if skip_if_degraded('announcements', 'messages'):
+        return
     for guild in bot.guilds:
+        channel_id = guild_config(guild.id)['announcement_channel']
+        if channel_id is None:
+            continue
         try:
             # Get the specific announcement channel
-            announcement_channel = guild.get_channel(1242067710385590293)
+            announcement_channel = guild.get_channel(channel_id)
             
             if announcement_channel:
                 embed = discord.Embed(
@@ -716,9 +2860,85 @@ async def periodic_announcement():
                 )
                 await announcement_channel.send(embed=embed)
             else:
-                logger.error(f"Could not find announcement channel in {guild}")
+                logger.error("Could not find announcement channel in %s", guild, extra={'guild': guild.id})
         except Exception as e:
-            logger.error(f"Error sending periodic announcement to {guild}: {e}")
+            logger.error("Error sending periodic announcement to %s: %s", guild, e, extra={'guild': guild.id})
+
+@tasks.loop(seconds=MATCH_TICK)
+@labelled('task:run_matchmaker')
+async def run_matchmaker():
+    """Seat queued /find_match auto players in open lobbies, one batch per guild"""
+    record_event('task', name='run_matchmaker')
+    now = datetime.utcnow()
+    for user_id, entry in list(match_queue.items()):
+        if user_id in user_sessions:
+            del match_queue[user_id]
+            touch_state()
+        elif now - entry['queued_at'] > timedelta(seconds=MATCH_QUEUE_TIMEOUT):
+            del match_queue[user_id]
+            touch_state()
+            log_lobby_event('match_expired', guild=entry['guild'], user=user_id)
+            channel = bot.get_channel(entry['channel'])
+            if channel:
+                try:
+                    await channel.send(f"⌛ <@{user_id}> no lobby opened up for you in time. Use `/find_match` to try again.")
+                except Exception as e:
+                    logger.error("Error telling queued player their match expired: %s", e,
+                                 extra={'guild': entry['guild'], 'user': user_id})
+    if not match_queue:
+        return
+
+    by_guild = {}
+    for entry in match_queue.values():
+        by_guild.setdefault(entry['guild'], []).append(entry)
+
+    matches = []
+    for guild_id, entries in by_guild.items():
+        lobbies = [active_lobbies[c] for c in open_lobbies.intersection(guild_lobbies.get(guild_id, ()))]
+        try:
+            matches.extend(solve_matches(entries, lobbies, now))
+        except Exception:
+            # A bad lobby or entry only costs its guild this pass, not the task
+            logger.exception("Matchmaker pass failed", extra={'guild': guild_id})
+    if matches:
+        results = await asyncio.gather(*(seat_match(user_id, channel_id) for user_id, channel_id in matches),
+                                       return_exceptions=True)
+        seated = sum(1 for result in results if result is True)
+        logger.info("Matchmaker seated %d of %d queued players (%d proposed)", seated, seated + len(match_queue), len(matches))
+
+async def seat_match(user_id, channel_id):
+    """Apply one matchmaker assignment; the player stays queued if the seat is gone"""
+    entry = match_queue.get(user_id)
+    lobby = active_lobbies.get(channel_id)
+    channel = bot.get_channel(channel_id)
+    if not entry or not lobby or not channel:
+        return False
+    member = channel.guild.get_member(user_id)
+    try:
+        if member is None:
+            member = await channel.guild.fetch_member(user_id)
+        player_count = await grant_seat(lobby, channel, member, reason='matched')
+    except discord.NotFound:
+        match_queue.pop(user_id, None)
+        touch_state()
+        return False
+    except SeatUnavailable:
+        return False
+    except Exception as e:
+        logger.error("Error seating matched player: %s", e, extra={'lobby': channel_id, 'guild': channel.guild.id, 'user': user_id})
+        return False
+    match_queue.pop(user_id, None)
+    touch_state()
+    log_lobby_event('match_accepted', channel_id, channel.guild.id, user_id, via='matchmaker')
+    # The seat is taken either way; a failed announcement is only logged
+    try:
+        await channel.send(f"🎉 **{member.display_name}** was matched into the lobby! ({player_count}/{lobby_capacity(lobby)} players)")
+        request_channel = bot.get_channel(entry['channel'])
+        if request_channel:
+            await request_channel.send(f"🎮 {member.mention} you've been matched into a lobby: {channel.mention}")
+    except Exception as e:
+        logger.error("Error announcing matched player: %s", e, extra={'lobby': channel_id, 'guild': channel.guild.id, 'user': user_id})
+    return True
 
 @bot.command(name='leave_lobby', description='Leave your current lobby')
 async def leave_lobby(ctx):
@@ -726,37 +2946,33 @@ async def leave_lobby(ctx):
     user_id = ctx.author.id
     
     # First check if they're in the channel they're trying to leave from
-    if ctx.channel.name.startswith('lobby-'):
+    if is_lobby_channel(ctx.channel):
         # They're in a lobby channel, check if they have permissions
         if not ctx.channel.permissions_for(ctx.author).read_messages:
             await ctx.send("❌ You don't have access to this lobby.")
             return
             
-        # Remove their permissions from this channel
+        # Release their seat and remove their permissions from this channel
         try:
-            await ctx.channel.set_permissions(ctx.author, overwrite=None)
+            lobby = active_lobbies.get(ctx.channel.id)
+            # revoke_seat clears the session only if it still points here; it may
+            # already point at a lobby they joined since
+            await revoke_seat(lobby, ctx.channel, ctx.author)
+            end_if_empty(lobby, ctx.channel)
             await ctx.channel.send(f"👋 **{ctx.author.display_name}** left the lobby.")
-            
-            # Clean up user_sessions
-            if user_id in user_sessions:
-                del user_sessions[user_id]
-            
-            # Clean up active_lobbies
-            if ctx.channel.id in active_lobbies:
-                lobby = active_lobbies[ctx.channel.id]
-                if user_id in lobby['players']:
-                    lobby['players'].remove(user_id)
-                    if len(lobby['players']) == 0:
-                        del active_lobbies[ctx.channel.id]
-            
             await ctx.send("✅ You have left the lobby.", ephemeral=True)
         except Exception as e:
-            logger.error(f"Error removing permissions for user {ctx.author}: {e}")
+            end_if_empty(lobby, ctx.channel)
+            logger.error("Error removing permissions for user %s: %s", ctx.author, e,
+                         extra={'lobby': ctx.channel.id, 'guild': ctx.guild.id, 'command': 'leave_lobby'})
             await ctx.send("❌ Error removing you from the lobby.")
         return
     
     # If they're not in a lobby channel, check user_sessions
     if user_id not in user_sessions:
+        if leave_waitlist(user_id) is not None:
+            await ctx.send("✅ You have left the waitlist.", ephemeral=True)
+            return
         await ctx.send("❌ You are not in any lobby.")
         return
         
@@ -770,26 +2986,24 @@ async def leave_lobby(ctx):
         await ctx.send("✅ You have been removed from the lobby.", ephemeral=True)
         return
         
-    # Remove user from active_lobbies if tracked
+    # Release the seat, then end the lobby if that emptied it, so 'ended' follows 'left' in the log
     lobby = active_lobbies.get(channel_id)
-    if lobby and user_id in lobby['players']:
-        lobby['players'].remove(user_id)
-        if len(lobby['players']) == 0:
-            del active_lobbies[channel_id]
-    
     try:
-        await channel.set_permissions(ctx.author, overwrite=None)
+        await revoke_seat(lobby, channel, ctx.author)
+        end_if_empty(lobby, channel)
         await channel.send(f"👋 **{ctx.author.display_name}** left the lobby.")
         await ctx.send("✅ You have left the lobby.", ephemeral=True)
     except Exception as e:
-        logger.error(f"Error removing permissions for user {ctx.author}: {e}")
+        end_if_empty(lobby, channel)  # The seat was released before the permission update failed
+        logger.error("Error removing permissions for user %s: %s", ctx.author, e,
+                     extra={'lobby': channel_id, 'guild': ctx.guild.id, 'command': 'leave_lobby'})
         await ctx.send("❌ Error removing you from the lobby.")
 
 @bot.command(name='end_lobby', description='End the current lobby (owner/mod/role only)')
 async def end_lobby(ctx):
     """End the current lobby"""
     # First check if this is a lobby channel
-    if not ctx.channel.name.startswith('lobby-'):
+    if not is_lobby_channel(ctx.channel):
         await ctx.send("❌ This command can only be used in lobby channels.")
         return
         
@@ -799,11 +3013,11 @@ async def end_lobby(ctx):
         return
         
     # Check if user has the required role
-    has_role = any(role.id == 1242067709433217088 for role in ctx.author.roles)
+    has_role = any(role.id == guild_config(ctx.guild.id)['lobby_role'] for role in ctx.author.roles)
     
     # Check if user is owner, mod, or has the specific role
     is_owner = False
-    is_mod = ctx.author.guild_permissions.administrator or ctx.author.guild_permissions.manage_channels
+    is_mod = is_moderator(ctx.author)
     
     # Try to get lobby data
     lobby = active_lobbies.get(ctx.channel.id)
@@ -819,18 +3033,23 @@ async def end_lobby(ctx):
         for pid in lobby['players']:
             if pid in user_sessions:
                 del user_sessions[pid]
-        del active_lobbies[ctx.channel.id]
+        unregister_lobby(ctx.channel.id)
+        log_lobby_event('ended', ctx.channel.id, ctx.guild.id, ctx.author.id, players=len(lobby['players']))
     
     await ctx.send("🏁 **Session ended.** Channel will be deleted in 10 seconds...")
     await asyncio.sleep(10)
     try:
-        await ctx.channel.delete(reason="Session ended by owner/mod/role")
+        await submit_rest_job('delete_channel', channel_id=ctx.channel.id, reason="Session ended by owner/mod/role")
     except Exception:
         pass
 
-@bot.command(name='invite_lobby', description='Invite a player to your lobby')
-async def invite_lobby(ctx, member: discord.Member):
-    """Invite a player to your lobby"""
+@bot.command(name='invite_lobby', description='Invite one or more players to your lobby')
+async def invite_lobby(ctx, members: commands.Greedy[discord.Member]):
+    """Invite players to your lobby; everyone mentioned is let in with one permission update"""
+    members = list(dict.fromkeys(members))
+    if not members:
+        await ctx.send("❌ Mention at least one player to invite, e.g. `/invite_lobby @player`.")
+        return
     user_id = ctx.author.id
     if user_id not in user_sessions:
         await ctx.send("❌ You are not in any lobby.")
@@ -842,18 +3061,48 @@ async def invite_lobby(ctx, member: discord.Member):
         await ctx.send("❌ Your lobby channel no longer exists.")
         return
     lobby = active_lobbies.get(channel_id)
-    if lobby and member.id in lobby['players']:
-        await ctx.send(f"❌ {member.mention} is already in this lobby.")
-        return
-    if lobby and len(lobby['players']) >= 3:
-        await ctx.send("❌ This lobby is full! (3/3 players)")
-        return
     if lobby:
-        lobby['players'].append(member.id)
-    user_sessions[member.id] = channel_id
-    await channel.set_permissions(member, read_messages=True, send_messages=True)
-    await channel.send(f"🎉 **{member.display_name}** was invited and joined the lobby! ({len(lobby['players']) if lobby else 'unknown'} players)")
-    await ctx.send(f"✅ Successfully invited {member.mention} to the lobby!")
+        for member in [m for m in members if m.id in lobby['players']]:
+            await ctx.send(f"❌ {member.mention} is already in this lobby.")
+            members.remove(member)
+        # Seats are claimed up front, so every grant below shares one overwrite edit
+        results = await asyncio.gather(
+            *(grant_seat(lobby, channel, member, reason='invited') for member in members), return_exceptions=True
+        )
+        invited = [member for member, result in zip(members, results) if not isinstance(result, BaseException)]
+        for member, result in zip(members, results):
+            if isinstance(result, SeatUnavailable):
+                await ctx.send(f"{result} ({member.mention} was not invited)")
+            elif isinstance(result, discord.Forbidden):
+                await ctx.send(f"❌ I don't have permission to add {member.mention} to this channel.")
+            elif isinstance(result, BaseException):
+                logger.error("Error inviting player: %s", result,
+                             extra={'lobby': channel_id, 'guild': channel.guild.id, 'command': 'invite_lobby', 'user': member.id})
+                await ctx.send(f"❌ An error occurred while inviting {member.mention}.")
+        player_count = len(lobby['players'])
+    else:
+        invited = members
+        seated = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+        try:
+            async with lobby_lock(channel_id):
+                await channel.edit(overwrites={**channel.overwrites, **{member: seated for member in invited}})
+        except discord.Forbidden:
+            await ctx.send("❌ I don't have permission to add players to this channel.")
+            return
+        except Exception as e:
+            logger.error("Error inviting players: %s", e,
+                         extra={'lobby': channel_id, 'guild': channel.guild.id, 'command': 'invite_lobby'})
+            await ctx.send("❌ An error occurred while inviting players.")
+            return
+        for member in invited:
+            user_sessions[member.id] = channel_id
+        player_count = 'unknown'
+    if not invited:
+        return
+    names = ', '.join(f"**{member.display_name}**" for member in invited)
+    verb = 'was' if len(invited) == 1 else 'were'
+    await channel.send(f"🎉 {names} {verb} invited and joined the lobby! ({player_count} players)")
+    await ctx.send(f"✅ Successfully invited {', '.join(member.mention for member in invited)} to the lobby!")
 
 @bot.command(name='lobbyhelp', description='Show all available lobby commands')
 async def lobby_help(ctx):
@@ -865,13 +3114,13 @@ async def lobby_help(ctx):
     )
     
     # Check if command is used in a lobby channel
-    if ctx.channel.name.startswith('lobby-'):
+    if is_lobby_channel(ctx.channel):
         embed.add_field(
             name="🎮 Lobby Commands",
             value=(
                 "`/leave_lobby` - Leave this lobby\n"
                 "`/end_lobby` - End the current lobby (owner/mod/role only)\n"
-                "`/invite_lobby @user` - Invite a player to this lobby\n"
+                "`/invite_lobby @user [@user ...]` - Invite players to this lobby\n"
                 "`/kick_lobby @user` - Kick a player from this lobby\n"
                 "`/find_match` - Find players to join your game"
             ),
@@ -886,6 +3135,7 @@ async def lobby_help(ctx):
                 "`/my_lobby` - Check your current lobby status\n"
                 "`/lobbies` - List all active lobbies\n"
                 "`/join_lobby <hash>` - Join a lobby using its hash\n"
+                "`/join_party @friend [@friend] [hash]` - Join a lobby together with friends\n"
                 "`/find_match` - Find players to join your game\n"
                 "`/help` or `/lobbyhelp` - See all commands"
             ),
@@ -905,6 +3155,7 @@ async def lobby_help(ctx):
     await ctx.send(embed=embed)
 
 @bot.command(name='join_lobby', description='Join a lobby using its hash')
+@coalesce_per_user
 async def join_lobby(ctx, lobby_hash: str):
     """Join a lobby by its hash"""
     try:
@@ -933,103 +3184,152 @@ async def join_lobby(ctx, lobby_hash: str):
                     await ctx.send("❌ That lobby no longer exists.", ephemeral=True)
                     return
                     
-                if ctx.author.id in lobby['players']:
-                    await ctx.send("❌ You are already in this lobby.", ephemeral=True)
-                    return
-                    
-                # Enforce the 3-player limit
-                if len(lobby['players']) >= 3:
-                    player_names = [bot.get_user(pid).display_name for pid in lobby['players']]
-                    await ctx.send(f"❌ This lobby is full! ({len(lobby['players'])}/3 players)\nPlayers in lobby: {', '.join(player_names)}", ephemeral=True)
-                    return
-                    
                 try:
-                    # Add player to lobby data
-                    lobby['players'].append(ctx.author.id)
-                    user_sessions[ctx.author.id] = channel.id
-                    
-                    # Set permissions
-                    await channel.set_permissions(ctx.author, read_messages=True, send_messages=True)
+                    # Claim the seat and set permissions
+                    player_count = await grant_seat(lobby, channel, ctx.author)
                     
                     # Send join message
-                    await channel.send(f"🎉 **{ctx.author.display_name}** joined the lobby! ({len(lobby['players'])}/3 players)")
+                    await channel.send(f"🎉 **{ctx.author.display_name}** joined the lobby! ({player_count}/{lobby_capacity(lobby)} players)")
                     
                     # Notify the user
                     await ctx.send(f"🎮 You've joined the lobby! Click here to go to the channel: {channel.mention}", ephemeral=True)
                     return
+                except LobbyFull as e:
+                    position = join_waitlist(lobby, ctx.author.id, ctx.channel.id)
+                    await ctx.send(full_lobby_message(e, channel.guild, lobby, position), ephemeral=True)
+                    return
+                except SeatUnavailable as e:
+                    await ctx.send(str(e), ephemeral=True)
+                    return
                 except discord.Forbidden:
                     await ctx.send("❌ I don't have permission to add you to this channel.", ephemeral=True)
                     return
                 except Exception as e:
-                    logger.error(f"Error joining lobby: {e}")
+                    logger.error("Error joining lobby: %s", e,
+                                 extra={'lobby': channel.id, 'guild': channel.guild.id, 'command': 'join_lobby'})
                     await ctx.send("❌ An error occurred while joining the lobby.", ephemeral=True)
                     return
 
-        # If not found in active_lobbies, search all text channels
-        for guild in bot.guilds:
-            for channel in guild.text_channels:
-                if not channel.name.startswith('lobby-'):
-                    continue
-                    
-                try:
-                    async for message in channel.history(limit=20):
-                        if message.author == bot.user and message.content and message.content.lower().startswith('lobby hash:'):
-                            if input_hash in message.content.lower():
-                                # Check if channel is full
-                                member_count = 0
-                                player_names = []
-                                for member in channel.members:
-                                    if channel.permissions_for(member).read_messages and not member.bot:
-                                        member_count += 1
-                                        player_names.append(member.display_name)
+        # If not found in active_lobbies, search the lobby channels we haven't restored
+        for channel in iter_lobby_channels(guild_id=ctx.guild.id):
+            if channel.id in active_lobbies:
+                continue
+
+            try:
+                async for message in channel.history(limit=20):
+                    if message.author == bot.user and message.content and message.content.lower().startswith('lobby hash:'):
+                        if input_hash in message.content.lower():
+                            max_players = hash_message_seats(message.content) or MAX_PLAYERS
+                            try:
+                                # Add to active_lobbies if not already there, so concurrent joiners all
+                                # claim seats against the same record and a full lobby has a waitlist
+                                lobby = active_lobbies.get(channel.id)
+                                if lobby is None:
+                                    players = [m.id for m in channel.members
+                                               if channel.permissions_for(m).read_messages and not m.bot]
+                                    lobby = {
+                                        'owner': players[0] if players else ctx.author.id,
+                                        'players': players,
+                                        'channel': channel.id,
+                                        'created_at': channel.created_at,
+                                        'hash': input_hash,
+                                        'hash_message_id': message.id,
+                                        'max_players': max_players,
+                                        'version': 0
+                                    }
+                                    register_lobby(lobby)
                                 
-                                if member_count >= 3:
-                                    await ctx.send(f"❌ This lobby is full! ({member_count}/3 players)\nPlayers in lobby: {', '.join(player_names)}", ephemeral=True)
-                                    return
-                                    
-                                try:
-                                    # Set permissions
-                                    await channel.set_permissions(ctx.author, read_messages=True, send_messages=True)
-                                    
-                                    # Add to active_lobbies if not already there
-                                    if channel.id not in active_lobbies:
-                                        active_lobbies[channel.id] = {
-                                            'owner': channel.members[0].id if channel.members else ctx.author.id,
-                                            'players': [m.id for m in channel.members if not m.bot],
-                                            'channel': channel.id,
-                                            'created_at': channel.created_at,
-                                            'hash': input_hash,
-                                            'hash_message_id': message.id
-                                        }
-                                    
-                                    # Add to user_sessions
-                                    user_sessions[ctx.author.id] = channel.id
-                                    
-                                    # Send join message
-                                    await channel.send(f"🎉 **{ctx.author.display_name}** joined the lobby! ({member_count + 1}/3 players)")
-                                    
-                                    # Notify the user
-                                    await ctx.send(f"🎮 You've joined the lobby! Click here to go to the channel: {channel.mention}", ephemeral=True)
-                                    return
-                                except discord.Forbidden:
-                                    await ctx.send("❌ I don't have permission to add you to this channel.", ephemeral=True)
-                                    return
-                                except Exception as e:
-                                    logger.error(f"Error joining lobby: {e}")
-                                    await ctx.send("❌ An error occurred while joining the lobby.", ephemeral=True)
-                                    return
-                except Exception as e:
-                    logger.error(f"Error searching channel {channel.name}: {e}")
-                    continue
-                    
+                                # Claim the seat and set permissions
+                                player_count = await grant_seat(lobby, channel, ctx.author)
+                                
+                                # Send join message
+                                await channel.send(f"🎉 **{ctx.author.display_name}** joined the lobby! ({player_count}/{lobby_capacity(lobby)} players)")
+                                
+                                # Notify the user
+                                await ctx.send(f"🎮 You've joined the lobby! Click here to go to the channel: {channel.mention}", ephemeral=True)
+                                return
+                            except LobbyFull as e:
+                                position = join_waitlist(lobby, ctx.author.id, ctx.channel.id)
+                                await ctx.send(full_lobby_message(e, channel.guild, lobby, position), ephemeral=True)
+                                return
+                            except SeatUnavailable as e:
+                                await ctx.send(str(e), ephemeral=True)
+                                return
+                            except discord.Forbidden:
+                                await ctx.send("❌ I don't have permission to add you to this channel.", ephemeral=True)
+                                return
+                            except Exception as e:
+                                logger.error("Error joining lobby: %s", e,
+                                             extra={'lobby': channel.id, 'guild': channel.guild.id, 'command': 'join_lobby'})
+                                await ctx.send("❌ An error occurred while joining the lobby.", ephemeral=True)
+                                return
+            except Exception as e:
+                logger.error("Error searching channel %s: %s", channel.name, e,
+                             extra={'lobby': channel.id, 'guild': channel.guild.id, 'command': 'join_lobby'})
+                continue
+                
         await ctx.send("❌ No lobby found with that hash.", ephemeral=True)
     except Exception as e:
-        logger.error(f"Unexpected error in join_lobby: {e}")
+        logger.exception("Unexpected error in join_lobby: %s", e, extra={'command': 'join_lobby'})
         await ctx.send("❌ An unexpected error occurred. Please try again.", ephemeral=True)
 
+@bot.command(name='join_party', description='Join a lobby together with one or two friends')
+@coalesce_per_user
+async def join_party(ctx, companions: commands.Greedy[discord.Member], lobby_hash: Optional[str] = None):
+    """Join a lobby as a party: everyone gets a seat in the same lobby, or nobody does"""
+    companions = [m for m in dict.fromkeys(companions) if m.id != ctx.author.id]
+    if not 1 <= len(companions) <= PARTY_MAX_COMPANIONS:
+        await ctx.send(f"❌ Mention 1 to {PARTY_MAX_COMPANIONS} friends to join with, e.g. `/join_party @friend`.", ephemeral=True)
+        return
+    party = [ctx.author] + companions
+    for member in party:
+        if member.bot:
+            await ctx.send(f"❌ {member.mention} is a bot and can't join a lobby.", ephemeral=True)
+            return
+        if member.id in user_sessions:
+            who = "You're" if member == ctx.author else f"{member.mention} is"
+            await ctx.send(f"❌ {who} already in a lobby. Leave it first with `/leave_lobby`.", ephemeral=True)
+            return
+
+    if lobby_hash:
+        input_hash = lobby_hash.strip().lower()
+        lobby = next((l for l in active_lobbies.values() if str(l['hash']).strip().lower() == input_hash), None)
+        if lobby is None:
+            await ctx.send("❌ No lobby found with that hash.", ephemeral=True)
+            return
+    else:
+        channel_id = find_lobby_with_seats(ctx.guild.id, len(party))
+        if channel_id is None:
+            await ctx.send(f"❌ No open lobby has {len(party)} free seats right now. "
+                           f"Try `/create_game` and `/invite_lobby` your friends.", ephemeral=True)
+            return
+        lobby = active_lobbies[channel_id]
+    channel = bot.get_channel(lobby['channel'])
+    if not channel:
+        await ctx.send("❌ That lobby no longer exists.", ephemeral=True)
+        return
+
+    try:
+        player_count = await grant_seats(lobby, channel, party, reason='party')
+    except SeatUnavailable as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
+    except discord.Forbidden:
+        await ctx.send("❌ I don't have permission to add your party to this channel.", ephemeral=True)
+        return
+    except Exception as e:
+        logger.error("Error joining lobby as a party: %s", e,
+                     extra={'lobby': channel.id, 'guild': channel.guild.id, 'command': 'join_party'})
+        await ctx.send("❌ An error occurred while joining the lobby.", ephemeral=True)
+        return
+    names = ', '.join(f"**{member.display_name}**" for member in party)
+    await channel.send(f"🎉 {names} joined the lobby as a party! ({player_count}/{lobby_capacity(lobby)} players)")
+    await ctx.send(f"🎮 Your party joined the lobby! Click here to go to the channel: {channel.mention}", ephemeral=True)
+
 @bot.command(name='find_match', description='Find players to join your game')
-async def find_match(ctx):
-    """Broadcast a request to join any available lobby"""
+@coalesce_per_user
+async def find_match(ctx, *, prefs: MatchFlags):
+    """Broadcast a request to join any available lobby, or queue for automatic matching"""
     user_id = ctx.author.id
     
     # Check if user is already in a session
@@ -1045,6 +3345,25 @@ async def find_match(ctx):
             # Clean up stale session
             del user_sessions[user_id]
         return
+
+    if prefs.auto:
+        entry = match_queue.get(user_id)
+        match_queue[user_id] = {
+            'user_id': user_id,
+            'guild': ctx.guild.id,
+            'channel': ctx.channel.id,
+            'queued_at': entry['queued_at'] if entry else datetime.utcnow(),
+            'prefs': {attr: normalize_attr(attr, getattr(prefs, attr)) for attr in MATCH_AFFINITY},
+        }
+        touch_state()
+        if not entry:
+            log_lobby_event('match_requested', guild=ctx.guild.id, user=user_id, via='matchmaker')
+        await ctx.send(
+            "🔎 You're in the matchmaking queue! You'll be placed in an open lobby as soon as a seat fits.\n"
+            "Use `/cancel_request` to leave the queue.",
+            ephemeral=True
+        )
+        return
     
     # Create the request embed
     embed = discord.Embed(
@@ -1060,16 +3379,17 @@ async def find_match(ctx):
     )
     
     # Send the request to all non-full lobbies
-    sent_count = 0
-    for channel_id, lobby_data in active_lobbies.items():
-        channel = bot.get_channel(channel_id)
-        if channel and len(lobby_data['players']) < 3:  # Only send to non-full lobbies
-            try:
-                await channel.send(embed=embed)
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Error sending match request to {channel.name}: {e}")
+    channels = [
+        channel for channel_id in guild_lobbies.get(ctx.guild.id, ())
+        if free_seats(active_lobbies[channel_id]) and (channel := bot.get_channel(channel_id))  # Only send to non-full lobbies
+    ]
+    if len(channels) > DEGRADED_FANOUT and skip_if_degraded('match request fan-outs', 'messages'):
+        # Fullest lobbies first: they need one more player the most
+        channels = sorted(channels, key=lambda c: len(active_lobbies[c.id]['players']), reverse=True)[:DEGRADED_FANOUT]
+    results = await run_rest_jobs('send', [{'channel_id': c.id, 'embed': embed.to_dict()} for c in channels])
+    sent_count = len(results) - log_batch_failures("sending match request to", channels, results, command='find_match')
     
+    log_lobby_event('match_requested', guild=ctx.guild.id, user=user_id, lobbies=sent_count)
     if sent_count == 0:
         await ctx.send("❌ No available lobbies found to send your request to.", ephemeral=True)
         return
@@ -1083,7 +3403,7 @@ async def find_match(ctx):
 @bot.command(name='allow', description='Allow a player to join your lobby')
 async def allow_player(ctx):
     """Allow a player to join your lobby"""
-    if not ctx.channel.name.startswith('lobby-'):
+    if not is_lobby_channel(ctx.channel):
         await ctx.send("❌ This command can only be used in lobby channels.", ephemeral=True)
         return
     
@@ -1117,17 +3437,8 @@ async def allow_player(ctx):
         await ctx.send("❌ This lobby is no longer active.", ephemeral=True)
         return
     
-    # Count actual members in channel
-    member_count = 0
-    for member in ctx.channel.members:
-        if (ctx.channel.permissions_for(member).read_messages and 
-            not member.bot and 
-            not member.guild_permissions.administrator and 
-            not member.guild_permissions.manage_channels):
-            member_count += 1
-    
-    if member_count >= 3:
-        await ctx.send("❌ This lobby is full! (3/3 players)", ephemeral=True)
+    if not free_seats(lobby):
+        await ctx.send(f"❌ This lobby is full! ({len(lobby['players'])}/{lobby_capacity(lobby)} players)", ephemeral=True)
         return
     
     # Add player to lobby
@@ -1149,15 +3460,10 @@ async def allow_player(ctx):
         await ctx.send(f"❌ {user.display_name} is already in another lobby.", ephemeral=True)
         return
     
-    # Add to lobby data
-    if user_id not in lobby['players']:
-        lobby['players'].append(user_id)
-    user_sessions[user_id] = ctx.channel.id
-    
-    # Add permissions
+    # Claim the seat and add permissions; the lobby may have filled while we fetched the member
     try:
-        await ctx.channel.set_permissions(user, read_messages=True, send_messages=True)
-        await ctx.channel.send(f"🎉 **{user.display_name}** was accepted and joined the lobby! ({member_count + 1}/3 players)")
+        player_count = await grant_seat(lobby, ctx.channel, user, reason='match')
+        await ctx.channel.send(f"🎉 **{user.display_name}** was accepted and joined the lobby! ({player_count}/{lobby_capacity(lobby)} players)")
         
         # Notify the user
         try:
@@ -1165,6 +3471,8 @@ async def allow_player(ctx):
         except:
             pass
         
+        log_lobby_event('match_accepted', ctx.channel.id, ctx.guild.id, user_id)
+        
         # Clean up the request
         if user_id in pending_requests:
             del pending_requests[user_id]
@@ -1173,16 +3481,19 @@ async def allow_player(ctx):
             del request_timeouts[request_id]
         
         await ctx.send("✅ Player has been added to the lobby!", ephemeral=True)
+    except SeatUnavailable as e:
+        await ctx.send(str(e), ephemeral=True)
     except discord.Forbidden:
         await ctx.send("❌ I don't have permission to add the player to this channel.", ephemeral=True)
     except Exception as e:
         await ctx.send(f"❌ Error adding player to the lobby: {str(e)}", ephemeral=True)
-        logger.error(f"Error in allow command: {str(e)}")
+        logger.error("Error in allow command: %s", e,
+                     extra={'lobby': ctx.channel.id, 'guild': ctx.guild.id, 'command': 'allow'})
 
 @bot.command(name='deny', description='Deny a player\'s request to join')
 async def deny_player(ctx):
     """Deny a player's request to join your lobby"""
-    if not ctx.channel.name.startswith('lobby-'):
+    if not is_lobby_channel(ctx.channel):
         await ctx.send("❌ This command can only be used in lobby channels.", ephemeral=True)
         return
     
@@ -1204,6 +3515,7 @@ async def deny_player(ctx):
             await user.send(f"❌ Your match request was denied by {ctx.channel.name}")
         except:
             pass
+    log_lobby_event('match_denied', ctx.channel.id, ctx.guild.id, request['user_id'])
     
     await ctx.send("✅ Match request denied.", ephemeral=True)
 
@@ -1211,6 +3523,11 @@ async def deny_player(ctx):
 async def cancel_request(ctx):
     """Cancel your pending match request"""
     user_id = ctx.author.id
+
+    if match_queue.pop(user_id, None):
+        touch_state()
+        await ctx.send("✅ You've left the matchmaking queue.", ephemeral=True)
+        return
     
     if user_id not in pending_requests:
         await ctx.send("❌ You don't have any pending match requests.", ephemeral=True)
@@ -1228,7 +3545,7 @@ async def cancel_request(ctx):
 async def kick_lobby(ctx, member: discord.Member):
     """Kick a player from your current lobby (anyone in the lobby can kick anyone)"""
     # Must be used in a lobby channel
-    if not ctx.channel.name.startswith('lobby-'):
+    if not is_lobby_channel(ctx.channel):
         await ctx.send("❌ This command can only be used in lobby channels.", ephemeral=True)
         return
     # Both must be in the channel
@@ -1241,12 +3558,10 @@ async def kick_lobby(ctx, member: discord.Member):
         return
     # Remove from lobby data
     lobby = active_lobbies.get(ctx.channel.id)
-    if lobby and member.id in lobby['players']:
-        lobby['players'].remove(member.id)
     if member.id in user_sessions:
         del user_sessions[member.id]
     try:
-        await ctx.channel.set_permissions(member, overwrite=None)
+        await revoke_seat(lobby, ctx.channel, member, reason='kicked')
         await ctx.channel.send(f"👢 **{member.display_name}** was kicked from the lobby by **{ctx.author.display_name}**.")
         try:
             await member.send(f"❌ You were kicked from the lobby {ctx.channel.mention} by {ctx.author.display_name}.")
@@ -1256,10 +3571,402 @@ async def kick_lobby(ctx, member: discord.Member):
     except Exception as e:
         await ctx.send(f"❌ Error kicking {member.display_name}: {str(e)}", ephemeral=True)
 
+def is_moderator(member):
+    perms = getattr(member, 'guild_permissions', None)
+    return bool(perms and (perms.administrator or perms.manage_channels))
+
+@bot.command(name='stats', description='Show lobby statistics for this hour and today')
+async def lobby_stats_command(ctx):
+    """Show hourly and daily lobby rollups from the live aggregator"""
+    embed = discord.Embed(title="📊 NightReign Lobby Stats", color=0x00ff00, timestamp=datetime.now())
+    for label, period in (("This Hour", 'hour'), ("Today (UTC)", 'day')):
+        counters = lobby_stats.rollup(period)
+        embed.add_field(
+            name=label,
+            value=(
+                f"Lobbies created: {counters.get('created', 0)}\n"
+                f"Joins: {counters.get('joined', 0)} · Leaves: {counters.get('left', 0)} · Kicks: {counters.get('kicked', 0)}\n"
+                f"Ended: {counters.get('ended', 0)} · Expired: {counters.get('expired', 0)}\n"
+                f"Fill rate: {format_rate(counters['fill_rate'])} · "
+                f"Time to full: {format_duration(counters['avg_time_to_full'])}\n"
+                f"Avg lifetime: {format_duration(counters['avg_lifetime'])}\n"
+                f"Match requests: {counters.get('match_requested', 0)} "
+                f"(accepted {counters.get('match_accepted', 0)}, denied {counters.get('match_denied', 0)}, "
+                f"success {format_rate(counters['match_success_rate'])})"
+            ),
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+def parse_duration(value):
+    """'90s', '30m', '2h', '1d' (or bare minutes) -> timedelta; None if it doesn't parse"""
+    match = re.fullmatch(r'(\d+)\s*([smhd]?)', value.strip().lower())
+    if not match:
+        return None
+    unit = {'s': 'seconds', 'm': 'minutes', '': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+    return timedelta(**{unit: int(match.group(1))})
+
+def parse_count_filter(value):
+    """'0', '<2', '>=1' -> predicate on a player count; None if it doesn't parse"""
+    match = re.fullmatch(r'(<=|>=|<|>|=)?\s*(\d+)', value.strip())
+    if not match:
+        return None
+    n = int(match.group(2))
+    return {
+        None: lambda c: c == n, '=': lambda c: c == n, '<': lambda c: c < n,
+        '<=': lambda c: c <= n, '>': lambda c: c > n, '>=': lambda c: c >= n,
+    }[match.group(1)]
+
+def select_lobby_channels(guild, older=None, idle=None, owner_id=None, players=None, tracked_only=True):
+    """Lobby channels in guild matching every given filter, oldest first"""
+    now = datetime.utcnow()
+    selected = []
+    for channel in iter_lobby_channels(guild_id=guild.id):
+        lobby = active_lobbies.get(channel.id)
+        if lobby is None and tracked_only:
+            continue
+        created = lobby['created_at'] if lobby else channel.created_at.replace(tzinfo=None)
+        last_active = lobby.get('last_activity', created) if lobby else created
+        if older is not None and now - created < older:
+            continue
+        if idle is not None and now - last_active < idle:
+            continue
+        if owner_id is not None and (lobby is None or lobby['owner'] != owner_id):
+            continue
+        if players is not None and not players(len(lobby['players']) if lobby else 0):
+            continue
+        selected.append((created, channel))
+    return [channel for _, channel in sorted(selected, key=lambda item: item[0])]
+
+async def run_bulk(items, operation, state):
+    """Run operation on every item with at most BULK_CONCURRENCY in flight.
+
+    Progress and per-item errors are kept in state ('done', 'errors') for the caller to report.
+    """
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                await operation(item)
+            except Exception as e:
+                state['errors'].append((item, e))
+        state['done'] += 1
+
+    await asyncio.gather(*(run(item) for item in items))
+
+def end_if_empty(lobby, channel):
+    """End a lobby whose last player just left; logged after that player's 'left'"""
+    if lobby and not lobby['players'] and active_lobbies.get(channel.id) is lobby:
+        unregister_lobby(channel.id)
+        log_lobby_event('ended', channel.id, channel.guild.id, reason='empty')
+
+def forget_lobby(channel):
+    lobby = active_lobbies.get(channel.id)
+    if lobby:
+        for pid in lobby['players']:
+            if user_sessions.get(pid) == channel.id:
+                del user_sessions[pid]
+        unregister_lobby(channel.id)
+    return lobby
+
+async def bulk_end(channel):
+    """Announce the end; the lobby is forgotten once bulk_delete has removed its channel"""
+    await submit_rest_job('send', channel_id=channel.id,
+                          content="🏁 **Session ended by a moderator.** Channel will be deleted shortly...")
+
+async def bulk_delete(channel, via='bulk'):
+    # A lobby whose channel could not be deleted stays tracked, so it is still swept and listed
+    await submit_rest_job('delete_channel', channel_id=channel.id, reason="Bulk lobby cleanup by a moderator")
+    lobby = forget_lobby(channel)
+    if lobby:
+        log_lobby_event('ended', channel.id, channel.guild.id, players=len(lobby['players']), via=via)
+
+async def bulk_purge(channel):
+    await bulk_delete(channel, via='purge')
+
+async def bulk_resync(channel):
+    """Rebuild a lobby's player list from the channel's current permission overwrites"""
+    lobby = active_lobbies.get(channel.id)
+    if lobby is None:
+        return
+    fresh = await channel.guild.fetch_channel(channel.id)
+    allowed = {
+        overwrite_member_id(target) for target, overwrite in fresh.overwrites.items()
+        if overwrite.read_messages and overwrite_member_id(target) is not None
+    }
+    players = [pid for pid in lobby['players'] if pid in allowed]
+    players += sorted(allowed.difference(players))
+    for pid in set(lobby['players']).difference(players):
+        if user_sessions.get(pid) == channel.id:
+            del user_sessions[pid]
+    for pid in players:
+        user_sessions[pid] = channel.id
+    if players != lobby['players']:
+        lobby['players'] = players
+        bump_version(lobby)
+        schedule_join_refresh(lobby)
+        schedule_promotion(lobby)
+
+def describe_bulk_target(channel, now):
+    lobby = active_lobbies.get(channel.id)
+    if lobby is None:
+        return f"{channel.mention} · untracked"
+    age = (now - lobby['created_at']).total_seconds()
+    idle = (now - lobby.get('last_activity', lobby['created_at'])).total_seconds()
+    return (f"{channel.mention} · {len(lobby['players'])}/{lobby_capacity(lobby)} · owner <@{lobby['owner']}> · "
+            f"age {format_duration(age)} · idle {format_duration(idle)}")
+
+class BulkFlags(commands.FlagConverter):
+    older: Optional[str] = None
+    idle: Optional[str] = None
+    owner: Optional[discord.Member] = None
+    players: Optional[str] = None
+    confirm: bool = False
+
+@bot.command(name='bulk', description='End, purge or re-sync many lobbies at once (moderators only)')
+async def bulk_command(ctx, action: str, *, filters: BulkFlags):
+    """Bulk lobby operations, e.g. /bulk end idle: 2h players: <2 confirm: yes (previews without confirm)"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can run bulk operations.", ephemeral=True)
+        return
+    action = action.lower()
+    if action not in ('end', 'purge', 'resync'):
+        await ctx.send("❌ Action must be `end`, `purge` or `resync`.", ephemeral=True)
+        return
+
+    older = parse_duration(filters.older) if filters.older else None
+    idle = parse_duration(filters.idle) if filters.idle else None
+    players = parse_count_filter(filters.players) if filters.players else None
+    if (filters.older and older is None) or (filters.idle and idle is None) or (filters.players and players is None):
+        await ctx.send("❌ Use durations like `30m`, `2h`, `1d` and player counts like `0`, `<2`, `>=3`.", ephemeral=True)
+        return
+    channels = select_lobby_channels(ctx.guild, older, idle, filters.owner.id if filters.owner else None, players,
+                                     tracked_only=action != 'purge')
+    if ctx.channel in channels:
+        channels.remove(ctx.channel)  # Keep the channel we report progress in
+
+    if not channels:
+        await ctx.send("✅ No lobbies match those filters.", ephemeral=True)
+        return
+    if not filters.confirm:
+        now = datetime.utcnow()
+        lines = [describe_bulk_target(channel, now) for channel in channels[:BULK_PREVIEW]]
+        if len(channels) > BULK_PREVIEW:
+            lines.append(f"…and {len(channels) - BULK_PREVIEW} more")
+        embed = discord.Embed(
+            title=f"🧹 Dry run: {action} {len(channels)} lobbies",
+            description="\n".join(lines),
+            color=0xffa500
+        )
+        embed.set_footer(text="Nothing was changed. Re-run with confirm: yes to apply.")
+        await ctx.send(embed=embed, ephemeral=True)
+        return
+
+    state = {'done': 0, 'errors': []}
+    total = len(channels)
+    status = await ctx.send(f"⏳ {action}: 0/{total} lobbies…")
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(BULK_PROGRESS_INTERVAL)
+            await status.edit(content=f"⏳ {action}: {state['done']}/{total} lobbies…")
+
+    reporter = asyncio.create_task(report_progress())
+    started = time.perf_counter()
+    try:
+        if action == 'end':
+            await run_bulk(channels, bulk_end, state)
+            await asyncio.sleep(BULK_END_GRACE)
+            failed = {channel for channel, _ in state['errors']}
+            state['done'] = 0
+            await run_bulk([c for c in channels if c not in failed], bulk_delete, state)
+        elif action == 'purge':
+            await run_bulk(channels, bulk_purge, state)
+        else:
+            await run_bulk(channels, bulk_resync, state)
+    finally:
+        reporter.cancel()
+
+    errors = state['errors']
+    logger.info("Bulk %s of %d lobbies finished in %.1fs with %d errors", action, total,
+                time.perf_counter() - started, len(errors), extra={'guild': ctx.guild.id, 'command': 'bulk'})
+    summary = f"✅ {action}: {total - len(errors)}/{total} lobbies done in {time.perf_counter() - started:.1f}s."
+    if errors:
+        summary += "\n" + "\n".join(f"• {getattr(c, 'name', c)}: {e}" for c, e in errors[:10])
+        if len(errors) > 10:
+            summary += f"\n…and {len(errors) - 10} more errors"
+    await status.edit(content=summary)
+
+@bot.command(name='stalls', description='Show event loop lag and the worst recent stalls (moderators only)')
+async def loop_stalls_command(ctx):
+    """Show loop lag percentiles and the longest recent stalls with their stacks"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can view loop stalls.", ephemeral=True)
+        return
+    pct = lag_percentiles()
+    embed = discord.Embed(title="🐢 Event Loop Lag", color=0xffa500, timestamp=datetime.now())
+    embed.add_field(
+        name=f"Lag over the last {len(loop_lag)} samples",
+        value=" · ".join(f"{k} {v * 1000:.1f}ms" for k, v in pct.items()) if pct else "No samples yet",
+        inline=False
+    )
+    for stall in sorted(loop_stalls, key=lambda s: s['lag'], reverse=True)[:5]:
+        stack = "".join(stall['stack'])[-900:] or "(no stack captured)"
+        embed.add_field(
+            name=f"{stall['lag'] * 1000:.0f}ms in {stall['activity'] or 'unknown'} at {stall['at']:%H:%M:%S} UTC",
+            value=f"```{stack}```",
+            inline=False
+        )
+    if not loop_stalls:
+        embed.set_footer(text=f"No stalls over {LAG_THRESHOLD * 1000:.0f}ms recorded")
+    await ctx.send(embed=embed)
+
+@bot.command(name='duplicates', description='Show duplicate commands absorbed per command (moderators only)')
+async def duplicates_command(ctx):
+    """Show how many repeats of each coalesced command were absorbed, in flight and just after"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can view duplicate commands.", ephemeral=True)
+        return
+    embed = discord.Embed(title="♻️ Duplicate Commands Absorbed", color=0x00ff00, timestamp=datetime.now())
+    embed.description = "\n".join(
+        f"`{name}`: {absorbed_duplicates[name, 'in flight']} in flight, "
+        f"{absorbed_duplicates[name, 'just finished']} just finished, of {calls} calls"
+        for name, calls in command_calls.most_common()
+    ) or "No coalesced commands have run yet"
+    embed.set_footer(text=f"Repeats within {IDEMPOTENCY_WINDOW}s of the same command in the same channel are absorbed")
+    await ctx.send(embed=embed, ephemeral=True)
+
+@bot.command(name='health', description='Show REST health per route class and paused background work (moderators only)')
+async def health_command(ctx):
+    """Show each route class's breaker, error rate and median latency over the last minute"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can view REST health.", ephemeral=True)
+        return
+    embed = discord.Embed(title="🩺 REST Health", color=0xffa500 if degraded(*rest_health) else 0x00ff00,
+                          timestamp=datetime.now())
+    now = time.monotonic()
+    for route, health in sorted(rest_health.items()):
+        outcomes = [o for o in health['outcomes'] if o[0] >= now - HEALTH_WINDOW]
+        if outcomes:
+            errors = sum(1 for _, _, ok in outcomes if not ok) / len(outcomes)
+            median = median_latency(outcomes)
+            stats = f"{len(outcomes)} calls · {errors:.0%} errors"
+            if median is not None:
+                stats += f" · median {median * 1000:.0f}ms"
+        else:
+            stats = "No calls in the last minute"
+        if health['state'] == 'open':
+            stats += f"\nPaused for another {max(0, health['reopen_at'] - now):.0f}s"
+        embed.add_field(name=f"{route}: {health['state']}", value=stats, inline=False)
+    if degraded_skips:
+        embed.add_field(name="Skipped or cut down while degraded",
+                        value="\n".join(f"{name}: {count}" for name, count in degraded_skips.most_common()), inline=False)
+    if not rest_health:
+        embed.description = "No REST calls recorded yet."
+    await ctx.send(embed=embed)
+
+@bot.command(name='memory', description='Show memory use per in-memory structure and evicted entries (moderators only)')
+async def memory_command(ctx):
+    """Show resident memory against the budget and the approximate size of each tracked structure"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can view memory use.", ephemeral=True)
+        return
+    rss = process_rss()
+    embed = discord.Embed(title="🧠 Memory", color=0xffa500 if memory_over_budget else 0x00ff00, timestamp=datetime.now())
+    if rss is None:
+        embed.description = "Resident memory is not available on this platform."
+    else:
+        budget = f" of a {MEMORY_BUDGET_MB:.0f}MB budget" if MEMORY_BUDGET_MB else ""
+        embed.description = f"Resident memory: {rss / 2**20:.1f}MB{budget}"
+    rows = "\n".join(f"{name:<20}{entries:>8}{size / 1024:>9.1f}KB" for name, entries, size in memory_report()[:12])
+    embed.add_field(name="Largest structures (entries, approx. size)", value=f"```{rows}```", inline=False)
+    if evicted_entries or orphaned_since:
+        embed.add_field(
+            name="Orphaned entries",
+            value="\n".join([f"{name}: {count} evicted" for name, count in evicted_entries.most_common()]
+                            + [f"{len(orphaned_since)} waiting out the {ORPHAN_TTL // 60}m grace period"]),
+            inline=False
+        )
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        embed.add_field(name="tracemalloc", value=f"{current / 2**20:.1f}MB traced, peak {peak / 2**20:.1f}MB", inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='audit', description='Show what the background auditor checked and the drift it repaired (moderators only)')
+async def audit_command(ctx):
+    """Show drift rates per check and how long a full pass over every lobby takes"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can view the audit.", ephemeral=True)
+        return
+    embed = discord.Embed(title="🔍 Lobby Audit", color=0x00ff00, timestamp=datetime.now())
+    if not AUDIT_REST_BUDGET:
+        embed.description = "The auditor is disabled (`AUDIT_REST_BUDGET=0`)."
+        await ctx.send(embed=embed)
+        return
+    embed.description = (f"Budget {AUDIT_REST_BUDGET} REST calls/min · used {audit_rest_calls['read']} for reads "
+                         f"and {audit_rest_calls['repair']} for repairs so far")
+    embed.add_field(
+        name="Drift per check",
+        value="\n".join(
+            f"{check}: {audit_drift[check]} of {audit_checked[check]}"
+            + (f" ({audit_drift[check] / audit_checked[check]:.1%})" if audit_checked[check] else "")
+            for check in AUDIT_CHECKS
+        ),
+        inline=False
+    )
+    passes = f"In progress: {audit_pass['lobbies']} of {len(active_lobbies)} lobbies checked"
+    if last_audit_pass:
+        lobbies, seconds, drift = last_audit_pass
+        passes += f"\nLast full pass: {lobbies} lobbies in {format_duration(seconds)}, {drift} drifted"
+    embed.add_field(name="Passes", value=passes, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='profile', description='Profile a command or task for N runs or T seconds (moderators only)')
+async def profile_command(ctx, target: str, limit: str = '1'):
+    """Start or stop sampling a command or task, e.g. /profile lobbies 5 or /profile cleanup_inactive_lobbies 300s"""
+    if not is_moderator(ctx.author):
+        await ctx.send("❌ Only moderators can run the profiler.", ephemeral=True)
+        return
+    if target == 'off':
+        paths = [finish_profile_request(label) for label in list(profile_requests)]
+        await ctx.send(f"🛑 Profiler stopped. Wrote {len(paths)} profile(s) to `{PROFILE_DIR}`.", ephemeral=True)
+        return
+
+    command = bot.get_command(target)
+    if command is not None:
+        label = f"command:{command.qualified_name}"
+    elif isinstance(globals().get(target), tasks.Loop):
+        label = f"task:{target}"
+    else:
+        await ctx.send(f"❌ No command or task named `{target}`.", ephemeral=True)
+        return
+    if label in profile_requests:
+        await ctx.send(f"❌ `{target}` is already being profiled.", ephemeral=True)
+        return
+
+    match = re.fullmatch(r'(\d+)(s?)', limit.strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        await ctx.send("❌ Give a number of runs (e.g. `5`) or seconds (e.g. `300s`).", ephemeral=True)
+        return
+    count = int(match.group(1))
+    if match.group(2):
+        start_profile_request(label, seconds=count)
+        until = f"for {count}s"
+    else:
+        start_profile_request(label, invocations=count)
+        until = f"for the next {count} run(s)"
+    await ctx.send(f"🔬 Profiling `{target}` {until}. Profiles are written to `{PROFILE_DIR}`.", ephemeral=True)
+
 @bot.tree.command(name="help", description="Show all available commands")
 async def help_slash(interaction: discord.Interaction):
     ctx = await bot.get_context(interaction)
     await help_command(ctx)
 
 # Run the bot
-bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file
+if __name__ == '__main__':
+    mark_startup('import')
+    if STATE_DIR:
+        asyncio.run(run_with_standby(os.getenv('DISCORD_TOKEN')))
+    else:
+        bot.run(os.getenv('DISCORD_TOKEN'), log_handler=None)
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""Lobby event log parsing and the hourly/daily stats rollups built from it.
+
+Kept free of side effects so offline tools like rebuild_stats.py can import it
+without bot.py's logging handlers, listener threads and Discord client.
+"""
+import gzip
+import json
+import os
+import time
+from collections import OrderedDict
+
+# Lobby stats: hourly and daily rollups kept this long
+STATS_HOURS_KEPT = 48
+STATS_DAYS_KEPT = 30
+DEFAULT_MAX_PLAYERS = 3  # Lobby size for 'joined' events logged before max_players was recorded
+
+
+class LobbyStats:
+    """Incrementally maintained hourly and daily rollups of lobby events.
+
+    Feed it every event once with record(); rollup() then answers in O(1).
+    The same class rebuilds the aggregates offline from the event log.
+    """
+    def __init__(self):
+        self.hourly = OrderedDict()  # hour start (epoch seconds) -> counters
+        self.daily = OrderedDict()  # day start (epoch seconds) -> counters
+        self.lobby_created = {}  # lobby id -> created timestamp, for lobbies still open
+        self.lobby_filled = set()  # lobby ids that have been full at least once
+
+    def _bucket(self, buckets, start, keep):
+        counters = buckets.get(start)
+        if counters is None:
+            counters = buckets[start] = {}
+            while len(buckets) > keep:
+                buckets.popitem(last=False)
+        return counters
+
+    def _add(self, ts, key, amount=1):
+        day = int(ts // 86400 * 86400)
+        if day not in self.daily:
+            # Lobbies we never saw end (e.g. lost across a restart) shouldn't pile up
+            cutoff = ts - STATS_DAYS_KEPT * 86400
+            self.lobby_created = {lid: created for lid, created in self.lobby_created.items() if created >= cutoff}
+            self.lobby_filled &= set(self.lobby_created)
+        for buckets, size, keep in ((self.hourly, 3600, STATS_HOURS_KEPT), (self.daily, 86400, STATS_DAYS_KEPT)):
+            counters = self._bucket(buckets, int(ts // size * size), keep)
+            counters[key] = counters.get(key, 0) + amount
+
+    def record(self, event):
+        ts = event['ts']
+        kind = event['e']
+        lobby_id = event.get('lobby')
+        self._add(ts, kind)
+        if kind == 'created':
+            self.lobby_created[lobby_id] = ts
+        elif kind == 'joined':
+            if event.get('players', 0) >= event.get('max_players', DEFAULT_MAX_PLAYERS) and lobby_id not in self.lobby_filled:
+                self.lobby_filled.add(lobby_id)
+                self._add(ts, 'filled')
+                created = self.lobby_created.get(lobby_id)
+                if created is not None:
+                    self._add(ts, 'time_to_full_total', ts - created)
+                    self._add(ts, 'time_to_full_count')
+        elif kind in ('ended', 'expired'):
+            self.lobby_filled.discard(lobby_id)
+            created = self.lobby_created.pop(lobby_id, None)
+            if created is not None:
+                self._add(ts, 'lifetime_total', ts - created)
+                self._add(ts, 'lifetime_count')
+
+    def rollup(self, period='hour', ts=None):
+        """Counters and derived rates for the hour or day containing ts"""
+        ts = time.time() if ts is None else ts
+        buckets, size = (self.hourly, 3600) if period == 'hour' else (self.daily, 86400)
+        counters = dict(buckets.get(int(ts // size * size), {}))
+
+        def ratio(num, den):
+            return counters.get(num, 0) / counters[den] if counters.get(den) else None
+        counters['fill_rate'] = ratio('filled', 'created')
+        counters['match_success_rate'] = ratio('match_accepted', 'match_requested')
+        counters['avg_lifetime'] = ratio('lifetime_total', 'lifetime_count')
+        counters['avg_time_to_full'] = ratio('time_to_full_total', 'time_to_full_count')
+        return counters
+
+
+def read_lobby_events(path):
+    """Yield events from a lobby event log and its gzipped rotations, oldest first"""
+    rotated = []
+    while os.path.exists(f"{path}.{len(rotated) + 1}.gz"):
+        rotated.append(f"{path}.{len(rotated) + 1}.gz")
+    for name in reversed(rotated):
+        with gzip.open(name, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def rebuild_lobby_stats(path, until=None):
+    """LobbyStats of every logged event, or only those before the epoch time until"""
+    stats = LobbyStats()
+    for event in read_lobby_events(path):
+        if until is None or event['ts'] < until:
+            stats.record(event)
+    return stats
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "—"
+    minutes = int(seconds // 60)
+    return f"{minutes // 60}h {minutes % 60}m" if minutes >= 60 else f"{minutes}m"
+
+
+def format_rate(rate):
+    return "—" if rate is None else f"{rate:.0%}"
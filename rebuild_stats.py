@@ -0,0 +1,40 @@
+"""Rebuild lobby stats offline from the lobby event log (including gzipped rotations).
+
+    python rebuild_stats.py [lobby_events.log] [--days 7]
+"""
+import argparse
+import os
+import time
+
+import lobby_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default=os.getenv('LOBBY_EVENT_LOG') or 'lobby_events.log')
+    parser.add_argument('--days', type=int, default=7, help="Number of daily rollups to print")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = lobby_events.rebuild_lobby_stats(args.path)
+    elapsed = time.perf_counter() - started
+    events = sum(counters.get(kind, 0) for counters in stats.daily.values()
+                 for kind in ('created', 'joined', 'left', 'kicked', 'ended', 'expired',
+                              'match_requested', 'match_accepted', 'match_denied'))
+    print(f"Rebuilt stats from {events} events in {elapsed:.2f}s")
+
+    for day in list(stats.daily)[-args.days:]:
+        counters = stats.rollup('day', day)
+        print(
+            f"{time.strftime('%Y-%m-%d', time.gmtime(day))}  "
+            f"created {counters.get('created', 0):>5}  joined {counters.get('joined', 0):>5}  "
+            f"expired {counters.get('expired', 0):>5}  "
+            f"fill {lobby_events.format_rate(counters['fill_rate']):>4}  "
+            f"to-full {lobby_events.format_duration(counters['avg_time_to_full']):>7}  "
+            f"lifetime {lobby_events.format_duration(counters['avg_lifetime']):>7}  "
+            f"match {lobby_events.format_rate(counters['match_success_rate']):>4}"
+        )
+
+
+if __name__ == '__main__':
+    main()
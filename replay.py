@@ -0,0 +1,562 @@
+"""Replay a session recorded with RECORD_EVENTS through bot.py's handlers.
+
+The bot runs against an in-memory stand-in for Discord: no gateway connection
+is made and every REST call the handlers would have issued is counted instead.
+
+    python replay.py events.log [--speed 60] [--rest-latency 0.05]
+
+--speed scales the recorded gaps between events (0 replays as fast as possible).
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the replay's events out of the real log
+
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import discord
+from discord.ext import commands
+
+import bot as nightlobby
+
+_real_sleep = asyncio.sleep
+_snowflakes = itertools.count(discord.utils.time_snowflake(datetime.now(timezone.utc)))
+
+
+def next_id():
+    return next(_snowflakes)
+
+
+class FakeREST:
+    """Counts the REST calls handlers make and optionally simulates their latency"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def call(self, route):
+        self.calls[route] += 1
+        if self.latency:
+            await _real_sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, world, user_id, name=None, is_bot=False):
+        self.world = world
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.display_name = self.name
+        self.global_name = self.name
+        self.bot = is_bot
+        self.mention = f"<@{user_id}>"
+        self.roles = []
+        self.guild_permissions = discord.Permissions.none()
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, *args, **kwargs):
+        await self.world.rest.call('dm_send')
+
+
+class FakeMember(FakeUser):
+    def __init__(self, world, guild, user_id, name=None, is_bot=False):
+        super().__init__(world, user_id, name, is_bot)
+        self.guild = guild
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content=None, embeds=None):
+        self.id = next_id()
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.embeds = embeds or []
+        self.created_at = discord.utils.snowflake_time(self.id)
+
+    async def edit(self, **kwargs):
+        await self.channel.world.rest.call('message_edit')
+        if 'embed' in kwargs:
+            self.embeds = [kwargs['embed']] if kwargs['embed'] else []
+
+    async def delete(self, **kwargs):
+        await self.channel.world.rest.call('message_delete')
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeCategory:
+    def __init__(self, guild, channel_id, name=None):
+        self.id = channel_id
+        self.guild = guild
+        self.name = name or f"category-{channel_id}"
+
+
+class FakeChannel:
+    def __init__(self, world, guild, channel_id, name, category_id=None):
+        self.world = world
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.category_id = category_id
+        self.mention = f"<#{channel_id}>"
+        self.overwrites = {}
+        self.messages = {}  # message id -> FakeMessage, oldest first
+        self.created_at = discord.utils.snowflake_time(channel_id)
+
+    @property
+    def category(self):
+        return self.guild.get_channel(self.category_id) if self.category_id else None
+
+    @property
+    def members(self):
+        return [m for m in self.guild.members if self.permissions_for(m).read_messages]
+
+    def permissions_for(self, member):
+        if member == self.world.user:
+            return discord.Permissions.all()
+        overwrite = self.overwrites.get(member)
+        allowed = bool(overwrite and overwrite.read_messages)
+        return discord.Permissions(read_messages=allowed, send_messages=allowed)
+
+    async def set_permissions(self, target, *, overwrite=discord.utils.MISSING, reason=None, **permissions):
+        await self.world.rest.call('channel_permissions')
+        if overwrite is None:
+            self.overwrites.pop(target, None)
+        elif overwrite is discord.utils.MISSING:
+            self.overwrites[target] = discord.PermissionOverwrite(**permissions)
+        else:
+            self.overwrites[target] = overwrite
+
+    async def edit(self, **kwargs):
+        await self.world.rest.call('channel_edit')
+        if 'overwrites' in kwargs:
+            self.overwrites = dict(kwargs['overwrites'])
+        if 'name' in kwargs:
+            self.name = kwargs['name']
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        await self.world.rest.call('message_send')
+        message = FakeMessage(self, self.world.user, content, [embed] if embed else None)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.world.rest.call('message_fetch')
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(_FakeResponse(404), 'Unknown Message')
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(self, self.world.user)
+
+    async def history(self, limit=100, **kwargs):
+        await self.world.rest.call('message_history')
+        for message in list(reversed(self.messages.values()))[:limit]:
+            yield message
+
+    async def delete(self, reason=None):
+        await self.world.rest.call('channel_delete')
+        self.guild.remove_channel(self)
+        self.world.dispatch('on_guild_channel_delete', self)
+
+
+class _FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'replay'
+
+
+class FakeRole:
+    def __init__(self, role_id, name='@everyone'):
+        self.id = role_id
+        self.name = name
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeGuild:
+    def __init__(self, world, guild_id, name=None):
+        self.world = world
+        self.id = guild_id
+        self.name = name or f"guild-{guild_id}"
+        self.default_role = FakeRole(guild_id)
+        self.shard_id = 0
+        self._channels = {}
+        self._members = {}
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def text_channels(self):
+        return [c for c in self._channels.values() if isinstance(c, FakeChannel)]
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+    def member(self, data):
+        """Get or create the member described by a recorded user entry"""
+        member = self._members.get(data['id'])
+        if member is None:
+            member = FakeMember(self.world, self, data['id'], data.get('name'), data.get('bot', False))
+            self._members[member.id] = member
+        return member
+
+    async def fetch_member(self, user_id):
+        await self.world.rest.call('member_fetch')
+        member = self._members.get(user_id)
+        if member is None:
+            raise discord.NotFound(_FakeResponse(404), 'Unknown Member')
+        return member
+
+    async def fetch_channel(self, channel_id):
+        await self.world.rest.call('channel_fetch')
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            raise discord.NotFound(_FakeResponse(404), 'Unknown Channel')
+        return channel
+
+    def add_channel(self, channel):
+        self._channels[channel.id] = channel
+        self.world.channels[channel.id] = channel
+        return channel
+
+    def remove_channel(self, channel):
+        self._channels.pop(channel.id, None)
+        self.world.channels.pop(channel.id, None)
+
+    async def create_text_channel(self, name, *, overwrites=None, category=None, reason=None, **kwargs):
+        await self.world.rest.call('channel_create')
+        channel = FakeChannel(self.world, self, next_id(), name, category.id if category else None)
+        channel.overwrites = dict(overwrites or {})
+        self.add_channel(channel)
+        self.world.dispatch('on_guild_channel_create', channel)
+        return channel
+
+
+class FakeContext:
+    def __init__(self, world, command, author, channel):
+        self.world = world
+        self.bot = nightlobby.bot
+        self.command = command
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.interaction = None
+        self.args = []
+        self.kwargs = {}
+
+    async def send(self, content=None, **kwargs):
+        await self.world.rest.call('message_send')
+        return FakeMessage(self.channel, self.world.user, content,
+                           [kwargs['embed']] if kwargs.get('embed') else None)
+
+
+class FakeInteractionResponse:
+    def __init__(self, world):
+        self.world = world
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, *args, **kwargs):
+        await self.world.rest.call('interaction_response')
+        self._done = True
+
+    async def edit_message(self, *args, **kwargs):
+        await self.world.rest.call('interaction_response')
+        self._done = True
+
+    async def defer(self, *args, **kwargs):
+        await self.world.rest.call('interaction_response')
+        self._done = True
+
+
+class FakeInteraction:
+    def __init__(self, world, custom_id, user, channel):
+        self.data = {'custom_id': custom_id, 'component_type': 2}
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id if channel else None
+        self.guild = channel.guild if channel else None
+        self.message = None
+        self.response = FakeInteractionResponse(world)
+        self.followup = FakeContext(world, None, user, channel) if channel else None
+
+
+class FakeWorld:
+    """The slice of Discord that bot.py touches, kept in memory"""
+    def __init__(self, rest):
+        self.rest = rest
+        self.user = FakeUser(self, 1, 'NightLobby', is_bot=True)
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+
+    def guild(self, guild_id, name=None):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = FakeGuild(self, guild_id, name)
+            guild._members[self.user.id] = FakeMember(self, guild, self.user.id, self.user.name, True)
+        return guild
+
+    def channel(self, data):
+        """Get or create the channel described by a recorded channel entry"""
+        if data is None:
+            return None
+        channel = self.channels.get(data['id'])
+        if channel is None:
+            guild = self.guild(data['guild'])
+            if data.get('cat') and not guild.get_channel(data['cat']):
+                guild._channels[data['cat']] = FakeCategory(guild, data['cat'])
+            channel = guild.add_channel(FakeChannel(self, guild, data['id'], data['name'], data.get('cat')))
+        return channel
+
+    def member(self, guild, data):
+        member = guild.member(data)
+        self.users[member.id] = member
+        return member
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def dispatch(self, event, *args):
+        handler = getattr(nightlobby, event, None)
+        if handler is not None:
+            asyncio.get_running_loop().create_task(handler(*args))
+
+    def install(self):
+        """Point the bot at this world instead of a gateway connection"""
+        client = nightlobby.bot
+        client._connection.user = self.user
+        client._connection._guilds = self.guilds
+        client.get_channel = self.get_channel
+        client.get_user = self.get_user
+
+    def load_ready(self, event):
+        for guild_data in event.get('guilds', []):
+            guild = self.guild(guild_data['id'], guild_data.get('name'))
+            for category_id in guild_data.get('categories', []):
+                guild._channels[category_id] = FakeCategory(guild, category_id)
+            for channel_data in guild_data.get('channels', []):
+                self.channel(channel_data)
+        for lobby in event.get('lobbies', []):
+            channel = self.get_channel(lobby['channel'])
+            if channel is None:
+                continue
+            for pid in lobby['players']:
+                member = self.member(channel.guild, {'id': pid})
+                channel.overwrites[member] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+            hash_message = FakeMessage(channel, self.user, f"Lobby Hash: `{lobby['hash']}`")
+            hash_message.id = lobby['hash_message_id']
+            channel.messages[hash_message.id] = hash_message
+            nightlobby.register_lobby({
+                'owner': lobby['owner'],
+                'players': list(lobby['players']),
+                'channel': channel.id,
+                'created_at': datetime.utcnow(),
+                'hash': lobby['hash'],
+                'hash_message_id': lobby['hash_message_id'],
+            })
+            for pid in lobby['players']:
+                nightlobby.user_sessions[pid] = channel.id
+        nightlobby.build_lobby_channel_index()
+
+
+def read_events(path):
+    """Yield recorded events across rotated files, oldest first"""
+    backups = sorted(glob.glob(f"{glob.escape(path)}.*"), key=lambda p: int(p.rsplit('.', 1)[1]), reverse=True)
+    for name in backups + [path]:
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def default_flags(converter):
+    flags = converter.__new__(converter)
+    for flag in converter.get_flags().values():
+        setattr(flags, flag.attribute, None if flag.default is discord.utils.MISSING else flag.default)
+    return flags
+
+
+def convert_arg(world, guild, value, param=None):
+    if isinstance(value, dict) and 'member' in value:
+        return world.member(guild, value['member'])
+    if isinstance(value, dict) and 'flags' in value and param is not None:
+        flags = default_flags(param.converter)
+        for name, flag_value in value['flags'].items():
+            setattr(flags, name, convert_arg(world, guild, flag_value))
+        return flags
+    if isinstance(value, list):
+        return [convert_arg(world, guild, v) for v in value]
+    return value
+
+
+async def handle(world, event):
+    kind = event['e']
+    if kind == 'message':
+        channel = world.channel(event['channel'])
+        author = world.member(channel.guild, event['author']) if channel else world.user
+        message = FakeMessage(channel, author, event['content'])
+        if channel is not None:
+            channel.messages[message.id] = message
+        await nightlobby.on_message(message)
+    elif kind == 'command':
+        command = nightlobby.bot.get_command(event['name'])
+        channel = world.channel(event['channel'])
+        if command is None or channel is None:
+            return
+        ctx = FakeContext(world, command, world.member(channel.guild, event['author']), channel)
+        ctx.args = [ctx] + [convert_arg(world, channel.guild, a) for a in event['args']]
+        ctx.kwargs = {
+            k: convert_arg(world, channel.guild, v, command.clean_params.get(k))
+            for k, v in event['kwargs'].items()
+        }
+        for name, param in command.clean_params.items():
+            # Sessions recorded before a command grew flags have no value for them
+            if name not in ctx.kwargs and isinstance(param.converter, type) and issubclass(param.converter, commands.FlagConverter):
+                ctx.kwargs[name] = default_flags(param.converter)
+        await command.callback(*ctx.args, **ctx.kwargs)
+    elif kind == 'interaction':
+        channel = world.channel(event['channel'])
+        user = world.member(channel.guild, event['user']) if channel else FakeUser(world, event['user']['id'])
+        interaction = FakeInteraction(world, event['custom_id'], user, channel)
+        await nightlobby.on_interaction(interaction)
+        # Same routing the view store does for the dynamic items added in setup_hook
+        for item_cls in nightlobby.JOIN_BUTTONS:
+            match = item_cls.__discord_ui_compiled_template__.fullmatch(event['custom_id'])
+            if match:
+                item = await item_cls.from_custom_id(interaction, None, match)
+                await item.callback(interaction)
+                break
+    elif kind == 'member_join':
+        guild = world.guild(event['guild'])
+        await nightlobby.on_member_join(world.member(guild, event['member']))
+    elif kind == 'task':
+        loop = getattr(nightlobby, event['name'], None)
+        if loop is not None:
+            await loop.coro()
+
+
+async def replay(path, speed, rest_latency, limit=None):
+    rest = FakeREST(rest_latency)
+    world = FakeWorld(rest)
+    world.install()
+    nightlobby.bot.process_commands = _noop  # Commands are replayed from their own events
+
+    async def scaled_sleep(delay, result=None):
+        return await _real_sleep(delay / speed if speed else 0, result)
+    asyncio.sleep = scaled_sleep
+
+    latencies = defaultdict(list)
+    errors = Counter()
+
+    async def run(event):
+        started = time.perf_counter()
+        try:
+            await handle(world, event)
+        except Exception as e:
+            errors[f"{event['e']}: {type(e).__name__}: {e}"] += 1
+        latencies[event_label(event)].append(time.perf_counter() - started)
+
+    pending = []
+    started = time.perf_counter()
+    first = None
+    for count, event in enumerate(read_events(path)):
+        if limit is not None and count >= limit:
+            break
+        if event['e'] == 'ready':
+            world.load_ready(event)
+            continue
+        if first is None:
+            first = event['t']
+        if speed:
+            delay = (event['t'] - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await _real_sleep(delay)
+        pending.append(asyncio.get_running_loop().create_task(run(event)))
+        await _real_sleep(0)
+    await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - started
+    return report(len(pending), elapsed, latencies, rest.calls, errors)
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def event_label(event):
+    if event['e'] in ('command', 'task'):
+        return f"{event['e']}:{event['name']}"
+    return event['e']
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(total, elapsed, latencies, rest_calls, errors):
+    lines = [f"Replayed {total} events in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f} events/s)", ""]
+    lines.append(f"{'handler':<36}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for label, values in sorted(latencies.items()):
+        lines.append(
+            f"{label:<36}{len(values):>8}{statistics.median(values) * 1000:>10.2f}"
+            f"{percentile(values, 0.95) * 1000:>10.2f}{max(values) * 1000:>10.2f}"
+        )
+    lines.append("")
+    lines.append(f"REST calls that would have been issued: {sum(rest_calls.values())}")
+    for route, count in rest_calls.most_common():
+        lines.append(f"  {route:<30}{count:>8}")
+    if errors:
+        lines.append("")
+        lines.append("Handler errors:")
+        for error, count in errors.most_common(20):
+            lines.append(f"  {count:>5}x {error}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help="Recorded event log (rotated .1, .2, ... files are read too)")
+    parser.add_argument('--speed', type=float, default=0, help="Replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument('--rest-latency', type=float, default=0.0, help="Simulated seconds per REST call")
+    parser.add_argument('--limit', type=int, help="Stop after this many events")
+    args = parser.parse_args()
+    print(asyncio.run(replay(args.path, args.speed, args.rest_latency, args.limit)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Soak test: days of simulated lobby churn on a virtual clock, checking that memory stays flat.
+
+    python soak.py [--days 7] [--warmup 2] [--users 2000] [--lobbies-per-hour 30] [--seed 1]
+
+Runs bot.py's commands and background tasks against replay.py's in-memory Discord. Every
+simulated minute players create, join, chat in, leave and end lobbies, queue for the
+matchmaker and click join buttons; some lobbies are abandoned for the inactivity sweep and
+some channels disappear without a delete event. The size of every tracked structure and the
+memory tracemalloc attributes to bot.py are sampled each simulated hour. Exits non-zero if the
+last day uses noticeably more than the first day after the warm-up, or if the run never
+created, joined, ended and (unless --no-evict) evicted anything, since flat memory means
+nothing then.
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the soak's events out of the real log
+
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+import bot as nightlobby
+import replay
+from replay import FakeContext, FakeInteraction, FakeMessage, FakeREST, FakeWorld, default_flags
+
+GUILDS = 3
+HISTORY_KEPT = 50  # Messages kept per fake channel
+SLACK_BYTES = 16 * 1024  # Growth below this is noise (rollup buckets, dict resizes)
+
+
+class VirtualClock:
+    """Wall and monotonic time for bot.py that only move when the soak loop advances them"""
+    def __init__(self):
+        self.start = datetime.now(timezone.utc)
+        self.elapsed = 0.0
+        self.monotonic_base = time.monotonic()
+
+    def utcnow(self):
+        return (self.start + timedelta(seconds=self.elapsed)).replace(tzinfo=None)
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+        # New channels and messages get snowflakes, and so created_at times, from the virtual clock
+        floor = discord.utils.time_snowflake(self.start + timedelta(seconds=self.elapsed))
+        replay._snowflakes = itertools.count(max(replay.next_id(), floor))
+
+    def install(self):
+        clock = self
+
+        class VirtualDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return clock.utcnow()
+
+            @classmethod
+            def now(cls, tz=None):
+                now = clock.utcnow().replace(tzinfo=timezone.utc)
+                return now.astimezone(tz) if tz else now.astimezone().replace(tzinfo=None)
+
+        class VirtualTime:
+            def __getattr__(self, name):
+                return getattr(time, name)
+
+            def monotonic(self):
+                return clock.monotonic_base + clock.elapsed
+
+            def time(self):
+                return clock.start.timestamp() + clock.elapsed
+
+        nightlobby.datetime = VirtualDatetime
+        nightlobby.time = VirtualTime()
+
+
+class MissingChannel:
+    """A channel deleted behind the bot's back, as REST sees it: every call is a 404"""
+    def __init__(self, world, channel_id):
+        self.world = world
+        self.id = channel_id
+
+    async def _gone(self, route):
+        await self.world.rest.call(route)
+        raise discord.NotFound(replay._FakeResponse(404), 'Unknown Channel')
+
+    async def history(self, limit=100, **kwargs):
+        await self._gone('message_history')
+        yield
+
+    async def send(self, *args, **kwargs):
+        await self._gone('message_send')
+
+    async def delete(self, reason=None):
+        await self._gone('channel_delete')
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.world = FakeWorld(FakeREST())
+        self.world.install()
+        nightlobby.bot.process_commands = replay._noop  # Commands are driven directly below
+        nightlobby.bot.get_partial_messageable = lambda channel_id, **kwargs: MissingChannel(self.world, channel_id)
+        category_ids = {gid: nightlobby.guild_config(gid)['lobby_category'] for gid in range(1, GUILDS + 1)}
+        self.world.load_ready({'guilds': [
+            {'id': gid, 'categories': [category_ids[gid]],
+             'channels': [{'id': replay.next_id(), 'name': 'general', 'cat': None, 'guild': gid}]}
+            for gid in range(1, GUILDS + 1)
+        ]})
+        self.general = {gid: self.world.guild(gid).text_channels[0] for gid in range(1, GUILDS + 1)}
+        self.members = [
+            self.world.member(self.world.guild(1 + i % GUILDS), {'id': 10_000 + i}) for i in range(args.users)
+        ]
+        self.chatty = {}  # lobby channel id -> False for lobbies that will be abandoned
+        self.ends_at = {}  # lobby channel id -> virtual seconds when its owner ends it
+        self.missed_deletes = 0
+        self.joins = 0
+
+    def idle_member(self, guild_id=None):
+        for _ in range(20):
+            member = self.rng.choice(self.members)
+            if (guild_id is None or member.guild.id == guild_id) and member.id not in nightlobby.user_sessions \
+                    and member.id not in nightlobby.match_queue and member.id not in nightlobby.user_waitlist:
+                return member
+        return None
+
+    async def run_command(self, command, member, channel, *args, **kwargs):
+        await command.callback(FakeContext(self.world, command, member, channel), *args, **kwargs)
+
+    async def join(self, member, channel_id, how):
+        if how == 'hash':
+            await self.run_command(nightlobby.join_lobby, member, self.general[member.guild.id],
+                                   lobby_hash=nightlobby.active_lobbies[channel_id]['hash'])
+        else:
+            interaction = FakeInteraction(self.world, f"lobby:join:{channel_id}", member, self.general[member.guild.id])
+            await nightlobby.join_from_button(interaction, channel_id)
+        if nightlobby.user_sessions.get(member.id) == channel_id:
+            self.joins += 1
+
+    def churn_problems(self):
+        """Why the run exercised too little to say anything about memory, if it did"""
+        problems = []
+        if not self.world.rest.calls['channel_create']:
+            problems.append("no lobbies were created")
+        if not self.joins:
+            problems.append("nobody joined a lobby")
+        if not self.world.rest.calls['channel_delete']:
+            problems.append("no lobby was ended or swept")
+        if self.missed_deletes and not self.args.no_evict and not sum(nightlobby.evicted_entries.values()):
+            problems.append(f"{self.missed_deletes} channels vanished but nothing was evicted")
+        return problems
+
+    async def minute(self, clock):
+        rng = self.rng
+        if rng.random() < self.args.lobbies_per_hour / 60:
+            member = self.idle_member()
+            if member:
+                await self.run_command(nightlobby.create_game, member, self.general[member.guild.id],
+                                       details=default_flags(nightlobby.CreateFlags))
+        for channel_id, lobby in list(nightlobby.active_lobbies.items()):
+            channel = self.world.get_channel(channel_id)
+            if channel is None:
+                continue
+            if channel_id not in self.chatty:
+                self.chatty[channel_id] = rng.random() > 0.2
+                self.ends_at[channel_id] = clock.elapsed + rng.uniform(20, 120) * 60
+            if self.chatty[channel_id] and lobby['players'] and rng.random() < 0.3:
+                author = channel.guild.get_member(rng.choice(lobby['players']))
+                message = FakeMessage(channel, author, "gg")
+                channel.messages[message.id] = message
+                await nightlobby.on_message(message)
+            if nightlobby.free_seats(lobby) and rng.random() < 0.1:
+                member = self.idle_member(channel.guild.id)
+                if member:
+                    await self.join(member, channel_id, 'hash' if rng.random() < 0.5 else 'button')
+            elif not nightlobby.free_seats(lobby) and rng.random() < 0.05:
+                member = self.idle_member(channel.guild.id)
+                if member:
+                    await self.run_command(nightlobby.join_lobby, member, self.general[channel.guild.id],
+                                           lobby_hash=lobby['hash'])
+            if len(lobby['players']) > 1 and rng.random() < 0.02:
+                leaver = channel.guild.get_member(rng.choice(lobby['players'][1:]))
+                await self.run_command(nightlobby.leave_lobby, leaver, channel)
+            if self.chatty[channel_id] and clock.elapsed >= self.ends_at[channel_id]:
+                owner = channel.guild.get_member(lobby['owner'])
+                await self.run_command(nightlobby.end_lobby, owner, channel)
+            elif rng.random() < self.args.missed_deletes_per_hour / 60 / max(1, len(nightlobby.active_lobbies)):
+                channel.guild.remove_channel(channel)  # No on_guild_channel_delete reaches the bot
+                self.missed_deletes += 1
+        if rng.random() < 0.2:
+            member = self.idle_member()
+            if member:
+                flags = default_flags(nightlobby.MatchFlags)
+                flags.auto = True
+                await self.run_command(nightlobby.find_match, member, self.general[member.guild.id], prefs=flags)
+        for channel_id in [c for c in self.chatty if c not in nightlobby.active_lobbies]:
+            del self.chatty[channel_id]
+            del self.ends_at[channel_id]
+        for channel in self.world.channels.values():
+            # History lives on Discord's side; only the newest messages matter to the bot
+            while len(channel.messages) > HISTORY_KEPT:
+                channel.messages.pop(next(iter(channel.messages)))
+
+        await nightlobby.cleanup_inactive_lobbies.coro()
+        await nightlobby.run_matchmaker.coro()
+        if not self.args.no_evict:
+            await nightlobby.evict_orphaned_state.coro()
+        for _ in range(5):
+            await replay._real_sleep(0)  # Let join refreshes, promotions and dispatched events run
+
+
+def sample(bot_file):
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, bot_file)])
+    return {name: size for name, _, size in nightlobby.memory_report()}, sum(s.size for s in snapshot.statistics('filename'))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--warmup', type=int, default=2, help="Days before the baseline (rollups fill up over 48h)")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--lobbies-per-hour', type=float, default=30)
+    parser.add_argument('--missed-deletes-per-hour', type=float, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed growth of the last day over the baseline")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-evict', action='store_true', help="Skip orphan eviction, to see what it prevents")
+    args = parser.parse_args()
+    if args.days <= args.warmup:
+        parser.error("--days must be greater than --warmup")
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    asyncio.sleep = lambda delay, result=None: replay._real_sleep(0, result)
+    clock = VirtualClock()
+    clock.install()
+    tracemalloc.start()
+    soak = Soak(args)
+
+    started = time.perf_counter()
+    daily = []
+    print(f"{'day':>4} {'lobbies':>8} {'sessions':>9} {'tracked KB':>11} {'bot.py KB':>10} {'evicted':>8}")
+    for day in range(1, args.days + 1):
+        samples = []
+        for hour in range(24):
+            for _ in range(60):
+                clock.advance(60)
+                await soak.minute(clock)
+            samples.append(sample(nightlobby.__file__))
+        structures = {name: sum(s[0][name] for s in samples) / len(samples) for name in samples[0][0]}
+        traced = sum(s[1] for s in samples) / len(samples)
+        daily.append((structures, traced))
+        print(f"{day:>4} {len(nightlobby.active_lobbies):>8} {len(nightlobby.user_sessions):>9} "
+              f"{sum(structures.values()) / 1024:>11.1f} {traced / 1024:>10.1f} "
+              f"{sum(nightlobby.evicted_entries.values()):>8}")
+
+    baseline, last = daily[args.warmup], daily[-1]
+    grew = [
+        (name, baseline[0][name], size) for name, size in last[0].items()
+        if size > baseline[0][name] * (1 + args.tolerance) + SLACK_BYTES
+    ]
+    if last[1] > baseline[1] * (1 + args.tolerance) + SLACK_BYTES:
+        grew.append(('bot.py allocations', baseline[1], last[1]))
+    print(f"\n{args.days} simulated days in {time.perf_counter() - started:.1f}s; "
+          f"{soak.world.rest.calls['channel_create']} lobbies created, {soak.joins} joins, "
+          f"{soak.missed_deletes} deleted without an event; evicted {dict(nightlobby.evicted_entries) or 'nothing'}")
+    problems = soak.churn_problems()
+    if problems:
+        print(f"Not enough churn to judge memory: {'; '.join(problems)}")
+        return 1
+    if grew:
+        print(f"Memory is not flat (day {args.warmup + 1} vs day {args.days}):")
+        for name, before, after in grew:
+            print(f"  {name:<24} {before / 1024:>9.1f}KB -> {after / 1024:>9.1f}KB")
+        return 1
+    print(f"Memory is flat: day {args.days} is within {args.tolerance:.0%} of day {args.warmup + 1}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,166 @@
+"""Stress test: hundreds of players joining and leaving a few lobbies at once, checking nobody is overbooked.
+
+    python stress_joins.py [--joiners 600] [--lobbies 20] [--rounds 3] [--rest-latency 0.02]
+
+Runs bot.py's join paths (hash, button and party joins) and leaves concurrently against
+replay.py's in-memory Discord, with jittered REST latency so permission edits overlap.
+Every seat change is checked as it happens, and once the run settles every lobby's
+players, the sessions and the channel overwrites are checked against each other.
+Exits non-zero on any violation.
+"""
+import os
+
+os.environ.setdefault('LOBBY_EVENT_LOG', '')  # Keep the stress run's events out of the real log
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+
+import bot as nightlobby
+import replay
+from replay import FakeContext, FakeInteraction, FakeREST, FakeWorld, default_flags
+
+GUILD = 1
+
+
+class JitteryREST(FakeREST):
+    """REST latency drawn uniformly from 0 to twice the mean, so concurrent calls finish out of order"""
+    def __init__(self, latency, rng):
+        super().__init__(latency)
+        self.rng = rng
+
+    async def call(self, route):
+        self.calls[route] += 1
+        if self.latency:
+            await replay._real_sleep(self.rng.uniform(0, 2 * self.latency))
+
+
+class Stress:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.world = FakeWorld(JitteryREST(args.rest_latency, self.rng))
+        self.world.install()
+        nightlobby.bot.process_commands = replay._noop
+        category = nightlobby.guild_config(GUILD)['lobby_category']
+        self.world.load_ready({'guilds': [{'id': GUILD, 'categories': [category], 'channels': [
+            {'id': replay.next_id(), 'name': 'general', 'cat': None, 'guild': GUILD}]}]})
+        self.guild = self.world.guild(GUILD)
+        self.general = self.guild.text_channels[0]
+        self.members = [self.world.member(self.guild, {'id': 10_000 + i}) for i in range(args.joiners + args.lobbies)]
+        self.overbooked = []
+        self.joins = 0
+        self.leaves = 0
+
+        bump_version = nightlobby.bump_version
+
+        def checked_bump(lobby):
+            # Every claim and release goes through here, so an overbooking can't slip by between checks
+            if len(lobby['players']) > nightlobby.lobby_capacity(lobby) or len(set(lobby['players'])) != len(lobby['players']):
+                self.overbooked.append((lobby['channel'], list(lobby['players'])))
+            return bump_version(lobby)
+        nightlobby.bump_version = checked_bump
+
+    async def run_command(self, command, member, channel, *args, **kwargs):
+        await command.callback(FakeContext(self.world, command, member, channel), *args, **kwargs)
+
+    async def create_lobbies(self):
+        for owner in self.members[:self.args.lobbies]:
+            flags = default_flags(nightlobby.CreateFlags)
+            flags.max_players = self.rng.choice((2, 3, 4, 6))
+            await self.run_command(nightlobby.create_game, owner, self.general, details=flags)
+
+    async def join(self, member):
+        lobby = self.rng.choice(list(nightlobby.active_lobbies.values()))
+        how = self.rng.random()
+        if how < 0.4:
+            await self.run_command(nightlobby.join_lobby, member, self.general, lobby_hash=lobby['hash'])
+        elif how < 0.8:
+            interaction = FakeInteraction(self.world, f"lobby:join:{lobby['channel']}", member, self.general)
+            await nightlobby.join_from_button(interaction, lobby['channel'])
+        else:
+            friend = self.rng.choice(self.members[self.args.lobbies:])
+            await self.run_command(nightlobby.join_party, member, self.general, [friend],
+                                   lobby['hash'] if self.rng.random() < 0.5 else None)
+        self.joins += 1
+
+    async def leave(self, member):
+        channel = self.world.get_channel(nightlobby.user_sessions.get(member.id))
+        if channel is not None:
+            await self.run_command(nightlobby.leave_lobby, member, channel)
+            self.leaves += 1
+
+    async def round(self):
+        joiners = self.members[self.args.lobbies:]
+        self.rng.shuffle(joiners)
+        work = [self.join(member) for member in joiners]
+        owners = set(self.members[:self.args.lobbies])
+        seated = [m for m in self.members if m.id in nightlobby.user_sessions and m not in owners]
+        work += [self.leave(member) for member in self.rng.sample(seated, len(seated) // 2)]
+        self.rng.shuffle(work)
+        await asyncio.gather(*work)
+
+    def check(self):
+        """Problems in the settled state, as readable strings"""
+        problems = [f"lobby {channel_id} went over capacity with {players}" for channel_id, players in self.overbooked]
+        seen = {}
+        for channel_id, lobby in nightlobby.active_lobbies.items():
+            players = lobby['players']
+            if len(players) > nightlobby.lobby_capacity(lobby):
+                problems.append(f"lobby {channel_id} has {len(players)}/{nightlobby.lobby_capacity(lobby)} players")
+            for pid in players:
+                if pid in seen:
+                    problems.append(f"player {pid} is seated in {seen[pid]} and {channel_id}")
+                seen[pid] = channel_id
+                if nightlobby.user_sessions.get(pid) != channel_id:
+                    problems.append(f"player {pid} in {channel_id} has session {nightlobby.user_sessions.get(pid)}")
+            channel = self.world.get_channel(channel_id)
+            allowed = {
+                nightlobby.overwrite_member_id(target) for target, overwrite in channel.overwrites.items()
+                if overwrite.read_messages and nightlobby.overwrite_member_id(target) is not None
+            }
+            if allowed != set(players):
+                problems.append(f"lobby {channel_id} lets in {sorted(allowed)} but seats {sorted(players)}")
+        for pid, channel_id in nightlobby.user_sessions.items():
+            if seen.get(pid) != channel_id:
+                problems.append(f"session of {pid} points at {channel_id} where they have no seat")
+        return problems
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--joiners', type=int, default=600)
+    parser.add_argument('--lobbies', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--rest-latency', type=float, default=0.02, help="Mean seconds per simulated REST call")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    stress = Stress(args)
+    await stress.create_lobbies()
+    seats = sum(nightlobby.lobby_capacity(lobby) for lobby in nightlobby.active_lobbies.values())
+    print(f"{args.joiners} joiners racing for {seats} seats in {len(nightlobby.active_lobbies)} lobbies")
+    started = time.perf_counter()
+    for number in range(1, args.rounds + 1):
+        await stress.round()
+        print(f"round {number}: {len(nightlobby.user_sessions)} seated, "
+              f"{sum(len(w) for w in nightlobby.lobby_waitlists.values())} waitlisted")
+    await asyncio.sleep(nightlobby.JOIN_REFRESH_DELAY + 4 * args.rest_latency)  # Promotions and refreshes settle
+    problems = stress.check()
+    print(f"\n{stress.joins} joins and {stress.leaves} leaves in {time.perf_counter() - started:.1f}s; "
+          f"{stress.world.rest.calls['channel_edit']} overwrite edits")
+    if problems:
+        print(f"{len(problems)} problems:")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        return 1
+    print("No lobby was overbooked and every seat, session and overwrite agrees")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))